@@ -4,7 +4,8 @@ analysis.py
 
 from lib.utils import Data
 from time import sleep
-from lib import processor
+from lib import processor, report, export
+from lib.cache import ResultCache
 
 import os
 import statistics as st
@@ -52,7 +53,7 @@ def gen_cl_height_plot(paths: str|list):
     if save:
         fig = os.path.join(paths,"Figures", 'cl-height.pdf')
     data_list = processor.get_data_list(paths)
-    processor.cl_height_plot(data_list, fig = fig,avg =True,fit = True, rpm_range = [0,12000])
+    processor.cl_height_plot(data_list, fig = fig,avg =True,fit = True, rpm_range = [0,12000], **get_rig(paths))
 
 def gen_3d_plot(paths: str|list):
     if save:
@@ -79,11 +80,29 @@ def gen_cl_height_multiple_plot(paths: str|list):
             fig = os.path.join(path, "Figures",f"cl-height_model_{model}.pdf")
             processor.cl_height_plot_multiple(data_lists,data_choice=[0], fig=fig, fit =True,avg=True,model=model)
 
-def test_data_extractor(paths: str|list):
-    data_lists = []
-    for path in paths:
-        data_lists.append(processor.get_data_list(path))
-    processor.extractor(data_lists)
+# render figures (see report.FIGURES) of the campaign in {path} into {path}/Figures, without showing them.
+# loads the campaign once, and skips figures whose inputs have not changed since they were last rendered.
+def gen_report(path: str, figures: list = None):
+    report.render(path, figures = figures, cache = processor.result_cache, rig = get_rig(path))
+
+# rig of each campaign, as columns of the export.
+# note that the second run of the 24cm drone is the correction run
+campaign_metadata = {'160mm_prop_spacing_4inch_prop':          {'prop_spacing': 16, 'prop_radius': 5.08, 'test_run': 1},
+                     '240mm_prop_spacing_4inch_prop':          {'prop_spacing': 24, 'prop_radius': 5.08, 'test_run': 1},
+                     '320mm_prop_spacing_4inch_prop':          {'prop_spacing': 32, 'prop_radius': 5.08, 'test_run': 1},
+                     '240mm_prop_spacing_4inch_prop_retest':   {'prop_spacing': 24, 'prop_radius': 5.08, 'test_run': 2},
+                     '120mm_prop_spacing_4inch_prop':          {'prop_spacing': 12, 'prop_radius': 5.08, 'test_run': 1}}
+
+# paths: folder(s) of campaigns of the same rig; the first is looked up.
+# return -> prop_spacing and prop_radius of the campaign, from campaign_metadata; empty if unknown.
+def get_rig(paths: str|list) -> dict:
+    path = paths if isinstance(paths, str) else paths[0]
+    metadata = campaign_metadata.get(os.path.basename(os.path.normpath(path)), {})
+    return {key: metadata[key] for key in ('prop_spacing', 'prop_radius') if key in metadata}
+
+# export rpm and lift of every frame, with the rig of its campaign, see export.export.
+def test_data_extractor(paths: str|list, name: str = 'temp/all_data.csv'):
+    export.export(paths, name, rows = 'frame', metadata = campaign_metadata)
 
 def test_comparison(paths: str|list):
     data_lists = []
@@ -107,6 +126,8 @@ if __name__ == '__main__':
 
     
     os.makedirs(os.path.join(path, "Figures"), exist_ok=True)
+    # reuse lift statistics of unchanged files across runs.
+    processor.result_cache = ResultCache(os.path.join(path, '.cache'))
     
     #gen_w2_norm_plots('../raw/snap/07-14/')
     #gen_w2_norm_plots(path) this is for sound processing and not in use
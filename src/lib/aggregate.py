@@ -0,0 +1,238 @@
+"""
+aggregate.py
+
+Vectorised group-by statistics over columnar frame data.
+
+Values are flat arrays, with an integer group label (0 <= label < n_groups) for each value.
+Every statistic is computed for all groups at once with NumPy reductions, instead of calling
+statistics.mean / stdev on a Python list per group. Results agree with the per-group
+computations up to floating point rounding.
+
+GroupTable holds the frames of get_result_by_batch in this form: one group per
+(height, timestamp, target_rpm), see processor.get_group_table.
+
+bootstrap_cl_by_batch estimates the uncertainty of CL by resampling frames within each group:
+each block of replicates is a matrix of frame indices, and the CL of every (replicate, batch)
+is computed at once by the same group-by reductions, with one group per (replicate, batch).
+"""
+
+import os
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+
+# return -> array [n_groups] of the number of values in each group.
+def group_count(groups: np.ndarray, n_groups: int) -> np.ndarray:
+    return np.bincount(groups, minlength = n_groups)
+
+# values: array [n] or [n, k]. Each column is treated separately.
+# return -> (mean, stdev, count) of each group, mean and stdev of shape [n_groups] or [n_groups, k].
+#   stdev is the sample standard deviation; nan for groups of fewer than 2 values.
+def group_mean_stdev(values: np.ndarray, groups: np.ndarray, n_groups: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    values = np.asarray(values, dtype = float)
+    count = group_count(groups, n_groups)
+    columns = values.reshape(len(values), -1).T
+
+    mean = list()
+    stdev = list()
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        for column in columns:
+            col_mean = np.bincount(groups, weights = column, minlength = n_groups) / count
+            dev = column - col_mean[groups]
+            ss = np.bincount(groups, weights = dev * dev, minlength = n_groups)
+            mean.append(col_mean)
+            stdev.append(np.where(count > 1, np.sqrt(ss / (count - 1)), np.nan))
+
+    shape = (n_groups, *values.shape[1:])
+    return np.column_stack(mean).reshape(shape), np.column_stack(stdev).reshape(shape), count
+
+# linear regression of y against x within each group, as scipy.stats.linregress does for each.
+# return -> (slope, intercept, rvalue, stderr), arrays [n_groups]. stderr is that of the slope.
+def group_linregress(x: np.ndarray, y: np.ndarray, groups: np.ndarray, n_groups: int) -> tuple:
+    x = np.asarray(x, dtype = float)
+    y = np.asarray(y, dtype = float)
+    count = group_count(groups, n_groups)
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        x_mean = np.bincount(groups, weights = x, minlength = n_groups) / count
+        y_mean = np.bincount(groups, weights = y, minlength = n_groups) / count
+        dx = x - x_mean[groups]
+        dy = y - y_mean[groups]
+        # average sums of square differences from the mean
+        ssxm = np.bincount(groups, weights = dx * dx, minlength = n_groups) / count
+        ssym = np.bincount(groups, weights = dy * dy, minlength = n_groups) / count
+        ssxym = np.bincount(groups, weights = dx * dy, minlength = n_groups) / count
+
+        degenerate = (ssxm == 0) | (ssym == 0)
+        r = np.where(degenerate,
+                     np.where(ssxym == 0, np.nan, 0.0),
+                     np.clip(ssxym / np.sqrt(ssxm * ssym), -1, 1))
+        slope = ssxym / ssxm
+        intercept = y_mean - slope * x_mean
+        # only two points: exact fit.
+        stderr = np.where(count == 2, 0.0, np.sqrt((1 - r**2) * ssym / ssxm / (count - 2)))
+
+    return slope, intercept, r, stderr
+
+
+# frames of get_result_by_batch in columnar form, after outlier filtering.
+# groups are ordered by batch (height, timestamp), then by mean target rpm, as in get_result_by_batch,
+# and the frames of each group are contiguous, in the order of the files they came from.
+@dataclass
+class GroupTable:
+    batches: list               # [(height, timestamp)], sorted.
+    group_batch: np.ndarray     # [G] index into batches of each group.
+    targets: list               # [G] target_rpm of each group.
+    group: np.ndarray           # [n] group of each frame.
+    rpm: np.ndarray             # [n] mean rpm of each frame.
+    total_mass: np.ndarray      # [n] total mass of each frame.
+    source: np.ndarray          # [n] index of the Data each frame came from, see processor.get_group_table.
+    index: np.ndarray           # [n] index of each frame in its Data.
+    keep: list                  # [G] boolean array of the frames kept by filtering, out of all frames of the group.
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    # return -> (count, rpm_mean, rpm_stdev, mass_mean, mass_stdev), arrays [G].
+    def get_stats(self) -> tuple:
+        mean, stdev, count = group_mean_stdev(np.column_stack((self.rpm, self.total_mass)), self.group, len(self))
+        return count, mean[:, 0], stdev[:, 0], mean[:, 1], stdev[:, 1]
+
+    # same as processor.lift_rpm on every batch.
+    # avg = True: one point per target rpm, of time-averaged mean rpm and total mass.
+    # return -> lift_by_batch: dict = (batch -> (x, y, xerr, yerr)) of lists.
+    def get_lift(self, avg: bool = True) -> dict:
+        if avg:
+            _, rpm_mean, rpm_stdev, mass_mean, mass_stdev = self.get_stats()
+            x, y, xerr, yerr = rpm_mean, np.abs(mass_mean), rpm_stdev, np.abs(mass_stdev)
+            point_batch = self.group_batch
+        else:
+            x, y = self.rpm, np.abs(self.total_mass)
+            xerr = yerr = np.zeros(len(x))
+            point_batch = self.group_batch[self.group]
+
+        # points of each batch are contiguous, as groups are ordered by batch.
+        ends = np.cumsum(np.bincount(point_batch, minlength = len(self.batches)))
+        return {batch: tuple(arr[end - cnt:end].tolist() for arr in (x, y, xerr, yerr))
+                for batch, end, cnt in zip(self.batches, ends, np.diff(ends, prepend = 0))}
+
+
+# lift of frames binned by peak frequency (w), by height, after outlier filtering within each (bin, height).
+# samples are ordered by bin, then by height, then in the order of the frames they came from,
+# such that the samples of each (bin, height) are contiguous. See processor.get_bin_table.
+@dataclass
+class BinTable:
+    heights: list               # [H] in order of first appearance.
+    endpoints: np.ndarray       # [B + 1] bin b is (endpoints[b], endpoints[b + 1]).
+    group: np.ndarray           # [n] bin * H + height index of each sample, sorted.
+    lift: np.ndarray            # [n] lift (total mass) of each sample.
+    count: np.ndarray           # [B, H] number of samples.
+    total: np.ndarray           # [B, H] sum of lift of samples.
+
+    # return -> (height, lift) of all samples in bin {b}, arrays [count[b].sum()].
+    def get_bin(self, b: int) -> tuple[np.ndarray, np.ndarray]:
+        n_heights = len(self.heights)
+        start, end = np.searchsorted(self.group, [b * n_heights, (b + 1) * n_heights])
+        return np.asarray(self.heights, dtype = float)[self.group[start:end] % n_heights], self.lift[start:end]
+
+    # return -> [B, H] mean lift of each (bin, height); nan where empty.
+    def get_mean(self) -> np.ndarray:
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            return self.total / self.count
+
+# CL (slope of lift against rpm^2) of each batch, by linear regression, for all batches at once.
+# lift_by_batch: dict = (batch -> (x, y, xerr, yerr)), see GroupTable.get_lift.
+# return -> cl_by_batch: dict = (batch -> (slope, stderr))
+def get_cl_by_batch(lift_by_batch: dict) -> dict:
+    if not lift_by_batch:
+        return dict()
+
+    counts = [len(lift[0]) for lift in lift_by_batch.values()]
+    x = np.concatenate([lift[0] for lift in lift_by_batch.values()])
+    y = np.concatenate([lift[1] for lift in lift_by_batch.values()])
+    groups = np.repeat(np.arange(len(counts)), counts)
+    slope, _, _, stderr = group_linregress(x ** 2, y, groups, len(counts))
+    return {batch: (float(slope[i]), float(stderr[i])) for i, batch in enumerate(lift_by_batch)}
+
+
+# maximum number of resampled values (replicates * frames) held at once by bootstrap_slopes.
+BOOTSTRAP_BLOCK_SIZE = 2**22
+
+# CL of each batch for {n_replicates} bootstrap replicates of the frames of a GroupTable.
+# frames are resampled with replacement within each group, so each group keeps its size.
+# group, rpm, total_mass, group_batch, n_batches: see GroupTable. group must be sorted.
+# avg: see GroupTable.get_lift.
+# seed: seed or numpy SeedSequence of the replicates.
+# Module-level, so that it can be run by worker processes.
+# return -> array [n_replicates, n_batches] of CL.
+def bootstrap_slopes(group: np.ndarray, rpm: np.ndarray, total_mass: np.ndarray, group_batch: np.ndarray,
+                     n_batches: int, n_replicates: int, seed = None, avg: bool = True) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    n = len(group)
+    n_groups = len(group_batch)
+    count = group_count(group, n_groups)
+    start = np.cumsum(count) - count
+    frame_start = start[group]
+    frame_count = count[group]
+
+    slopes = np.empty((n_replicates, n_batches))
+    block = max(BOOTSTRAP_BLOCK_SIZE // max(n, 1), 1)
+    for r0 in range(0, n_replicates, block):
+        r = min(block, n_replicates - r0)
+        # index matrix [r, n]: each frame position draws a frame of its own group.
+        index = frame_start + (rng.random((r, n)) * frame_count).astype(int)
+        offset = np.arange(r)[:, None]
+
+        if avg:
+            labels = (group + n_groups * offset).ravel()
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                x = np.bincount(labels, weights = rpm[index].ravel(), minlength = r * n_groups) / np.tile(count, r)
+                y = np.bincount(labels, weights = total_mass[index].ravel(), minlength = r * n_groups) / np.tile(count, r)
+            batch_labels = (group_batch + n_batches * offset).ravel()
+        else:
+            x = rpm[index].ravel()
+            y = total_mass[index].ravel()
+            batch_labels = (group_batch[group] + n_batches * offset).ravel()
+
+        slope, _, _, _ = group_linregress(x ** 2, np.abs(y), batch_labels, r * n_batches)
+        slopes[r0:r0 + r] = slope.reshape(r, n_batches)
+
+    return slopes
+
+# bootstrap confidence intervals of the CL of each batch of {table}, see bootstrap_slopes.
+# confidence: coverage of the (percentile) intervals.
+# workers: number of worker processes. None: one per CPU. 1: resample in this process.
+#   Results do not depend on workers for a given seed.
+# return -> cl_by_batch: dict = (batch -> (slope, stderr, lower, upper)), where slope is the CL of the
+#   data itself (see get_cl_by_batch), and stderr the standard deviation of the replicates.
+def bootstrap_cl_by_batch(table: GroupTable, n_replicates: int = 1000, confidence: float = 0.95, avg: bool = True,
+                          seed = None, workers: int = 1) -> dict:
+    if not 0 < confidence < 1:
+        raise ValueError(f'(E) aggregate::bootstrap_cl_by_batch: confidence must be in (0, 1), got {confidence}.')
+    if not len(table.batches):
+        return dict()
+
+    n_batches = len(table.batches)
+    args = (table.group, table.rpm, table.total_mass, table.group_batch, n_batches)
+    # fixed blocks, each with a seed of its own, so that results do not depend on how they are shared out.
+    block = max(BOOTSTRAP_BLOCK_SIZE // max(len(table.group), 1), 1)
+    sizes = [min(block, n_replicates - r0) for r0 in range(0, n_replicates, block)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(sizes) <= 1:
+        slopes = [bootstrap_slopes(*args, size, block_seed, avg) for size, block_seed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, len(sizes))) as executor:
+            futures = [executor.submit(bootstrap_slopes, *args, size, block_seed, avg) for size, block_seed in zip(sizes, seeds)]
+            slopes = [future.result() for future in futures]
+    slopes = np.concatenate(slopes)
+
+    stderr = np.std(slopes, axis = 0, ddof = 1)
+    lower, upper = np.percentile(slopes, [50 * (1 - confidence), 50 * (1 + confidence)], axis = 0)
+    cl_by_batch = get_cl_by_batch(table.get_lift(avg))
+    return {batch: (cl_by_batch[batch][0], float(stderr[i]), float(lower[i]), float(upper[i]))
+            for i, batch in enumerate(table.batches)}
@@ -0,0 +1,96 @@
+"""
+cache.py
+
+Persistent, content-addressed cache of processing results, kept as files in a folder.
+
+Results are keyed on the files they were computed from (path, mtime and size of each, in order)
+and on the processing parameters, so that a result is reused only as long as neither changes.
+Each result is a json-serialisable header with a dict of numpy arrays, saved as one .npz file.
+The folder is kept under a size limit by evicting the least recently used results.
+
+Usage:
+    cache = ResultCache('../.cache')
+    key = cache.get_key(files, heights = None, rpm_range = [0, 12000])
+    result = cache.get(key)         # None if missing
+    if result is None:
+        cache.put(key, header, arrays)
+"""
+
+import os, json, hashlib, zipfile
+import numpy as np
+
+
+class ResultCache:
+    # bump when the processing behind cached results changes, so that old results are not reused.
+    VERSION: int = 2
+    EXTENSION: str = 'npz'
+
+    # path: folder to keep results in. Created if it does not exist.
+    # max_size: limit of the total size of cached results, in bytes.
+    def __init__(self, path: str, max_size: int = 256 * 2**20):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok = True)
+
+    # files: paths to the input files, in the order they are processed.
+    # params: processing parameters. Must be json-serialisable.
+    # return -> key of the result computed from {files} with {params}.
+    def get_key(self, files: list, **params) -> str:
+        inputs = list()
+        for name in files:
+            stat = os.stat(name)
+            inputs.append([os.path.abspath(name), stat.st_mtime_ns, stat.st_size])
+
+        content = json.dumps({'version': self.VERSION, 'files': inputs, 'params': params}, sort_keys = True)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    # return -> (header, arrays) saved with {key}, or None if there is none.
+    def get(self, key: str) -> tuple[dict, dict]:
+        name = self.get_name(key)
+        try:
+            with np.load(name, allow_pickle = False) as file:
+                header = json.loads(str(file['header']))
+                arrays = {array_name: file[array_name] for array_name in file.files if array_name != 'header'}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):    # missing, or corrupt
+            return None
+
+        # mark as recently used.
+        os.utime(name)
+        return header, arrays
+
+    # save {header} and {arrays} with {key}, then evict old results beyond max_size.
+    def put(self, key: str, header: dict, arrays: dict = {}):
+        name = self.get_name(key)
+        temp_name = f'{name}.{os.getpid()}.tmp'
+        with open(temp_name, 'wb') as file:
+            np.savez_compressed(file, header = json.dumps(header), **arrays)
+        # atomic, so that readers never see a partial file.
+        os.replace(temp_name, name)
+        self.evict()
+
+    # remove least recently used results until the total size is within max_size.
+    def evict(self):
+        entries = list()
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.is_file() and entry.name.endswith('.' + self.EXTENSION):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            os.remove(name)
+            total -= size
+
+    # remove all results.
+    def clear(self):
+        self.max_size, max_size = 0, self.max_size
+        try:
+            self.evict()
+        finally:
+            self.max_size = max_size
+
+    def get_name(self, key: str) -> str:
+        return os.path.join(self.path, f'{key}.{self.EXTENSION}')
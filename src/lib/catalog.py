@@ -0,0 +1,185 @@
+"""
+catalog.py
+
+Persistent catalog of the Data files in a folder, kept as an SQLite database next to the data.
+
+For each file, the catalog records its name, mtime and size, its metadata (height, target_rpm,
+timestamp, platform, description), its number of frames and the shapes of its channels. Files can
+then be selected by metadata without opening any of them. The catalog is updated incrementally:
+only files that are new, or modified (by mtime and size) since they were last indexed, are opened.
+
+Usage:
+    files = Catalog('../raw/bf2').query(platform = 'betaflight-2', height_range = (10, 40), rpm_range = (None, 8000))
+or, to pass the selection to processor functions directly:
+    query = Query('../raw/bf2', platform = 'betaflight-2', height_range = (10, 40), rpm_range = (None, 8000))
+    processor.lift_rpm2_plot(query)
+"""
+
+import os, json, sqlite3
+import statistics as st
+
+from dataclasses import dataclass
+from numbers import Number
+from datafile import DATA_EXTENSIONS
+from utils import Data
+
+
+class Catalog:
+    FILENAME: str = 'catalog.sqlite'
+    # bump when the table layout changes; outdated catalogs are rebuilt.
+    SCHEMA_VERSION: int = 1
+    COLUMNS: tuple = ('name', 'mtime', 'size',
+                      'height', 'target_rpm', 'mean_target_rpm', 'timestamp', 'platform', 'description',
+                      'n_frames', 'shapes')
+
+    # path: folder of Data files.
+    # recursive = True: also catalog files in subfolders (beware of e.g. converted copies).
+    # name: path to the database. Defaults to FILENAME in {path}.
+    def __init__(self, path: str, recursive: bool = False, name: str = None):
+        self.path = path
+        self.recursive = recursive
+        self.name = name if name is not None else os.path.join(path, self.FILENAME)
+        self.conn = sqlite3.connect(self.name)
+
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] != self.SCHEMA_VERSION:
+            self.conn.execute('DROP TABLE IF EXISTS files')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS files ('
+                          'name TEXT PRIMARY KEY, mtime REAL, size INTEGER, '
+                          'height REAL, target_rpm TEXT, mean_target_rpm REAL, timestamp REAL, '
+                          'platform TEXT, description TEXT, n_frames INTEGER, shapes TEXT)')
+        self.conn.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    # bring the catalog up to date with the folder.
+    # return -> (number of files (re)indexed, number of files removed)
+    def update(self) -> tuple[int, int]:
+        known = {name: (mtime, size)
+                 for name, mtime, size in self.conn.execute('SELECT name, mtime, size FROM files')}
+        seen = set()
+        indexed = 0
+
+        for entry in self.scan(self.path):
+            name = os.path.relpath(entry.path, self.path)
+            stat = entry.stat()
+            seen.add(name)
+            if known.get(name) == (stat.st_mtime, stat.st_size):
+                continue
+
+            print(f'Catalog::update: indexing {entry.path}')
+            self.conn.execute(f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * len(self.COLUMNS))})',
+                              self.index(entry.path, name, stat))
+            indexed += 1
+
+        removed = set(known) - seen
+        self.conn.executemany('DELETE FROM files WHERE name = ?', [(name,) for name in removed])
+        self.conn.commit()
+        return indexed, len(removed)
+
+    # select files by metadata. Filters that are None are not applied.
+    # platform: platform to match. SQL LIKE wildcards are allowed, e.g. 'betaflight%'.
+    # heights: height (float) or heights (float) to select.
+    # height_range, rpm_range: (lower, upper) limits of height and mean target rpm, inclusive.
+    #   Either limit can be None.
+    # update = True: update the catalog first.
+    # return -> list of paths to selected files, sorted by name.
+    def query(self, **kwargs) -> list:
+        return [os.path.join(self.path, entry['name']) for entry in self.entries(**kwargs)]
+
+    # same as query, but return -> list of catalog entries (column -> value) of selected files.
+    #   target_rpm and shapes are decoded from json.
+    def entries(self, platform: str = None, heights: Number|list = None,
+                height_range: tuple = None, rpm_range: tuple = None, update: bool = True) -> list:
+        if update:
+            self.update()
+
+        conditions = list()
+        params = list()
+        if platform is not None:
+            conditions.append('platform LIKE ?')
+            params.append(platform)
+
+        if heights is not None:
+            if isinstance(heights, Number):
+                heights = [heights]
+            conditions.append(f'height IN ({", ".join("?" * len(heights))})')
+            params.extend(heights)
+
+        for column, limits in (('height', height_range), ('mean_target_rpm', rpm_range)):
+            if limits is None:
+                continue
+            if limits[0] is not None:
+                conditions.append(f'{column} >= ?')
+                params.append(limits[0])
+            if limits[1] is not None:
+                conditions.append(f'{column} <= ?')
+                params.append(limits[1])
+
+        sql = f'SELECT {", ".join(self.COLUMNS)} FROM files'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY name'
+
+        entries = list()
+        for row in self.conn.execute(sql, params):
+            entry = dict(zip(self.COLUMNS, row))
+            entry['target_rpm'] = json.loads(entry['target_rpm'])
+            entry['shapes'] = json.loads(entry['shapes'])
+            entries.append(entry)
+
+        return entries
+
+    # return -> iterator of os.DirEntry of all Data files in {path}.
+    def scan(self, path: str):
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir() and self.recursive:
+                    yield from self.scan(entry.path)
+                elif entry.is_file() and entry.name.split('.')[-1] in DATA_EXTENSIONS:
+                    yield entry
+
+    # open a file to make its catalog entry.
+    # return -> row of values for COLUMNS.
+    @staticmethod
+    def index(path: str, name: str, stat: os.stat_result) -> tuple:
+        data = Data()
+        data.load(path)
+        target_rpm = data.target_rpm
+        mean_target_rpm = st.mean(target_rpm) if target_rpm else None
+        shapes = {key: list(data.get_channel(key).shape[1:]) for key in data.CHANNELS}
+        return (name, stat.st_mtime, stat.st_size,
+                data.height, json.dumps(target_rpm), mean_target_rpm, data.timestamp,
+                data.platform, data.description,
+                len(data.frames), json.dumps(shapes))
+
+
+# a selection of Data files from one or more catalogued folders, see Catalog.entries.
+# can be passed in place of paths / data_list to processor functions.
+@dataclass
+class Query:
+    paths: str|list
+    platform: str = None
+    heights: Number|list = None
+    height_range: tuple = None
+    rpm_range: tuple = None
+    recursive: bool = False
+
+    # return -> list of paths to selected files.
+    def get_files(self) -> list:
+        paths = [self.paths] if type(self.paths) is str else self.paths
+        files = list()
+        for path in paths:
+            with Catalog(path, recursive = self.recursive) as catalog:
+                files.extend(catalog.query(platform = self.platform,
+                                           heights = self.heights,
+                                           height_range = self.height_range,
+                                           rpm_range = self.rpm_range))
+        return files
@@ -0,0 +1,150 @@
+"""
+compare.py
+
+Comparison of CL against height between any number of runs, e.g. retests of the same rig.
+
+Each run is a curve of CL (with stderr) against height, see get_curve. compare_runs computes the offset
+between every pair of runs (i, j): the mean difference of CL of run j from run i, at the heights measured
+in run j that run i covers, with run i linearly interpolated there. Its uncertainty is propagated from the
+stderr of the measured CL, with the interpolation weights: points of run i shared by several heights of
+run j count as the same measurement. All runs are also interpolated onto a common height grid, to be
+plotted side by side.
+
+Usage:
+    curves = [get_curve(get_cl_by_batch(get_lift_by_batch(data_list))) for data_list in data_lists]
+    comparison = compare_runs(curves, labels = ['240mm', '240mm retest'])
+    print(comparison.format_table())
+"""
+
+import numpy as np
+
+from dataclasses import dataclass, field
+
+
+# cl_by_batch: dict = (batch -> (slope, stderr, ...)), see aggregate.get_cl_by_batch, where batch = (height, timestamp).
+# batches at the same height are averaged.
+# return -> (height, cl, stderr), arrays [n] sorted by height.
+def get_curve(cl_by_batch: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    height = np.array([batch[0] for batch in cl_by_batch], dtype = float)
+    cl = np.array([value[0] for value in cl_by_batch.values()], dtype = float)
+    stderr = np.array([value[1] for value in cl_by_batch.values()], dtype = float)
+
+    unique, inverse, count = np.unique(height, return_inverse = True, return_counts = True)
+    cl_mean = np.bincount(inverse, weights = cl, minlength = len(unique)) / count
+    stderr_mean = np.sqrt(np.bincount(inverse, weights = stderr ** 2, minlength = len(unique))) / count
+    return unique, cl_mean, stderr_mean
+
+# linear interpolation of a curve at {grid}: each grid point lies on the segment [left, right] of the
+#   curve, at weight w on the right end.
+# height: sorted heights of the curve, not empty.
+# return -> (left, right, w, inside), arrays of the shape of grid; inside: grid point within the range of height.
+def get_interpolation_weights(height: np.ndarray, grid: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    if len(height) == 1:
+        zeros = np.zeros(grid.shape, dtype = np.intp)
+        return zeros, zeros, np.zeros(grid.shape), grid == height[0]
+
+    right = np.clip(np.searchsorted(height, grid, side = 'right'), 1, len(height) - 1)
+    left = right - 1
+    w = (grid - height[left]) / (height[right] - height[left])
+    return left, right, w, (grid >= height[0]) & (grid <= height[-1])
+
+# interpolate a curve linearly at {grid}, with the stderr of each interpolated value (stderr of points are
+#   taken as independent). nan outside the range of the curve.
+# return -> (cl, stderr), arrays of the shape of grid.
+def interpolate_curve(height: np.ndarray, cl: np.ndarray, stderr: np.ndarray, grid: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    grid = np.asarray(grid, dtype = float)
+    if len(height) == 0:
+        return np.full(grid.shape, np.nan), np.full(grid.shape, np.nan)
+
+    left, right, w, inside = get_interpolation_weights(height, grid)
+    value = (1 - w) * cl[left] + w * cl[right]
+    error = np.sqrt(((1 - w) * stderr[left]) ** 2 + (w * stderr[right]) ** 2)
+    return np.where(inside, value, np.nan), np.where(inside, error, np.nan)
+
+
+# see compare_runs. Arrays are indexed [run] or [run i, run j]; offsets are of run j relative to run i.
+@dataclass
+class Comparison:
+    labels: list
+    curves: list = field(repr = False)              # [R] (height, cl, stderr) of each run, see get_curve.
+    height: np.ndarray = field(repr = False)        # [H] common height grid.
+    cl: np.ndarray = field(repr = False)            # [R, H] CL of each run on the grid. nan outside the range of the run.
+    stderr: np.ndarray = field(repr = False)        # [R, H]
+    offset: np.ndarray = field(repr = False)        # [R, R] mean of CL of run j less run i (interpolated), at the heights of run j that run i covers.
+    offset_stderr: np.ndarray = field(repr = False) # [R, R]
+    count: np.ndarray = field(repr = False)         # [R, R] number of heights of run j that run i covers.
+
+    # return -> (height, diff): CL of run {j} less that of run {i} (interpolated), at the heights of run j
+    #   that run i covers, as averaged in offset.
+    def get_diff(self, i: int, j: int) -> tuple[np.ndarray, np.ndarray]:
+        height, cl, _ = self.curves[j]
+        reference, _ = interpolate_curve(*self.curves[i], height)
+        covered = ~np.isnan(reference)
+        return height[covered], (cl - reference)[covered]
+
+    # return -> table of offsets (and stderr) of every run relative to run {reference}, as text.
+    def format_table(self, reference: int = 0) -> str:
+        rows = [('run', f'offset from {self.labels[reference]}', 'stderr', 'heights')]
+        for j, label in enumerate(self.labels):
+            rows.append((str(label), f'{self.offset[reference, j]:.4g}', f'{self.offset_stderr[reference, j]:.2g}',
+                         str(self.count[reference, j])))
+
+        widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
+
+# offset between every pair of {curves}, see module docstring, and the curves on a common height grid.
+# curves: list of (height, cl, stderr), see get_curve.
+# labels: name of each run. Defaults to its index.
+# grid: heights of the common grid. None: every height of any curve.
+# return -> Comparison
+def compare_runs(curves: list, labels: list = None, grid = None) -> Comparison:
+    if labels is None:
+        labels = list(range(len(curves)))
+    if len(labels) != len(curves):
+        raise ValueError(f'(E) compare::compare_runs: got {len(curves)} curves but {len(labels)} labels.')
+    if grid is None:
+        grid = np.unique(np.concatenate([curve[0] for curve in curves])) if curves else np.empty(0)
+    grid = np.asarray(grid, dtype = float)
+
+    n_runs = len(curves)
+    aligned = [interpolate_curve(*curve, grid) for curve in curves]
+    cl = np.array([value for value, _ in aligned]).reshape(n_runs, len(grid))
+    stderr = np.array([error for _, error in aligned]).reshape(n_runs, len(grid))
+
+    # measured points of every run [R, N], padded with nan.
+    n_points = max((len(curve[0]) for curve in curves), default = 0)
+    height, value, error = (np.full((n_runs, n_points), np.nan) for _ in range(3))
+    for j, curve in enumerate(curves):
+        for padded, column in zip((height, value, error), curve):
+            padded[j, :len(column)] = column
+
+    offset = np.full((n_runs, n_runs), np.nan)
+    offset_stderr = np.full((n_runs, n_runs), np.nan)
+    count = np.zeros((n_runs, n_runs), dtype = int)
+    # reference run i against all runs j at once.
+    for i, (ref_height, ref_cl, ref_stderr) in enumerate(curves):
+        if not len(ref_height):
+            continue
+        left, right, w, inside = get_interpolation_weights(ref_height, height)
+        count[i] = np.count_nonzero(inside, axis = 1)
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            # offset[i, j] = sum over points k of run j of a[j, k] * (cl[j, k] - interpolated cl of run i).
+            a = np.where(inside, 1 / count[i][:, None], 0)
+            diff = np.where(inside, value - ((1 - w) * ref_cl[left] + w * ref_cl[right]), 0)
+            offset[i] = (a * diff).sum(axis = 1)
+
+        # coefficient of each point of run i in offset[i, j], summed over the points of run j it interpolates.
+        index = np.arange(n_runs)[:, None] * len(ref_height)
+        ref_coef = (np.bincount((index + left)[inside], weights = ((1 - w) * a)[inside], minlength = n_runs * len(ref_height))
+                    + np.bincount((index + right)[inside], weights = (w * a)[inside], minlength = n_runs * len(ref_height)))
+        ref_coef = ref_coef.reshape(n_runs, len(ref_height))
+        variance = (np.where(inside, (a * error) ** 2, 0).sum(axis = 1)
+                    + ((ref_coef * ref_stderr) ** 2).sum(axis = 1))
+        offset_stderr[i] = np.sqrt(variance)
+
+    # a run against itself: the same measurements.
+    offset_stderr[np.diag_indices(n_runs)] = 0
+    return Comparison(labels, curves, grid, cl, stderr,
+                      offset = np.where(count > 0, offset, np.nan),
+                      offset_stderr = np.where(count > 0, offset_stderr, np.nan),
+                      count = count)
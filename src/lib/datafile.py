@@ -0,0 +1,358 @@
+"""
+datafile.py
+
+Binary container format for Data dumps, as an alternative to json.
+
+Layout of a file:
+- preamble: MAGIC (8 bytes), format version (uint32), header length (uint32), little endian.
+- header: utf-8 json with the Data metadata, the number of frames, and a table of
+  arrays (name -> dtype, shape, offset). Offsets are relative to the start of the data section.
+- data section: starts at the first multiple of ALIGN after the header. Each array is
+  stored contiguously in C order, and also starts at a multiple of ALIGN.
+
+Channels (t, rpm, mass, ...) are stored as arrays under their own names. Ragged
+per-frame values (audio, fft_*, peak_*) are stored as
+- 'scalar': one float per frame under {name}, NaN for None (e.g. dt).
+- 'list': values of all frames concatenated under {name}.values, with lengths per
+  frame under {name}.lengths, -1 for None.
+- 'json': anything else, in the header itself.
+Ragged values that are None in every frame are not stored.
+
+The data section can be memory-mapped, so that loading does not copy any channel.
+
+Recordings can also be streamed to a journal (see Writer) while they are in progress,
+which is append-only and can be recovered if the recording is aborted.
+"""
+
+import json, struct, os, zlib
+import numpy as np
+
+from io import BytesIO
+from numbers import Number
+from queue import Queue
+from threading import Thread
+
+
+MAGIC = b'QUADDATA'
+VERSION = 1
+ALIGN = 64
+EXTENSION = 'bin'
+DATA_EXTENSIONS = ('json', EXTENSION)     # extensions of all files Data can load
+
+PREAMBLE = struct.Struct('<8sII')   # magic, version, header length
+
+# journal format, see Writer.
+JOURNAL_MAGIC = b'QUADJRNL'
+RECORD = struct.Struct('<4sIQI')    # tag, header length, payload length, crc32 of header and payload
+CHUNK_TAG = b'CHNK'
+END_TAG = b'DONE'
+
+# ragged kind -> suffixes of the arrays it is stored as.
+RAGGED_SUFFIXES = {'scalar': ('',), 'list': ('.values', '.lengths')}
+
+
+# return -> True if file at {name} is in the binary or the journal format.
+def is_binary(name: str) -> bool:
+    with open(name, 'rb') as file:
+        return file.read(len(MAGIC)) in (MAGIC, JOURNAL_MAGIC)
+
+# return -> True if file at {name} is in the journal format.
+def is_journal(name: str) -> bool:
+    with open(name, 'rb') as file:
+        return file.read(len(JOURNAL_MAGIC)) == JOURNAL_MAGIC
+
+# return -> smallest multiple of ALIGN no less than offset.
+def align(offset: int) -> int:
+    return -(-offset // ALIGN) * ALIGN
+
+# write a Data dump.
+# metadata: dict of json-serialisable values.
+# channels: name -> array, all with the frame index as their first axis.
+# ragged: name -> list of per-frame values.
+def write(name: str, metadata: dict, channels: dict, ragged: dict):
+    if os.path.isfile(name):
+        raise IOError(f'(E) datafile::write: {name} already exists.')
+
+    block, arrays = encode_block(channels, ragged)
+    header = json.dumps({'metadata': metadata} | block).encode('utf-8')
+    data_start = align(PREAMBLE.size + len(header))
+
+    with open(name, 'wb') as file:
+        file.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        file.write(header)
+        file.write(b'\0' * (data_start - file.tell()))
+        write_arrays(file, block, arrays)
+
+# read a Data dump, in either the binary or the journal format.
+# mmap = True: arrays are read-only views of a memory map of the file. Otherwise, they are read into memory.
+#   Journals are always read into memory.
+# return -> (metadata, channels, ragged), see write.
+#   ragged only contains values that are not None in every frame.
+def read(name: str, mmap: bool = True) -> tuple[dict, dict, dict]:
+    if is_journal(name):
+        return read_journal(name)
+
+    header, data_start = read_header(name)
+
+    size = block_size(header)
+    if size == 0:
+        buf = np.empty(0, dtype = np.uint8)
+    elif mmap:
+        buf = np.memmap(name, dtype = np.uint8, mode = 'r', offset = data_start, shape = (size,))
+    else:
+        buf = np.fromfile(name, dtype = np.uint8, count = size, offset = data_start)
+
+    channels, ragged = decode_block(header, buf)
+    return header['metadata'], channels, ragged
+
+# read the preamble and header only. Works for journals too, whose header only holds the metadata.
+# return -> (header: dict, data_start: int), see module docstring.
+def read_header(name: str) -> tuple[dict, int]:
+    with open(name, 'rb') as file:
+        magic, version, header_len = PREAMBLE.unpack(file.read(PREAMBLE.size))
+        if magic not in (MAGIC, JOURNAL_MAGIC):
+            raise IOError(f'(E) datafile::read_header: {name} is not a binary Data file.')
+        if version > VERSION:
+            raise IOError(f'(E) datafile::read_header: {name} has unsupported version {version}.')
+
+        header = json.loads(file.read(header_len).decode('utf-8'))
+
+    return header, align(PREAMBLE.size + header_len)
+
+
+# append-only writer of a journal: a Data dump that is written in blocks while recording.
+# blocks are encoded and written by a background thread, and synced to disk one by one,
+# so that all blocks written so far survive a crash. See read_journal for recovery.
+#
+# Layout of a journal:
+# - preamble: as in the binary format, but with JOURNAL_MAGIC. The header only holds the metadata.
+# - records: RECORD, followed by a json header and a payload. Each record is one of
+#   - CHUNK_TAG: a block of frames; the header is as returned by encode_block, the payload its arrays.
+#   - END_TAG: written by close. The header holds the total number of frames and the checksum
+#     (crc32 over all chunk records), and there is no payload.
+class Writer:
+    # name: path to journal file, which must not exist yet.
+    # metadata: see write.
+    def __init__(self, name: str, metadata: dict):
+        if os.path.isfile(name):
+            raise IOError(f'(E) Writer::__init__: {name} already exists.')
+
+        self.name = name
+        self.n = 0          # number of frames written
+        self.checksum = 0   # crc32 of all chunk records written
+        self.error = None   # exception encountered by the worker thread
+
+        header = json.dumps({'metadata': metadata}).encode('utf-8')
+        self.file = open(name, 'xb')
+        self.file.write(PREAMBLE.pack(JOURNAL_MAGIC, VERSION, len(header)))
+        self.file.write(header)
+        self.sync()
+
+        self.queue = Queue()
+        self.thread = Thread(target = self.worker, daemon = True)
+        self.thread.start()
+
+    # queue a block of frames for writing. Does not block.
+    # channels, ragged: see write. They must not be modified afterwards.
+    def write(self, channels: dict, ragged: dict):
+        if self.error is not None:
+            raise self.error
+        self.queue.put((channels, ragged))
+
+    # write all queued blocks and the end record, and close the file.
+    # return -> checksum of the journal.
+    def close(self) -> int:
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            if self.error is not None:
+                raise self.error
+
+            self.write_record(END_TAG, {'n': self.n, 'checksum': self.checksum})
+        finally:
+            self.file.close()
+
+        return self.checksum
+
+    def worker(self):
+        while (item := self.queue.get()) is not None:
+            # after a failure, discard the remaining blocks; the error is raised on write / close.
+            if self.error is not None:
+                continue
+
+            try:
+                block, arrays = encode_block(*item)
+                payload = BytesIO()
+                write_arrays(payload, block, arrays)
+                record = self.write_record(CHUNK_TAG, block, payload.getvalue())
+                self.checksum = zlib.crc32(record, self.checksum)
+                self.n += block['n']
+            except Exception as e:
+                self.error = e
+
+    # return -> bytes of the record written.
+    def write_record(self, tag: bytes, header: dict, payload: bytes = b'') -> bytes:
+        header = json.dumps(header).encode('utf-8')
+        crc = zlib.crc32(payload, zlib.crc32(header))
+        record = RECORD.pack(tag, len(header), len(payload), crc) + header + payload
+        self.file.write(record)
+        self.sync()
+        return record
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+# read a journal written by Writer.
+# if the journal is incomplete, e.g. the recording was aborted, all the blocks written
+# before the abort are recovered, and a warning is printed.
+# return -> (metadata, channels, ragged), see write.
+def read_journal(name: str) -> tuple[dict, dict, dict]:
+    with open(name, 'rb') as file:
+        magic, version, header_len = PREAMBLE.unpack(file.read(PREAMBLE.size))
+        if magic != JOURNAL_MAGIC:
+            raise IOError(f'(E) datafile::read_journal: {name} is not a journal.')
+        if version > VERSION:
+            raise IOError(f'(E) datafile::read_journal: {name} has unsupported version {version}.')
+
+        metadata = json.loads(file.read(header_len).decode('utf-8'))['metadata']
+        blocks = list()
+        checksum = 0
+        end = None
+        while len(raw := file.read(RECORD.size)) == RECORD.size:
+            tag, header_len, payload_len, crc = RECORD.unpack(raw)
+            record_header = file.read(header_len)
+            payload = file.read(payload_len)
+            # truncated or corrupted record: the recording was interrupted while writing it.
+            if (len(record_header) != header_len or len(payload) != payload_len
+                or zlib.crc32(payload, zlib.crc32(record_header)) != crc):
+                break
+
+            header = json.loads(record_header.decode('utf-8'))
+            if tag == END_TAG:
+                end = header
+                break
+
+            checksum = zlib.crc32(raw + record_header + payload, checksum)
+            blocks.append(decode_block(header, np.frombuffer(payload, dtype = np.uint8)))
+
+    n = sum(block_length(channels) for channels, ragged in blocks)
+    if end is None:
+        print(f'(W) datafile::read_journal: {name} is incomplete; recovered {n} frames.')
+    elif end['n'] != n or end['checksum'] != checksum:
+        raise IOError(f'(E) datafile::read_journal: {name} failed checksum.')
+
+    channels = dict()
+    ragged = dict()
+    if blocks:
+        for key in blocks[0][0]:
+            channels[key] = np.concatenate([block_channels[key] for block_channels, block_ragged in blocks])
+
+        # ragged values which are None in every frame of a block are not stored in that block.
+        for key in set().union(*[block_ragged.keys() for block_channels, block_ragged in blocks]):
+            ragged[key] = [value for block_channels, block_ragged in blocks
+                           for value in block_ragged.get(key, [None] * block_length(block_channels))]
+
+    return metadata, channels, ragged
+
+
+# return -> number of frames (rows) of a block of channels, which all have the frame index as their first axis.
+#   Data always has 't'; other column stores (see export.py) may not.
+def block_length(channels: dict) -> int:
+    if 't' in channels:
+        return len(channels['t'])
+    return len(next(iter(channels.values()))) if channels else 0
+
+# lay out a block of frames as arrays.
+# channels, ragged: see write.
+# return -> (block, arrays), where
+#   block: json-serialisable dict of the number of frames, the array table and ragged kinds.
+#   arrays: name -> contiguous array, to be written at block['arrays'][name]['offset'].
+def encode_block(channels: dict, ragged: dict) -> tuple[dict, dict]:
+    arrays = {key: np.ascontiguousarray(arr) for key, arr in channels.items()}
+    kinds = dict()
+    json_ragged = dict()
+    for key, values in ragged.items():
+        if all(value is None for value in values):
+            continue
+
+        kind, encoded = encode_ragged(values)
+        kinds[key] = kind
+        if kind == 'json':
+            json_ragged[key] = encoded
+        else:
+            arrays |= {f'{key}{suffix}': arr for suffix, arr in encoded.items()}
+
+    table = dict()
+    offset = 0
+    for key, arr in arrays.items():
+        offset = align(offset)
+        table[key] = {'dtype': arr.dtype.str, 'shape': list(arr.shape), 'offset': offset}
+        offset += arr.nbytes
+
+    block = {'n': block_length(channels),
+             'arrays': table,
+             'ragged': kinds,
+             'json_ragged': json_ragged}
+    return block, arrays
+
+# write arrays of a block, with offsets relative to the current position of file.
+def write_arrays(file, block: dict, arrays: dict):
+    start = file.tell()
+    for key, arr in arrays.items():
+        file.write(b'\0' * (start + block['arrays'][key]['offset'] - file.tell()))
+        file.write(arr.reshape(-1).view(np.uint8))
+
+# return -> number of bytes taken by the arrays of a block.
+def block_size(block: dict) -> int:
+    return max([info['offset'] + np.dtype(info['dtype']).itemsize * int(np.prod(info['shape']))
+                for info in block['arrays'].values()], default = 0)
+
+# inverse of encode_block.
+# buf: uint8 array of the bytes of the arrays. Arrays returned are views into buf.
+# return -> (channels, ragged), see write.
+def decode_block(block: dict, buf: np.ndarray) -> tuple[dict, dict]:
+    arrays = dict()
+    for key, info in block['arrays'].items():
+        dtype = np.dtype(info['dtype'])
+        shape = tuple(info['shape'])
+        nbytes = dtype.itemsize * int(np.prod(shape))
+        # np.ndarray rather than np.memmap, so that slicing and reductions are plain arrays.
+        arrays[key] = np.asarray(buf[info['offset']:info['offset'] + nbytes]).view(dtype).reshape(shape)
+
+    ragged = dict()
+    for key, kind in block['ragged'].items():
+        if kind == 'json':
+            ragged[key] = block['json_ragged'][key]
+            continue
+
+        ragged[key] = decode_ragged(kind, {suffix: arrays.pop(f'{key}{suffix}')
+                                           for suffix in RAGGED_SUFFIXES[kind]})
+
+    return arrays, ragged
+
+# return -> (kind, encoded). encoded is suffix -> array, or a list for 'json'.
+def encode_ragged(values: list) -> tuple[str, dict|list]:
+    if all(value is None or isinstance(value, Number) for value in values):
+        return 'scalar', {'': np.array([np.nan if value is None else value for value in values],
+                                       dtype = np.float64)}
+
+    if all(value is None or np.ndim(value) == 1 for value in values):
+        lengths = np.array([-1 if value is None else len(value) for value in values], dtype = np.int64)
+        present = [value for value in values if value is not None]
+        flat = np.concatenate(present).astype(np.float64) if present else np.empty(0)
+        return 'list', {'.values': flat, '.lengths': lengths}
+
+    return 'json', [value if value is None else np.asarray(value).tolist() for value in values]
+
+# inverse of encode_ragged.
+# return -> list of per-frame values.
+def decode_ragged(kind: str, encoded: dict) -> list:
+    if kind == 'scalar':
+        return [None if np.isnan(value) else value for value in encoded[''].tolist()]
+
+    values = encoded['.values']
+    lengths = encoded['.lengths'].tolist()
+    offsets = np.concatenate([[0], np.cumsum(np.maximum(lengths, 0))]).tolist()
+    return [None if length < 0 else values[offset:offset + length].tolist()
+            for offset, length in zip(offsets, lengths)]
@@ -0,0 +1,158 @@
+"""
+export.py
+
+Streaming export of lift data to CSV, or to a compact binary columnar file.
+
+Files are read from a folder (or folders, or a catalog Query, see processor.get_data_files) one by one,
+in worker processes, and each is reduced, with the same filtering as processor.get_group_table, to rows:
+- 'frame': one row per frame kept: t, mean rpm and lift (absolute total mass).
+- 'group': one row per (height, timestamp, target_rpm) group of the file: number of frames kept, mean
+  and standard deviation of rpm and lift. Groups are per file: a group that spans several files
+  gets a row from each.
+Every row also has the file, height, timestamp and mean target rpm, and the columns that the metadata
+config gives for the campaign (folder) of its file, e.g. prop spacing. Rows are written file by file,
+so that memory stays bounded whatever the size of the campaigns.
+
+The binary format is a datafile journal (see datafile.Writer), with one block of columns per file.
+Text columns (file, and text metadata) are stored as integer codes, with their values in the header.
+Read it back with read.
+
+Usage:
+    metadata = {'240mm_prop_spacing_4inch_prop': {'prop_spacing': 24, 'prop_radius': 5.08, 'test_run': 1}}
+    export(['../raw/bf2/240mm_prop_spacing_4inch_prop'], '../temp/all_data.csv', rows = 'frame', metadata = metadata)
+"""
+
+import os, csv, json
+import numpy as np
+
+from functools import partial
+from numbers import Number
+import datafile, processor
+from catalog import Query
+from utils import Data
+
+
+EXTENSION: str = 'cols'     # of binary exports; not a Data file, so not picked up by get_data_files.
+ROWS: dict = {'frame': ('t', 'rpm', 'lift'),
+              'group': ('count', 'rpm', 'rpm_stdev', 'lift', 'lift_stdev')}
+# columns common to every row, before those of ROWS.
+KEY_COLUMNS: tuple = ('file', 'height', 'timestamp', 'target_rpm')
+
+
+# reduce a Data to rows, see module docstring. Module-level, so that it can be run by worker processes.
+# kwargs: filtering arguments of processor.get_group_table.
+# return -> (source file of data, dict (column -> array) of rows of data without the file and metadata columns).
+#   No rows if data is filtered out.
+def reduce_data(data: Data, rows: str = 'group', **kwargs) -> tuple[str, dict]:
+    table, selected = processor.get_group_table([data], **kwargs)
+    if rows == 'frame':
+        columns = {'t': selected[0].get_t()[table.index] if selected else np.empty(0),
+                   'rpm': table.rpm,
+                   'lift': np.abs(table.total_mass)}
+        group = table.group
+    else:
+        count, rpm_mean, rpm_stdev, mass_mean, mass_stdev = table.get_stats()
+        columns = {'count': count, 'rpm': rpm_mean, 'rpm_stdev': rpm_stdev,
+                   'lift': np.abs(mass_mean), 'lift_stdev': np.abs(mass_stdev)}
+        group = np.arange(len(table))
+
+    batches = [table.batches[b] for b in table.group_batch]
+    height = np.array([batch[0] for batch in batches], dtype = float)
+    timestamp = np.array([batch[1] for batch in batches], dtype = float)
+    target_rpm = np.array([np.mean(target) for target in table.targets], dtype = float)
+    return data.source, {'height': height[group], 'timestamp': timestamp[group], 'target_rpm': target_rpm[group]} | columns
+
+# return -> dict (column -> value) of the metadata of the campaign (folder) of file {name}.
+def get_campaign_metadata(name: str, metadata: dict) -> dict:
+    return metadata.get(os.path.basename(os.path.dirname(os.path.abspath(name))), {})
+
+# export the lift data of the files in {paths} to {name}, file by file.
+# paths: folder(s), or a catalog Query, see processor.get_data_files.
+# name: path to the export, which must not exist yet. A .csv file, or a binary file (.EXTENSION).
+# rows: 'frame' or 'group', see module docstring.
+# metadata: dict (campaign folder name -> dict (column -> value)), or path to a json file of it.
+# workers, progress: see processor.iter_data_list.
+# kwargs: filtering arguments of processor.get_group_table, e.g. rpm_range.
+# return -> number of rows written.
+def export(paths: str|list|Query, name: str, rows: str = 'group', metadata: dict|str = None,
+           workers: int = None, progress: bool = True, **kwargs) -> int:
+    if rows not in ROWS:
+        raise ValueError(f'(E) export::export: rows must be one of {list(ROWS)}, got {rows}.')
+    if os.path.exists(name):
+        raise IOError(f'(E) export::export: {name} already exists.')
+    if type(metadata) is str:
+        with open(metadata, 'r') as file:
+            metadata = json.load(file)
+    metadata = metadata or dict()
+
+    # resolved once, so that the files streamed are those listed in the header (a Query may change in between).
+    files = processor.get_data_files(paths)
+    meta_columns = list(dict.fromkeys(key for values in metadata.values() for key in values))
+    columns = [*KEY_COLUMNS, *ROWS[rows], *meta_columns]
+    reduced = processor.iter_data_list(files, workers = workers, progress = progress,
+                                       reduce = partial(reduce_data, rows = rows, **kwargs))
+
+    if name.endswith('.csv'):
+        return write_csv(name, columns, meta_columns, metadata, reduced)
+    if name.endswith('.' + EXTENSION):
+        return write_binary(name, columns, meta_columns, metadata, files, rows, reduced)
+    raise ValueError(f'(E) export::export: {name} must end in .csv or .{EXTENSION}.')
+
+def write_csv(name: str, columns: list, meta_columns: list, metadata: dict, reduced) -> int:
+    n = 0
+    with open(name, 'x', newline = '') as file:
+        writer = csv.writer(file)
+        writer.writerow(columns)
+        for source, block in reduced:
+            count = len(block['height'])
+            if not count:
+                continue
+            campaign = get_campaign_metadata(source, metadata)
+            constants = [campaign.get(key, '') for key in meta_columns]
+            writer.writerows([os.path.basename(source), *row, *constants]
+                             for row in zip(*(block[key].tolist() for key in columns[1:len(columns) - len(meta_columns)])))
+            n += count
+    return n
+
+def write_binary(name: str, columns: list, meta_columns: list, metadata: dict, files: list, rows: str, reduced) -> int:
+    # text columns are stored as codes into their values: file, and metadata that is not all numbers.
+    categories = {'file': [os.path.basename(file) for file in files]}
+    for key in meta_columns:
+        values = [campaign[key] for campaign in metadata.values() if key in campaign]
+        if not all(isinstance(value, Number) for value in values):
+            categories[key] = list(dict.fromkeys(str(value) for value in values))
+    file_code = {os.path.abspath(file): code for code, file in enumerate(files)}
+
+    writer = datafile.Writer(name, {'rows': rows, 'columns': columns, 'categories': categories})
+    n = 0
+    try:
+        for source, block in reduced:
+            count = len(block['height'])
+            if not count:
+                continue
+            campaign = get_campaign_metadata(source, metadata)
+            block = {'file': np.full(count, file_code[os.path.abspath(source)], dtype = np.int32)} | block
+            for key in meta_columns:
+                if key in categories:
+                    code = categories[key].index(str(campaign[key])) if key in campaign else -1
+                    block[key] = np.full(count, code, dtype = np.int32)
+                else:
+                    block[key] = np.full(count, campaign.get(key, np.nan), dtype = float)
+            writer.write(block, dict())
+            n += count
+    finally:
+        writer.close()
+    return n
+
+# read a binary export.
+# return -> dict (column -> array), in the order of the columns. Text columns are decoded to arrays of str
+#   ('' where missing).
+def read(name: str) -> dict:
+    header, channels, _ = datafile.read(name)
+    columns = dict()
+    for key in header['columns']:
+        values = channels.get(key, np.empty(0))
+        if key in header['categories']:
+            values = np.array([*header['categories'][key], ''])[values] if len(values) else np.empty(0, dtype = str)
+        columns[key] = values
+    return columns
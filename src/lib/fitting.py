@@ -0,0 +1,266 @@
+"""
+fitting.py
+
+Batch curve fitting of the ground effect models of CL against height.
+
+A fit is described by a FitJob: a data set (x = height, y = CL), a model from MODELS, and
+the constants of the rig the model needs (prop_spacing, prop_radius). fit_all fits many jobs
+at once, in parallel worker processes, and returns a FitResult for each: parameters,
+covariance, residual RMS and AIC / BIC, so that models can be compared across data sets.
+format_table lays the results out as a table.
+
+Models are vectorised over x and come with analytic Jacobians, which curve_fit uses
+instead of finite differences. Fits can be warm-started from the parameters of previous
+fits of the same (label, model), kept in a json file.
+
+profile_scan fits a job for every point of a grid of fixed parameters of its model (e.g. c4,
+prop_spacing), over a process pool, and returns the profile of the residuals and likelihood.
+
+Usage:
+    jobs = [FitJob(x_cl, y_cl, model, label = '160mm', prop_spacing = 16) for model in (1, 2, 3)]
+    print(format_table(fit_all(jobs, warm_start = 'fits.json')))
+    profile = profile_scan(FitJob(x_cl, y_cl, 4, prop_spacing = 16), {'c4': np.linspace(0, 10, 500)})
+"""
+
+import os, json, itertools
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from scipy.optimize import curve_fit
+
+
+"""
+MODELS
+each model has a function f(x, *params, prop_spacing, prop_radius) and its Jacobian
+jac(x, *params, prop_spacing, prop_radius) -> array [len(x), len(params)].
+"""
+# multiplicative solution with powers -4 and -2.
+def model_1(x, a1, a2, a3, prop_spacing = None, prop_radius = None):
+    a5, e1, e2 = 3, -4, -2
+    u = np.power((x + a5) / a2, e1)
+    v = np.power((x + a5) / a3, e2)
+    return a1 * (1 + u) / (1 + v)
+
+def model_1_jac(x, a1, a2, a3, prop_spacing = None, prop_radius = None):
+    a5, e1, e2 = 3, -4, -2
+    u = np.power((x + a5) / a2, e1)
+    v = np.power((x + a5) / a3, e2)
+    return np.column_stack(((1 + u) / (1 + v),
+                            - a1 * e1 * u / a2 / (1 + v),
+                            a1 * (1 + u) * e2 * v / a3 / (1 + v) ** 2))
+
+# Sanchez-Cuevas, for a quadrotor of propellers {prop_spacing} apart.
+# return -> T_oge / (reciprocal of ground effect factor), i.e. linear in T_oge.
+def model_2_factor(x, prop_spacing, prop_radius):
+    Kb = 2
+    z = x + 2
+    term1 = 1 - (prop_radius / (4 * z)) ** 2
+    term2 = -prop_radius ** 2 * (z / (prop_spacing ** 2 + 4 * z ** 2) ** (3 / 2))
+    term3 = -(prop_radius ** 2 / 2) * (z / (2 * prop_spacing ** 2 + 4 * z ** 2) ** (3 / 2))
+    term4 = -2 * prop_radius ** 2 * (z / ((2 ** 0.5 * prop_spacing) ** 2 + 4 * z ** 2) ** (3 / 2) * Kb)
+    return 1 / (term1 + term2 + term3 + term4)
+
+def model_2(x, T_oge, prop_spacing = None, prop_radius = None):
+    return T_oge * model_2_factor(x, prop_spacing, prop_radius)
+
+def model_2_jac(x, T_oge, prop_spacing = None, prop_radius = None):
+    return model_2_factor(x, prop_spacing, prop_radius)[:, None]
+
+# single propeller ground effect, with height offset {x_offset}.
+def model_3(x, T_oge, x_offset, prop_spacing = None, prop_radius = None):
+    s = (x + x_offset) / 2 / prop_radius
+    return T_oge * np.power(0.9926 + 0.03794 / np.power(s, 2), 2 / 3)
+
+def model_3_jac(x, T_oge, x_offset, prop_spacing = None, prop_radius = None):
+    s = (x + x_offset) / 2 / prop_radius
+    h = 0.9926 + 0.03794 / np.power(s, 2)
+    dh_dz = - 2 * 0.03794 / np.power(s, 3) / 2 / prop_radius
+    return np.column_stack((np.power(h, 2 / 3),
+                            T_oge * 2 / 3 * np.power(h, -1 / 3) * dh_dz))
+
+# ground effect with power {c3} of height over prop spacing, as in processor.cl_height_plot.
+# heights are offset by {c4}, and heights below 0 are taken as 0.
+def model_4(x, c1, c2, c3, c4 = 3, prop_spacing = None, prop_radius = None):
+    s = (np.maximum(x, 0) + c4) / prop_spacing
+    return c1 / np.power(s, c3) + c2
+
+def model_4_jac(x, c1, c2, c3, c4 = 3, prop_spacing = None, prop_radius = None):
+    s = (np.maximum(x, 0) + c4) / prop_spacing
+    p = np.power(s, -c3)
+    return np.column_stack((p, np.ones(len(p)), - c1 * p * np.log(s)))
+
+
+@dataclass
+class Model:
+    func: callable
+    jac: callable
+    params: tuple   # names of parameters
+    p0: tuple       # default initial guess
+
+# model number -> Model. Numbering as in processor.cl_height_plot_multiple.
+MODELS = {1: Model(model_1, model_1_jac, ('a1', 'a2', 'a3'), (1e-6, 40, 100)),
+          2: Model(model_2, model_2_jac, ('T_oge',), (2.5e-6,)),
+          3: Model(model_3, model_3_jac, ('T_oge', 'x_offset'), (1, 1)),
+          4: Model(model_4, model_4_jac, ('c1', 'c2', 'c3'), (4e-6, 2.3e-6, 1))}
+
+
+"""
+FITTING
+"""
+@dataclass
+class FitJob:
+    x: list
+    y: list
+    model: int
+    label: str = ''
+    prop_spacing: float = None
+    prop_radius: float = 5.08
+    p0: tuple = None    # None: warm start if available, otherwise the default of the model.
+    fixed: dict = field(default_factory = dict)     # other fixed parameters of the model, e.g. {'c4': 3}.
+
+    # return -> keyword arguments of the model function other than the fitted parameters.
+    def get_consts(self) -> dict:
+        return {'prop_spacing': self.prop_spacing, 'prop_radius': self.prop_radius, **self.fixed}
+
+@dataclass
+class FitResult:
+    label: str
+    model: int
+    params: np.ndarray = field(repr = False)
+    cov: np.ndarray = field(repr = False)
+    rms: float = None   # root mean square of residuals
+    aic: float = None
+    bic: float = None
+    n: int = 0          # number of data points
+    message: str = ''   # why the fit failed, if it did.
+
+    # return -> model evaluated at {x} with the fitted parameters.
+    # consts: other keyword arguments of the model function, e.g. FitJob.get_consts().
+    def evaluate(self, x, prop_spacing: float = None, prop_radius: float = None, **consts) -> np.ndarray:
+        return MODELS[self.model].func(np.asarray(x, dtype = float), *self.params,
+                                       prop_spacing = prop_spacing, prop_radius = prop_radius, **consts)
+
+# fit a single job.
+# return -> FitResult. On failure, params are nan and message says why.
+def fit(job: FitJob) -> FitResult:
+    model = MODELS[job.model]
+    x = np.asarray(job.x, dtype = float)
+    y = np.asarray(job.y, dtype = float)
+    p0 = job.p0 if job.p0 is not None else model.p0
+    consts = job.get_consts()
+
+    try:
+        params, cov = curve_fit(lambda x, *params: model.func(x, *params, **consts), x, y,
+                                p0 = np.asarray(p0, dtype = float),
+                                jac = lambda x, *params: model.jac(x, *params, **consts),
+                                maxfev = 10000)
+    except (RuntimeError, ValueError) as e:
+        nan = np.full(len(model.params), np.nan)
+        return FitResult(job.label, job.model, nan, np.full((len(nan), len(nan)), np.nan),
+                         n = len(x), message = str(e))
+
+    residual = y - model.func(x, *params, **consts)
+    n, k = len(x), len(params)
+    rss = float(residual @ residual)
+    # least squares information criteria, with gaussian errors of unknown variance.
+    log_likelihood_term = n * np.log(rss / n) if rss > 0 else -np.inf
+    return FitResult(job.label, job.model, params, cov,
+                     rms = float(np.sqrt(rss / n)),
+                     aic = float(log_likelihood_term + 2 * k),
+                     bic = float(log_likelihood_term + k * np.log(n)),
+                     n = n)
+
+# fit many jobs, in parallel.
+# workers: number of worker processes. None: one per CPU. 1: fit in this process.
+# warm_start: path to a json file of fitted parameters by (label, model). Jobs without p0 start
+#   from the parameters found last time, and the file is updated with the new fits.
+# return -> list of FitResult, in the order of jobs.
+def fit_all(jobs: list, workers: int = None, warm_start: str = None) -> list:
+    previous = dict()
+    if warm_start is not None and os.path.isfile(warm_start):
+        with open(warm_start, 'r') as file:
+            previous = json.load(file)
+
+    jobs = [job if job.p0 is not None or f'{job.label}/{job.model}' not in previous
+            else FitJob(**(job.__dict__ | {'p0': previous[f'{job.label}/{job.model}']}))
+            for job in jobs]
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        results = [fit(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers = min(workers, len(jobs))) as executor:
+            # fits are short: send them in chunks, a few per worker.
+            results = list(executor.map(fit, jobs, chunksize = max(len(jobs) // (4 * workers), 1)))
+
+    if warm_start is not None:
+        for result in results:
+            if not result.message:
+                previous[f'{result.label}/{result.model}'] = result.params.tolist()
+        with open(warm_start, 'w') as file:
+            json.dump(previous, file, indent = 4)
+
+    return results
+
+# fits of a job over a grid of fixed parameters, see profile_scan.
+@dataclass
+class Profile:
+    names: tuple        # names of the fixed parameters scanned.
+    values: tuple       # grid values of each.
+    params: np.ndarray = field(repr = False)   # [*shape, k] fitted parameters at each grid point.
+    rss: np.ndarray = field(repr = False)      # [*shape] residual sum of squares at each grid point. nan where the fit failed.
+    n: int = 0          # number of data points.
+
+    # return -> shape of the grid, one axis per scanned parameter.
+    @property
+    def shape(self) -> tuple:
+        return tuple(len(values) for values in self.values)
+
+    # return -> [*shape] maximised gaussian log likelihood at each grid point, i.e. the profile likelihood.
+    def get_log_likelihood(self) -> np.ndarray:
+        return - self.n / 2 * (np.log(2 * np.pi * self.rss / self.n) + 1)
+
+    # return -> (dict (name -> value) of fixed parameters, fitted parameters) at the grid point of least rss.
+    def get_best(self) -> tuple[dict, np.ndarray]:
+        index = np.unravel_index(np.nanargmin(self.rss), self.shape)
+        return {name: values[i] for name, values, i in zip(self.names, self.values, index)}, self.params[index]
+
+# fit {job} for every combination of values of fixed parameters, see fit_all.
+# grid: dict (name -> values). Each name is a keyword of the model function, e.g.
+#   {'c4': np.linspace(0, 10, 500), 'prop_spacing': [12, 16, 24]}.
+# workers: see fit_all.
+# return -> Profile
+def profile_scan(job: FitJob, grid: dict, workers: int = None) -> Profile:
+    names = tuple(grid)
+    values = tuple(np.asarray(grid[name]).tolist() for name in names)
+    jobs = list()
+    for point in itertools.product(*values):
+        consts = dict(zip(names, point))
+        # rig constants are fields of the job, other parameters go to fixed.
+        rig = {key: consts.pop(key) for key in ('prop_spacing', 'prop_radius') if key in consts}
+        jobs.append(FitJob(**(job.__dict__ | rig | {'fixed': job.fixed | consts})))
+
+    results = fit_all(jobs, workers = workers)
+    shape = tuple(len(v) for v in values)
+    rss = np.array([result.n * result.rms ** 2 if not result.message else np.nan for result in results])
+    return Profile(names, values,
+                   params = np.array([result.params for result in results]).reshape(*shape, -1),
+                   rss = rss.reshape(shape),
+                   n = len(job.x))
+
+# return -> table of {results} as text: one row per fit, with parameters, their standard errors,
+#   residual RMS, AIC and BIC.
+def format_table(results: list) -> str:
+    rows = [('label', 'model', 'n', 'params', 'stderr', 'rms', 'aic', 'bic')]
+    for result in results:
+        names = MODELS[result.model].params
+        stderr = np.sqrt(np.diag(result.cov))
+        rows.append((result.label, str(result.model), str(result.n),
+                     ', '.join(f'{name}={val:.4g}' for name, val in zip(names, result.params)),
+                     ', '.join(f'{val:.2g}' for val in stderr),
+                     *(f'{val:.4g}' if val is not None else result.message for val in (result.rms, result.aic, result.bic))))
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(row, widths)) for row in rows)
@@ -0,0 +1,83 @@
+"""
+force.py
+
+Reconstruction of 3D force vectors from the readings of a load cell rig.
+
+Each reading (e.g. each element of Frame.mass) measures the force along the axis of one cell.
+A rig is described by a CellLayout: for each reading, the force vector that a unit reading
+stands for. Reconstruction is then a single matrix product, done for all frames at once:
+    force[N, 3] = readings[N, k] @ layout.matrix.T
+
+NINE_CELL is the layout of the 9-load cell setup; other rigs can define their own layout,
+e.g. with CellLayout.from_angles, and pass it to Data.get_mass_vec / Frame.get_mass_vec.
+"""
+
+import numpy as np
+
+
+class CellLayout:
+    # axes: array [k, 3]. axes[i] is the force vector [x, y, z] that a unit of reading i stands for.
+    #   right-handed coordinate system, z points upward.
+    # name: for error messages.
+    def __init__(self, axes, name: str = None):
+        axes = np.array(axes, dtype = float)
+        if axes.ndim != 2 or axes.shape[1] != 3:
+            raise ValueError(f'(E) CellLayout::__init__: axes must be of shape [k, 3], got {list(axes.shape)}.')
+
+        self.name = name if name is not None else f'{len(axes)}-cell'
+        # reconstruction matrix [3, k], such that force = matrix @ readings.
+        self.matrix = np.ascontiguousarray(axes.T)
+        self.matrix.flags.writeable = False
+
+    def __len__(self) -> int:
+        return self.matrix.shape[1]
+
+    # build a layout from the direction of each cell's axis.
+    # azimuth: angle of the axis in the xy-plane from x towards y, in degrees.
+    # elevation: angle of the axis above the xy-plane, in degrees; e.g. -90 for a cell measuring downward force.
+    # return -> CellLayout
+    @classmethod
+    def from_angles(cls, azimuth: list, elevation: list, name: str = None):
+        azimuth = np.radians(azimuth)
+        elevation = np.radians(elevation)
+        axes = np.column_stack((np.cos(elevation) * np.cos(azimuth),
+                                np.cos(elevation) * np.sin(azimuth),
+                                np.sin(elevation)))
+        return cls(axes, name)
+
+    # readings: array [N, k] of readings by frame, or [k] for a single frame.
+    # return -> array [N, 3] (or [3]) of force vectors.
+    def reconstruct(self, readings) -> np.ndarray:
+        readings = np.asarray(readings, dtype = float)
+        if not readings.size:
+            return np.empty((*readings.shape[:-1], 3))
+        if readings.shape[-1] != len(self):
+            raise IndexError(f'(E) CellLayout::reconstruct: must have {len(self)} readings for the {self.name} '
+                             f'layout, got {readings.shape[-1]}.')
+
+        if readings.ndim == 1:
+            return self.matrix @ readings
+        return readings @ self.matrix.T
+
+
+# the 9-load cell setup: three mounts, each with one vertical and two horizontal cells,
+# such that reshape(mass, (3, 3))[i, j] is cell j of mount i, and j = 0 is vertical.
+# z points upward, x points along middle line towards cells 1-0
+def _nine_cell_axes() -> np.ndarray:
+    from numpy import sin, cos, pi
+
+    DEG15 = pi * 15 / 180
+    DEG45 = pi * 45 / 180
+    DEG75 = pi * 75 / 180
+
+    axes = np.zeros((9, 3))
+    axes[[1, 2, 4, 5, 7, 8], 0] = [- sin(DEG45), sin(DEG45),
+                                   cos(DEG15), cos(DEG75),
+                                   - cos(DEG75), - cos(DEG15)]
+    axes[[1, 2, 4, 5, 7, 8], 1] = [- cos(DEG45), - cos(DEG45),
+                                   - sin(DEG15), sin(DEG75),
+                                   sin(DEG75), - sin(DEG15)]
+    axes[[0, 3, 6], 2] = -1     # z-component adds simply
+    return axes
+
+NINE_CELL = CellLayout(_nine_cell_axes(), name = '9-cell')
@@ -163,7 +163,7 @@ class Plotter:
                         update_func_name = 'update_generic'
             
             update_func = getattr(self, update_func_name)
-            update_func(graph_id, graph_type, data, window)
+            update_func(graph_id, graph_type, data, window = window)
 
         self.refresh()
 
@@ -215,11 +215,8 @@ class Plotter:
         x = []
         y = []
 
-        t = data.get_t()
-        peaks = data.get_peak_freq()
-        if window is not None:
-            t = t[-window:]
-            peaks = peaks[-window:]
+        t = data.get_t(window)
+        peaks = data.get_peak_freq(window)
 
         for i in range(len(t)):
             for peak in peaks[i]:
@@ -233,12 +230,9 @@ class Plotter:
     def update_generic(self, graph_id: tuple, graph_type: str, data: Data, window: int = None):
         get_func = getattr(data, 'get_' + graph_type)
 
-        t = data.get_t()
-        val = get_func()
-
-        if window is not None:
-            t = t[-window:]
-            val = val[-window:]
+        # windowed accessors only touch the last {window} frames.
+        t = data.get_t(window)
+        val = get_func(window)
 
         line = self.get_lines(graph_id)[0]
         line.set_xdata(t)
@@ -272,18 +266,13 @@ class Plotter:
         get_func_name = 'get_' + graph_type.replace('comp', 'vec')
         get_func = getattr(data, get_func_name)
        
-        t = data.get_t()
-        vec_list = get_func()    # list of vectors by time.
-
-        if window is not None:
-            t = t[-window:]
-            vec_list = vec_list[-window:]
+        t = data.get_t(window)
+        vec_list = get_func(window)    # array [N, 3] of vectors by time.
 
-       
         lines = self.get_lines(graph_id)
         for i in range(3):
             lines[i].set_xdata(t)
-            lines[i].set_ydata([vec[i] for vec in vec_list])     # i-th component
+            lines[i].set_ydata(vec_list[:, i])     # i-th component
     
     # GET functions (private)
     # return -> matplotlib.axes.Axes object at graph_id.
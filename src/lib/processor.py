@@ -15,8 +15,18 @@ import matplotlib.pyplot as plt
 import numpy as np
 import statistics as st
 from matplotlib import cm
+import datafile, fitting, spectrum, tracking
 from utils import Data
+from catalog import Query
+from cache import ResultCache
+from aggregate import GroupTable, BinTable, group_count, get_cl_by_batch, bootstrap_cl_by_batch
+from surface import LiftSurface
+from compare import get_curve, compare_runs
 from math import sqrt
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from functools import partial
 from numbers import Number
 
 
@@ -54,57 +64,158 @@ def errorbar_plot(x: list, y: list, xerr: list = None, yerr: list = None, linreg
 
         return y_fit
 
-# filter a list with z-values, IQR and percentile limit.
-# if none of these are specified, no values are filtered.
-# return -> indices: list. indices of outlier items.
-def get_outlier_indices(x: list, z: float = None, iqr_factor: float = None, percentile_limit: float = 0) -> list:
+# scale factor from median absolute deviation to standard deviation, for normally distributed data.
+MAD_SCALE = 1.4826
+
+# check the statistical parameters of outlier filtering, see get_outlier_mask.
+def check_outlier_params(z: float = None, iqr_factor: float = None, percentile_limit: float = 0, mad: float = None):
     if (percentile_limit >= 100
         or (z and z < 0)
-        or (iqr_factor and iqr_factor < 0)):
-        raise ValueError(':get_outlier_indices: Invalid statistical parameters supplied.')
-
+        or (iqr_factor and iqr_factor < 0)
+        or (mad and mad < 0)):
+        raise ValueError('(E) check_outlier_params: Invalid statistical parameters supplied.')
+
+# x: array of shape (n, k). the other arguments are statistics of each column, broadcastable to (n, k).
+# return -> boolean mask of shape (n,), True where an item is an outlier in any column.
+def outlier_mask_from_stats(x: np.ndarray, mean, stdev, q1, q3, percentile_l, percentile_r, median, mad_dev,
+                            z: float = None, iqr_factor: float = None, mad: float = None) -> np.ndarray:
+    # only need to satisfy one of these criteria to be removed.
+    mask = (x > percentile_r) | (x < percentile_l)
+    if z is not None:
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mask |= (stdev != 0) & (np.abs(x - mean) / stdev > z)
+    if iqr_factor is not None:
+        iqr = q3 - q1
+        mask |= (x > q3 + iqr_factor * iqr) | (x < q1 - iqr_factor * iqr)
+    if mad is not None:
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            mask |= (mad_dev != 0) & (np.abs(x - median) / (MAD_SCALE * mad_dev) > mad)
+
+    return mask.any(axis = 1)
+
+# find outliers with z-values, IQR, percentile limit and median absolute deviation (MAD).
+# if none of these are specified, no values are found.
+# x: values of shape (n,), or of shape (n, k) for k axes of the same n items, each tested on its own.
+# z: outside of mean +- z * standard deviation.
+# iqr_factor: outside of [Q1 - iqr_factor * IQR, Q3 + iqr_factor * IQR].
+# percentile_limit: outside of [percentile_limit, 100 - percentile_limit] percentiles.
+# mad: outside of median +- mad * MAD_SCALE * MAD.
+# return -> boolean mask of shape (n,), True where an item is an outlier on any axis.
+def get_outlier_mask(x, z: float = None, iqr_factor: float = None, percentile_limit: float = 0,
+                     mad: float = None) -> np.ndarray:
+    check_outlier_params(z, iqr_factor, percentile_limit, mad)
+    x = np.asarray(x, dtype = float)
     # can't do statistics
     if len(x) < 2:
-        return []
-
-    indices = list()
-    mean = st.mean(x)
-    stdev = st.stdev(x)
-    q3, q1 = np.percentile(x, [75, 25])
-    iqr = q3 - q1
-    percentile_l, percentile_r = np.percentile(x, [0 + percentile_limit, 100 - percentile_limit])
-    
-    for i in range(len(x)):
-        val = x[i]
-        # only need to satisfy one of these criteria to be removed.
-        if z is not None and stdev and abs(val - mean) / stdev > z:
-            indices.append(i)
-        elif (iqr_factor is not None
-            and (val > q3 + iqr_factor * iqr or val < q1 - iqr_factor * iqr)):
-            indices.append(i)
-        elif val > percentile_r or val < percentile_l:
-            indices.append(i)
-        
-    return indices 
+        return np.zeros(len(x), dtype = bool)
+
+    x = x.reshape(len(x), -1)
+
+    mean = x.mean(axis = 0)
+    stdev = x.std(axis = 0, ddof = 1)
+    q3, q1, percentile_l, percentile_r = np.percentile(x, [75, 25, 0 + percentile_limit, 100 - percentile_limit], axis = 0)
+    median = np.median(x, axis = 0) if mad is not None else None
+    mad_dev = np.median(np.abs(x - median), axis = 0) if mad is not None else None
+    return outlier_mask_from_stats(x, mean, stdev, q1, q3, percentile_l, percentile_r, median, mad_dev,
+                                   z = z, iqr_factor = iqr_factor, mad = mad)
+
+# percentiles of each group, same as np.percentile (linear method) on each group.
+# x: values of shape (n, k), sorted within each group, with groups in order.
+# starts, counts: start index and number of items in each group. counts must be positive.
+# return -> array of shape (len(q), groups, k).
+def get_grouped_percentile(x: np.ndarray, starts: np.ndarray, counts: np.ndarray, q: list) -> np.ndarray:
+    result = list()
+    for quantile in np.asarray(q, dtype = float) / 100:
+        virtual = (counts - 1) * quantile
+        previous = np.floor(virtual).astype(int)
+        following = np.minimum(previous + 1, counts - 1)
+        gamma = (virtual - previous)[:, None]
+        a = x[starts + previous]
+        b = x[starts + following]
+        diff = b - a
+        # same interpolation as numpy, for identical results.
+        result.append(np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma))
+
+    return np.array(result)
+
+# find outliers within each group, for many groups at once. See get_outlier_mask.
+# x: values of shape (n,) or (n, k).
+# groups: group label of each of the n items. Items of a group need not be contiguous.
+# return -> boolean mask of shape (n,), True where an item is an outlier within its group.
+def get_grouped_outlier_mask(x, groups, z: float = None, iqr_factor: float = None, percentile_limit: float = 0,
+                             mad: float = None) -> np.ndarray:
+    check_outlier_params(z, iqr_factor, percentile_limit, mad)
+    x = np.asarray(x, dtype = float)
+    if len(x) != len(groups):
+        raise IndexError('(E) get_grouped_outlier_mask: Values and groups of different lengths supplied.')
+    if len(x) == 0:
+        return np.zeros(0, dtype = bool)
+
+    x = x.reshape(len(x), -1)
+
+    _, inverse, counts = np.unique(groups, return_inverse = True, return_counts = True)
+    inverse = inverse.reshape(-1)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    # stable sort by group, then by value in each column within the group.
+    by_group = np.argsort(inverse, kind = 'stable')
+    xs = np.empty_like(x)
+    for col in range(x.shape[1]):
+        xs[:, col] = x[np.lexsort((x[:, col], inverse)), col]
+
+    sums = np.add.reduceat(x[by_group], starts, axis = 0)
+    mean = sums / counts[:, None]
+    dev = x - mean[inverse]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        stdev = np.sqrt(np.add.reduceat((dev ** 2)[by_group], starts, axis = 0) / (counts[:, None] - 1))
+    q3, q1, percentile_l, percentile_r = get_grouped_percentile(xs, starts, counts,
+                                                                [75, 25, 0 + percentile_limit, 100 - percentile_limit])
+
+    median = mad_dev = None
+    if mad is not None:
+        median = get_grouped_percentile(xs, starts, counts, [50])[0]
+        abs_dev = np.abs(x - median[inverse])
+        abs_dev_sorted = np.empty_like(abs_dev)
+        for col in range(x.shape[1]):
+            abs_dev_sorted[:, col] = abs_dev[np.lexsort((abs_dev[:, col], inverse)), col]
+        mad_dev = get_grouped_percentile(abs_dev_sorted, starts, counts, [50])[0][inverse]
+        median = median[inverse]
+
+    mask = outlier_mask_from_stats(x, mean[inverse], stdev[inverse], q1[inverse], q3[inverse],
+                                   percentile_l[inverse], percentile_r[inverse], median, mad_dev,
+                                   z = z, iqr_factor = iqr_factor, mad = mad)
+    # can't do statistics
+    mask &= counts[inverse] >= 2
+    return mask
+
+# filter a list with z-values, IQR and percentile limit. See get_outlier_mask.
+# return -> indices: list. indices of outlier items.
+def get_outlier_indices(x: list, z: float = None, iqr_factor: float = None, percentile_limit: float = 0,
+                        mad: float = None) -> list:
+    return np.flatnonzero(get_outlier_mask(x, z, iqr_factor, percentile_limit, mad)).tolist()
 
 # remove elements at positions {indices} in list {x}
 # return -> filtered list of x
 def remove_by_indices(x: list, indices: list) -> list:
+    indices = set(indices)
     return [x[i] for i in range(len(x)) if i not in indices]
 
+# remove elements where {mask} is True from {x}.
+# return -> filtered x, as an array if x is an array, as a list otherwise.
+def remove_by_mask(x: list|np.ndarray, mask: np.ndarray) -> list|np.ndarray:
+    if isinstance(x, np.ndarray):
+        return x[~mask]
+    return [val for val, outlier in zip(x, mask) if not outlier]
+
 # axes: list, or potentially list of lists, corresponding to many axes of the same data set.
 # no_outlier: a list of indices where we don't attempt to find outliers.
 #             Needed for independent variables.
-# **kwargs: filtering options, see arguments of get_outlier_indices
+# **kwargs: filtering options, see arguments of get_outlier_mask
 # return -> list: modified axes (original 1d/2d form preserved)
 def remove_outliers(axes: list, no_outlier: int|list = [], **kwargs) -> list:
-    # create shallow copy to avoid altering original
-    axes = [el for el in axes]
-
     # treat single list case first
     if (len(axes) == 0 or isinstance(axes[0], Number)):
-        outlier_indices = get_outlier_indices(axes, **kwargs)
-        return remove_by_indices(axes, outlier_indices)
+        return remove_by_mask(list(axes), get_outlier_mask(axes, **kwargs))
     
     # sanity check: must be at least uniform 2D list.
     l = len(axes[0])
@@ -115,18 +226,14 @@ def remove_outliers(axes: list, no_outlier: int|list = [], **kwargs) -> list:
     if type(no_outlier) is int:
         no_outlier = [no_outlier]
 
-    outlier_indices = set()
-    # find all the outlier indices first
-    for i in range(len(axes)):
-        if i in no_outlier:
-            continue
-        outlier_indices = outlier_indices | set(get_outlier_indices(axes[i], **kwargs))
+    # find all the outliers in one pass over the axes, then remove corresponding elements in each axis.
+    tested = [axes[i] for i in range(len(axes)) if i not in no_outlier]
+    if tested:
+        mask = get_outlier_mask(np.column_stack(tested), **kwargs)
+    else:
+        mask = np.zeros(l, dtype = bool)
 
-    # remove corresponding elements in each axis.
-    for i in range(len(axes)):
-        axes[i] = remove_by_indices(axes[i], outlier_indices)
-
-    return axes
+    return [remove_by_mask(axis, mask) for axis in axes]
 
 # return if {val} is in [l, r).
 # if either l or r is None, that side of the limit is ignored.
@@ -134,33 +241,104 @@ def remove_outliers(axes: list, no_outlier: int|list = [], **kwargs) -> list:
 def in_range(val: float, l: float = None, r: float = None) -> bool:
     return (l is None or l < val) and (r is None or val < r)
 
-# get a list of the paths to all the valid files (json) in a folder
-# paths: the folder(s) to look at, non-recursive.
+# get a list of the paths to all the valid files (json or binary, see datafile.py) in a folder
+# paths: the folder(s) to look at, non-recursive, or a catalog Query selecting files by metadata.
+#   Paths to files, e.g. already resolved by this function, are taken as they are.
 # return -> list of paths to valid files.
-def get_data_files(paths: str|list) -> list:
+def get_data_files(paths: str|list|Query) -> list:
+    if hasattr(paths, 'get_files'):     # Query; not isinstance, as lib modules may be imported twice (lib.catalog, catalog)
+        return paths.get_files()
+
     data_files = list() 
     if type(paths) is str:
         paths = [paths]
 
     for path in paths:
+        if os.path.isfile(path):
+            data_files.append(path)
+            continue
         data_files.extend(
                 [os.path.join(path, name) 
                 for name in os.listdir(path) 
                 if os.path.isfile(os.path.join(path, name))
-                and name.split('.')[-1] == 'json']
+                and name.split('.')[-1] in datafile.DATA_EXTENSIONS]
                 )
     return data_files
 
-# return a list of Data objects loaded from json files in {paths}.
-def get_data_list(paths: str|list) -> list:
-    data_list = list()
+# load a single json / binary file. Module-level, so that it can be run by worker processes.
+# return -> loaded Data.
+def load_data(name: str, lazy: bool = False) -> Data:
+    data = Data()
+    data.load(name, lazy = lazy)
+    return data
+
+# load {name} lazily, and reduce it in the same process, see iter_data_list.
+def load_and_reduce(name: str, reduce: callable):
+    return reduce(load_data(name, lazy = True))
+
+# load the files in {paths} (see get_data_files) in parallel, yielding each Data once it is loaded.
+# workers: number of worker processes. None: one per CPU. 1: load in this process.
+# ordered = True: yield in the order of get_data_files. False: yield in the order loading finishes.
+# Either way, at most 2 * workers files are loaded ahead of the consumer, so memory stays bounded
+#   if the consumer does not keep every Data.
+# progress = True: print the number of files loaded so far.
+# reduce: function of a Data, run where it is loaded. It must be module-level (or a functools.partial
+#   of one) to be run by worker processes. If given, each file is loaded lazily (so frames of files
+#   that reduce does not look into are never parsed), and the result of reduce is yielded instead of
+#   the Data; only results are sent back from worker processes.
+# return -> generator of Data, or of results of reduce.
+def iter_data_list(paths: str|list|Query, workers: int = None, ordered: bool = True, progress: bool = True,
+                   reduce: callable = None):
     data_files = get_data_files(paths)
-    for name in data_files:
-        data = Data()
-        data.load(name)
-        data_list.append(data)
+    n = len(data_files)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def report(cnt: int):
+        if progress and (cnt % max(n // 100, 1) == 0 or cnt == n):
+            print(f'\riter_data_list: loaded {cnt}/{n} files', end = '' if cnt < n else '\n')
+
+    task = load_data if reduce is None else partial(load_and_reduce, reduce = reduce)
+
+    if workers <= 1 or n <= 1:
+        for i, name in enumerate(data_files):
+            data = task(name)
+            report(i + 1)
+            yield data
+        return
 
-    return data_list
+    names = iter(data_files)
+    pending = deque()
+    cnt = 0
+    with ProcessPoolExecutor(max_workers = min(workers, n)) as executor:
+        for name in islice(names, 2 * workers):
+            pending.append(executor.submit(task, name))
+
+        while pending:
+            if ordered:
+                future = pending.popleft()
+            else:
+                done, _ = wait(pending, return_when = FIRST_COMPLETED)
+                future = next(iter(done))
+                pending.remove(future)
+
+            data = future.result()
+            cnt += 1
+            report(cnt)
+            for name in islice(names, 1):
+                pending.append(executor.submit(task, name))
+            yield data
+
+# return a list of Data objects loaded from json / binary files in {paths} (see get_data_files).
+# lazy = True: only metadata is read for now, and frames of each Data are loaded on first access.
+#   This way, files filtered out by metadata (e.g. in get_result_by_batch) are never parsed.
+# lazy = False: all files are loaded in full, in parallel, see iter_data_list.
+# workers, progress: see iter_data_list. Only used if lazy = False.
+def get_data_list(paths: str|list|Query, lazy: bool = True, workers: int = None, progress: bool = False) -> list:
+    if not lazy:
+        return list(iter_data_list(paths, workers = workers, progress = progress))
+
+    return [load_data(name, lazy = True) for name in get_data_files(paths)]
 """
 SNAPTAIN processing functions 
 """
@@ -168,22 +346,34 @@ SNAPTAIN processing functions
 # the lift that frame is then normalised by frequency squared of the picked peak.
 # this gives us a coefficient of lift (CL) against time plot.
 # CL is then filtered for outliers (1.5 IQR, z = 3).
+# track: None, or arguments of tracking.track_data (e.g. {'blades': 2}) to normalise by the frequency
+#   tracked through the spectrogram of the audio instead, which does not jump between harmonics.
 # return -> (time: list, CL: list)  (filtered)
-def w2_normalisation(data: Data, fl:float = None, fr:float = None) -> tuple[list, list]:
+def w2_normalisation(data: Data, fl:float = None, fr:float = None, track: dict = None) -> tuple[list, list]:
     norm_t = list()
     norm_val = list()
-    for frame in data.frames:
-        for freq in frame.peak_freq:
-            # lies outside the specified range
-            if not in_range(freq, fl, fr):
-                continue
-
-            # match found
-            lift = frame.get_total_mass()
-            norm_t.append(frame.t)
-            norm_val.append(lift / freq**2) 
-            # only take first / tallest one
-            break
+    if track is None and needs_tracking(data):
+        print(f'(W) w2_normalisation: data {data.timestamp} has audio but no peaks (see Data.add); tracking instead.')
+        track = dict()
+    if track is not None:
+        freq = tracking.track_data(data, fl = fl or 0, fr = fr or 20000, **track).get_freq(data.get_t())
+        found = ~np.isnan(freq)
+        norm_t = data.get_t()[found].tolist()
+        norm_val = (data.get_total_mass()[found] / freq[found]**2).tolist()
+    else:
+        for frame in data.frames:
+            # frames without audio have no peaks.
+            for freq in frame.peak_freq or ():
+                # lies outside the specified range
+                if not in_range(freq, fl, fr):
+                    continue
+
+                # match found
+                lift = frame.get_total_mass()
+                norm_t.append(frame.t)
+                norm_val.append(lift / freq**2) 
+                # only take first / tallest one
+                break
 
     norm_t, norm_val = remove_outliers([norm_t, norm_val],
                                        no_outlier = 0,  # t is independent variable
@@ -193,7 +383,7 @@ def w2_normalisation(data: Data, fl:float = None, fr:float = None) -> tuple[list
     return norm_t, norm_val
 
 # plot w2_normalisation result for a single Data dump.
-def w2_norm_plot(data: Data, fig: str = None, fl = None, fr = None):
+def w2_norm_plot(data: Data, fig: str = None, fl = None, fr = None, track: dict = None):
     plt.ioff()
     plt.clf()
 
@@ -201,7 +391,7 @@ def w2_norm_plot(data: Data, fig: str = None, fl = None, fr = None):
         print(f':w2_norm_plot: data provided does not have a height defined; Abort.')
         return
 
-    x, y = w2_normalisation(data, fl = fl, fr = fr)
+    x, y = w2_normalisation(data, fl = fl, fr = fr, track = track)
 
     mean = st.mean(y)
     stdev = st.stdev(y)
@@ -219,7 +409,7 @@ def w2_norm_plot(data: Data, fig: str = None, fl = None, fr = None):
 
 # process all Data files in a path, for each find a mean CL value,
 # then plot that against height.
-def w2_norm_height_plot(data_list: list, fig: str = None, fl = None, fr = None):
+def w2_norm_height_plot(data_list: list, fig: str = None, fl = None, fr = None, track: dict = None):
     plt.ioff()
     plt.clf()
     height = []
@@ -233,7 +423,7 @@ def w2_norm_height_plot(data_list: list, fig: str = None, fl = None, fr = None):
             continue
 
         print(f':w2_norm_height_plot: processing {data.timestamp}')
-        norm_t, norm_val = w2_normalisation(data, fl, fr)
+        norm_t, norm_val = w2_normalisation(data, fl, fr, track)
         height.append(data.height)
         lift_const.append(st.mean(norm_val)) 
         lift_const_err.append(st.stdev(norm_val))
@@ -250,80 +440,129 @@ def w2_norm_height_plot(data_list: list, fig: str = None, fl = None, fr = None):
     plt.show()
     plt.clf()
 
+# plot the spectrogram of the audio of {data}, in dB. See spectrum.from_data.
+# kwargs: see spectrum.STFT, e.g. nperseg, hop, average, fl, fr.
+def spectrogram_plot(data: Data, fig: str = None, **kwargs):
+    plt.ioff()
+    plt.clf()
+
+    spectrogram = spectrum.from_data(data, **kwargs)
+    with np.errstate(divide = 'ignore'):
+        power = 10 * np.log10(spectrogram.power.T)
+    plt.pcolormesh(spectrogram.t, spectrogram.freq, power, shading = 'nearest')
+    plt.colorbar(label = 'PSD / dB')
+    plt.xlabel('time / s')
+    plt.ylabel('frequency / Hz')
+    plt.title(f'h = ${data.height}$ cm')
+
+    if fig:
+        plt.savefig(fig)
+    plt.show()
+    plt.clf()
+
+# return -> True if {data} has audio but no peaks, e.g. recorded with the STFT of Data.listen (see Data.add),
+#   so that its frequency can only be found by tracking (see tracking.track_data).
+def needs_tracking(data: Data) -> bool:
+    return (all(peaks is None for peaks in data.get_peak_freq())
+            and any(audio is not None and len(audio) for audio in data.get_audio()))
+
+# bin of each frame of {data} by frequency: that of its first (tallest) peak within (endpoints[0], endpoints[-1]).
+# data with audio but no peaks is binned by the frequency tracked through its spectrogram instead.
+# a peak on an inner endpoint belongs to neither bin, as with in_range.
+# return -> array [n_frames] of bin indices, -1 where none.
+def get_w_bins(data: Data, endpoints) -> np.ndarray:
+    endpoints = np.asarray(endpoints, dtype = float)
+    if needs_tracking(data):
+        print(f'(W) get_w_bins: data {data.timestamp} has audio but no peaks (see Data.add); tracking instead.')
+        freq = tracking.track_data(data, fl = endpoints[0], fr = endpoints[-1]).get_freq(data.get_t())
+        frames = np.flatnonzero((endpoints[0] < freq) & (freq < endpoints[-1]))
+        freq = freq[frames]
+    else:
+        peak_freq = data.get_peak_freq()
+        lengths = np.array([len(peaks) if peaks is not None else 0 for peaks in peak_freq], dtype = int)
+        values = np.concatenate([np.asarray(peaks, dtype = float) for peaks in peak_freq if peaks is not None] or [np.empty(0)])
+        frame = np.repeat(np.arange(len(lengths)), lengths)
+        inside = (endpoints[0] < values) & (values < endpoints[-1])
+        # first peak inside, of each frame that has one.
+        frames, first = np.unique(frame[inside], return_index = True)
+        freq = values[inside][first]
+
+    bins = np.full(len(data.get_t()), -1)
+    if not len(freq):
+        return bins
+    right = np.searchsorted(endpoints, freq, side = 'left')
+    bins[frames] = np.where(endpoints[right] == freq, -1, right - 1)
+    return bins
+
 # bin lift values by frequency ranges.
 # endpoints: endpoints for the bin intervals. 
-#   [endpoints[0], endpoints[1]) is the interval for the first bin.
+#   (endpoints[0], endpoints[1]) is the interval for the first bin.
 #   the list must be sorted.
 # return -> bins: list(list)
 #   for example bin[0] stores lift of all frames whose peak is between endpoints[0] and endpoints[1]
 def bin_by_w(data: Data, endpoints: list) -> list:
-    # element-wise comparison
-    if (sorted(endpoints) != endpoints).all():
+    if np.any(np.diff(endpoints) < 0):
         print('(E) :bin_by_w: the endpoints provided are not sorted. Bins ill-defined.')
 
-    fl = endpoints[0]
-    fr = endpoints[-1]
-    # the naive [] * n will fail, as it creates copies of the same list
-    bins = [list() for i in range(len(endpoints) - 1)] 
-    
-    for frame in data.frames:
-        for freq in frame.peak_freq:
-            if not in_range(freq, fl, fr):
-                continue
-            # else in range, find which bin the data belongs to
-            for i in range(0, len(endpoints) - 1):
-                if in_range(freq, endpoints[i], endpoints[i + 1]):
-                    bins[i].append(frame.get_total_mass())
-                    break
-            break
-
-    return bins
+    bins = get_w_bins(data, endpoints)
+    lift = data.get_total_mass()
+    return [lift[bins == i].tolist() for i in range(len(endpoints) - 1)]
+
+# bin the lift of the frames of all of {data_list} by w (see get_w_bins) and by height, at once.
+# within each (bin, height), lift is filtered for outliers (z, iqr_factor, see get_outlier_mask).
+# return -> aggregate.BinTable
+def get_bin_table(data_list: list, endpoints: list, z: float = 3, iqr_factor: float = 1.5) -> BinTable:
+    if np.any(np.diff(endpoints) < 0):
+        print('(E) :get_bin_table: the endpoints provided are not sorted. Bins ill-defined.')
+    endpoints = np.asarray(endpoints, dtype = float)
+    n_bins = len(endpoints) - 1
+
+    heights = list()
+    height_rank = dict()
+    bin_list = list()
+    height_list = list()
+    lift_list = list()
+    for data in data_list:
+        print(f':get_bin_table: Processing {data.timestamp}')
+        if data.height is None:
+            print(f'(W) get_bin_table: height in {data.timestamp} is undefined.')
+            continue
+        if data.height not in height_rank:
+            height_rank[data.height] = len(heights)
+            heights.append(data.height)
+
+        bins = get_w_bins(data, endpoints)
+        binned = bins >= 0
+        bin_list.append(bins[binned])
+        height_list.append(np.full(np.count_nonzero(binned), height_rank[data.height]))
+        lift_list.append(data.get_total_mass()[binned])
+
+    n_heights = len(heights)
+    if bin_list:
+        group = np.concatenate(bin_list) * n_heights + np.concatenate(height_list)
+        lift = np.concatenate(lift_list)
+    else:
+        group, lift = np.zeros(0, dtype = int), np.zeros(0)
+
+    keep = ~get_grouped_outlier_mask(lift, group, z = z, iqr_factor = iqr_factor, percentile_limit = 0)
+    order = np.argsort(group, kind = 'stable')
+    order = order[keep[order]]
+    group, lift = group[order], lift[order]
+
+    count = group_count(group, n_bins * n_heights).reshape(n_bins, n_heights)
+    total = np.bincount(group, weights = lift, minlength = n_bins * n_heights).reshape(n_bins, n_heights)
+    return BinTable(heights, endpoints, group, lift, count, total)
 
 # bin the lift values by w and for each bin, plot a scatter plot of lift versus distance.
 # different bins distinguished by colour.
 def bin_by_w_plot(data_list: list, endpoints: list, fig: str = None):
     plt.clf()
 
-    # height -> bins 
-    bins_by_height = dict()
-
-    for data in data_list:
-        print(f':bin_by_w_plot: Processing {data.timestamp}')
-        height = data.height
-
-        if height is None:
-            print(f'(W) bin_by_w_plot: height in {data.timestamp} is undefined.')
-            continue
+    table = get_bin_table(data_list, endpoints)
 
-        bins = bin_by_w(data, endpoints)
-        if height not in bins_by_height:
-            bins_by_height[height] = bins
-        else:
-            orig_bins = bins_by_height[height]
-            # combine the bins directly, since colouring by bin stops us
-            # from differentiating data sets anyway.
-            bins_by_height[height] = [orig_bins[i] + bins[i] for i in range(len(bins))]
-
-    # O(n^3). So wow...
     # for each particular bin...
     for i in range(0, len(endpoints) - 1):
-        print(f':bin_by_w_plot: Processing bin num. {i}')
-        d = list() 
-        lift = list()
-        # for each particular height...
-        for height, bins in bins_by_height.items():
-            # n-th bin in bins at this height.
-            # can't use 'bin', since that is a python keyword.
-            bn = bins[i]
-            bn = remove_outliers(bn,
-                                 z = 3,
-                                 iqr_factor = 1.5,
-                                 percentile_limit = 0)
-
-            # take the frames in the correct bin,
-            for mass in bn:
-                d.append(height)
-                lift.append(mass)
+        d, lift = table.get_bin(i)
 
         plt.plot(d,
                  lift,
@@ -350,16 +589,48 @@ def bin_by_w_plot(data_list: list, endpoints: list, fig: str = None):
 BETAFLIGHT processing functions
 """
 # Read Data dumps from path, and sort them into batches (height, timestamp) and for each batch, into different rpm.
+# filtering only uses metadata, so frames of lazily loaded Data that are filtered out are never loaded.
+# data_list: list of Data, or a catalog Query, whose files are then loaded with get_data_list.
 # heights: height (float) or heights (float) to show in plot. None: all heights.
 # rpm_range: lower (rpm_range[0]) and upper (rpm_range[1]) limit for rpm range of interest.
+# time_window: (t0, t1), only use frames with t0 <= t < t1, in seconds from the start of each run (see Data.window).
+#   Either can be None, e.g. (5, None) drops the first 5 seconds of every run, to remove transients.
+# z, iqr_factor: outlier filtering of each target rpm by mean rpm and total mass, see get_outlier_mask.
 # return -> result_by_batch: dict = (batch -> result_by_rpm), where
 #   result_by_rpm: dict = (target_rpm -> frames)
-def get_result_by_batch(data_list: list, heights: Number|list = None, rpm_range: tuple = None) -> dict:
+def get_result_by_batch(data_list: list|Query, **kwargs) -> dict:
+    return group_by_batch(data_list, **kwargs)[0]
+
+# same as get_result_by_batch, but also return the outlier filtering.
+# return -> (result_by_batch, keep_by_batch), where
+#   keep_by_batch: dict = (batch -> (target_rpm -> boolean array)), True for each frame kept, out of all
+#   frames of the target rpm in the batch, in order of data_list.
+def group_by_batch(data_list: list|Query, **kwargs) -> tuple[dict, dict]:
+    table, selected = get_group_table(data_list, **kwargs)
+
+    result_by_batch = {batch: dict() for batch in table.batches}
+    keep_by_batch = {batch: dict() for batch in table.batches}
+    ends = np.cumsum(np.bincount(table.group, minlength = len(table)))
+    for g, (target_rpm, end) in enumerate(zip(table.targets, ends)):
+        batch = table.batches[table.group_batch[g]]
+        start = end - np.count_nonzero(table.keep[g])
+        result_by_batch[batch][target_rpm] = [selected[source].get_frame(index)
+                                              for source, index in zip(table.source[start:end], table.index[start:end])]
+        keep_by_batch[batch][target_rpm] = table.keep[g]
+
+    return result_by_batch, keep_by_batch
+
+# get_result_by_batch in columnar form, see aggregate.GroupTable. Arguments are the same.
+# return -> (table, selected), where selected: list of the Data that frames in table come from (table.source).
+def get_group_table(data_list: list|Query, heights: Number|list = None, rpm_range: tuple = None,
+                    time_window: tuple = None, z: float = 3, iqr_factor: float = 1.5) -> tuple[GroupTable, list]:
+    if hasattr(data_list, 'get_files'):
+        data_list = get_data_list(data_list)
     if isinstance(heights, Number):
         heights = [heights]
 
-    result_by_batch = dict()   # tuple(height, timestamp) -> list(result_by_rpm: dict)
-    # for each result_by_rpm: rpm[4] -> list(frames: Frame)
+    selected = list()
+    keys = list()   # (batch, target_rpm) of each selected Data
     # group all with the same height into a series, in which group those with the same target into the same point which we do statistics on.
     for data in data_list:
         if 'betaflight' not in data.platform:
@@ -379,36 +650,98 @@ def get_result_by_batch(data_list: list, heights: Number|list = None, rpm_range:
         print(f'get_result_by_batch: Processing file {data.timestamp}.')
         # NOTE: uncomment this hack if you want differentiating by timestamp...
         # height = data.timestamp
-        if batch not in result_by_batch.keys():
-            result_by_batch[batch] = dict()
-
-        result_by_rpm = result_by_batch[batch]  # target_rpm: tuple -> list(frames)
-        target = tuple(data.target_rpm)
-        if target not in result_by_rpm.keys():
-            result_by_rpm[target] = list()
-
-        result_by_rpm[target].extend(data.frames)
-    
-    for batch, result_by_rpm in result_by_batch.items():
-        for target_rpm, frames in result_by_rpm.items():
-            rpm = [frame.get_mean_rpm() for frame in frames]
-            total_mass = [frame.get_total_mass() for frame in frames]
-
-            # filter frames with data in rpm and total_mass
-            # [0] at the end extracts filtered frames from the the three-elemnt list.
-            result_by_rpm[target_rpm] = remove_outliers([frames, rpm, total_mass],
-                                                        no_outlier = 0,
-                                                        z = 3,
-                                                        iqr_factor = 1.5,
-                                                        percentile_limit = 0)[0]
-
-        result_by_batch[batch] = dict(sorted(result_by_rpm.items(),
-                                             key = lambda pair:st.mean(pair[0])))
-
-    # sort by heights
-    result_by_batch = dict(sorted(result_by_batch.items()))
-
-    return result_by_batch
+        if time_window is not None:
+            data = data.window(*time_window, relative = True)
+        selected.append(data)
+        keys.append((batch, tuple(data.target_rpm)))
+
+    # order groups by batch, then by mean target rpm; ties in order of appearance.
+    group_keys = sorted(dict.fromkeys(keys), key = lambda key: (key[0], st.mean(key[1])))
+    rank = {key: g for g, key in enumerate(group_keys)}
+    batches = list(dict.fromkeys(batch for batch, _ in group_keys))
+    batch_rank = {batch: b for b, batch in enumerate(batches)}
+
+    counts = [len(data.frames) for data in selected]
+    group = np.repeat(np.array([rank[key] for key in keys], dtype = int), counts)
+    source = np.repeat(np.arange(len(selected)), counts)
+    index = np.concatenate([np.arange(cnt) for cnt in counts]) if counts else np.zeros(0, dtype = int)
+    values = (np.concatenate([np.column_stack((data.get_mean_rpm(), data.get_total_mass())) for data in selected])
+              if selected else np.zeros((0, 2)))
+
+    # filter frames with data in rpm and total_mass, within each group, all groups at once.
+    keep = ~get_grouped_outlier_mask(values, group,
+                                     z = z,
+                                     iqr_factor = iqr_factor,
+                                     percentile_limit = 0)
+
+    # make the frames of each group contiguous, keeping their order.
+    order = np.argsort(group, kind = 'stable')
+    ends = np.cumsum(np.bincount(group, minlength = len(group_keys)))
+    keep_by_group = [keep[order[end - cnt:end]] for end, cnt in zip(ends, np.diff(ends, prepend = 0))]
+    order = order[keep[order]]
+
+    table = GroupTable(batches = batches,
+                       group_batch = np.array([batch_rank[batch] for batch, _ in group_keys], dtype = int),
+                       targets = [target_rpm for _, target_rpm in group_keys],
+                       group = group[order],
+                       rpm = values[order, 0],
+                       total_mass = values[order, 1],
+                       source = source[order],
+                       index = index[order],
+                       keep = keep_by_group)
+    return table, selected
+
+# cache used by get_lift_by_batch when none is given, see cache.ResultCache. None: no caching.
+result_cache = None
+
+# lift_rpm of every batch of get_result_by_batch, i.e. what the plotting functions below need.
+# if a cache is used, and every Data in data_list was loaded from a file and not modified since (see Data.source),
+#   results are looked up by the files and the arguments, and lazily loaded Data are never loaded
+#   if the result is found.
+# avg: see lift_rpm.
+# cache: ResultCache to use. None: use result_cache.
+# **kwargs: arguments to be passed to get_result_by_batch.
+# return -> lift_by_batch: dict = (batch -> (x, y, xerr, yerr)), see lift_rpm.
+def get_lift_by_batch(data_list: list|Query, avg: bool = True, cache: ResultCache = None, **kwargs) -> dict:
+    if hasattr(data_list, 'get_files'):
+        data_list = get_data_list(data_list)
+    if cache is None:
+        cache = result_cache
+
+    key = None
+    if cache is not None and all(data.source is not None for data in data_list):
+        key = cache.get_key([data.source for data in data_list], avg = avg, **kwargs)
+        cached = cache.get(key)
+        if cached is not None:
+            header, _ = cached
+            return {tuple(entry['batch']): tuple(entry['lift']) for entry in header['batches']}
+
+    table, _ = get_group_table(data_list, **kwargs)
+    lift_by_batch = table.get_lift(avg)
+
+    if key is not None:
+        # per (batch, target_rpm): number of frames before and after filtering, and which were kept.
+        header = {'batches': [{'batch': list(batch), 'targets': list(), 'lift': lift_by_batch[batch]}
+                              for batch in table.batches]}
+        arrays = dict()
+        for g, (target_rpm, keep) in enumerate(zip(table.targets, table.keep)):
+            arrays[f'keep_{g}'] = keep
+            header['batches'][table.group_batch[g]]['targets'].append({'target_rpm': list(target_rpm),
+                                                                        'count': len(keep),
+                                                                        'kept': int(np.count_nonzero(keep))})
+        cache.put(key, header, arrays)
+
+    return lift_by_batch
+
+# CL of every batch of get_result_by_batch, with bootstrap confidence intervals that account for the
+# scatter of frames within each (height, target_rpm) group, see aggregate.bootstrap_cl_by_batch.
+# n_replicates, confidence, avg, seed, workers: see aggregate.bootstrap_cl_by_batch.
+# **kwargs: arguments to be passed to get_result_by_batch.
+# return -> cl_by_batch: dict = (batch -> (slope, stderr, lower, upper))
+def get_cl_bootstrap_by_batch(data_list: list|Query, n_replicates: int = 1000, confidence: float = 0.95, avg: bool = True,
+                              seed = None, workers: int = 1, **kwargs) -> dict:
+    table, _ = get_group_table(data_list, **kwargs)
+    return bootstrap_cl_by_batch(table, n_replicates, confidence, avg, seed = seed, workers = workers)
 
 # calculates parameters for plotting a single line of lift against rpm
 # result_by_rpm: dict(target_rpm -> frames)
@@ -447,7 +780,7 @@ def lift_rpm(result_by_rpm: dict, avg: bool = True):
     return x, y, xerr, yerr
 
 
-# calls get_result_by_batch to process data.
+# calls get_lift_by_batch to process data.
 # avg = True: take time-averaged mean_rpm and total_mass
 # fig: path to save lift against rpm2 plots.
 # kwargs: arguments to be passed to get_result_by_batch
@@ -455,13 +788,12 @@ def lift_rpm2_plot(data_list: list, avg: bool = True, fig: str = None, **kwargs)
     plt.ioff()
     plt.clf()
 
-    result_by_batch = get_result_by_batch(data_list, **kwargs)
+    lift_by_batch = get_lift_by_batch(data_list, avg, **kwargs)
 
     fig_, axs = plt.subplots(2, 1, figsize=(8, 10))
 
     # for every series, do:
-    for (height, timestamp), result_by_rpm in result_by_batch.items():
-        x, y, xerr, yerr = lift_rpm(result_by_rpm, avg)
+    for (height, timestamp), (x, y, xerr, yerr) in lift_by_batch.items():
         xerr = [2 * xx * xe for xx, xe in zip(x, xerr)]
         x = [xx ** 2 for xx in x]
         y_fit = errorbar_plot(x, y, xerr, yerr,
@@ -494,11 +826,9 @@ def cl_w_plot(data_list: list, avg: bool = True, fig: str = None, **kwargs):
     plt.ioff() 
     plt.clf()
 
-    result_by_batch = get_result_by_batch(data_list, **kwargs)
-
-    for (height, timestamp), result_by_rpm in result_by_batch.items():
-        x, y, xerr, yerr = lift_rpm(result_by_rpm, avg)
+    lift_by_batch = get_lift_by_batch(data_list, avg, **kwargs)
 
+    for (height, timestamp), (x, y, xerr, yerr) in lift_by_batch.items():
         yerr = [sqrt((ye * 1 / (xx**2)) ** 2
                     + (xe * 2 * yy / (xx**3)) ** 2)
                 for xx, yy, xe, ye in zip(x, y, xerr, yerr)]
@@ -522,22 +852,34 @@ def cl_w_plot(data_list: list, avg: bool = True, fig: str = None, **kwargs):
 
 # plot a graph of CL (coefficient of lift) against height.
 # avg = True: take time-average of mean_rpm and total_mass.
-def cl_height_plot(data_list: list, avg: bool = True,fit: bool = True, fig: str = None, **kwargs):
+# bootstrap: number of bootstrap replicates, see get_cl_bootstrap_by_batch. If given, error bars are the 95%
+#   bootstrap confidence intervals, instead of the stderr of the regression.
+# fit: fit {model} (see fitting.MODELS; 4 is the ground effect model) to CL against height, and plot it with
+#   its residuals. prop_spacing, prop_radius: of the rig the data was recorded on, in cm. Models that need
+#   prop_spacing are not fitted without it.
+# offsets: values of the c4 height offset of model 4 to scan (see fitting.profile_scan); the fit of least
+#   residuals is plotted. None: the default offset of the model.
+# fit_workers: number of worker processes for the scan, see fitting.fit_all.
+def cl_height_plot(data_list: list, avg: bool = True,fit: bool = True, fig: str = None, bootstrap: int = 0,
+                   model: int = 4, prop_spacing: float = None, prop_radius: float = 5.08, offsets: list = None,
+                   fit_workers: int = None, **kwargs):
     plt.ioff()
     plt.clf()
-    result_by_batch = get_result_by_batch(data_list, **kwargs)
 
     # cl: coefficient of lift
     x_cl, y_cl, yerr_cl = ([] for i in range(3))
 
-    for (height, timestamp), result_by_rpm in result_by_batch.items():
-        x, y, xerr, yerr = lift_rpm(result_by_rpm, avg)
-        x = [xx ** 2 for xx in x]
-
-        res = scipy.stats.linregress(x, y)
-        x_cl.append(height)
-        y_cl.append(res.slope)
-        yerr_cl.append(res.stderr)
+    if bootstrap:
+        for (height, timestamp), (cl, cl_stderr, lower, upper) in get_cl_bootstrap_by_batch(data_list, bootstrap, avg = avg, **kwargs).items():
+            x_cl.append(height)
+            y_cl.append(cl)
+            # the point estimate may fall outside a percentile interval; the bar then starts at the point.
+            yerr_cl.append([[max(0, cl - lower)], [max(0, upper - cl)]])
+    else:
+        for (height, timestamp), (cl, cl_stderr) in get_cl_by_batch(get_lift_by_batch(data_list, avg, **kwargs)).items():
+            x_cl.append(height)
+            y_cl.append(cl)
+            yerr_cl.append(cl_stderr)
      
     for i in range(len(x_cl)):
         errorbar_plot(x_cl[i], y_cl[i], yerr = yerr_cl[i])
@@ -546,76 +888,83 @@ def cl_height_plot(data_list: list, avg: bool = True,fit: bool = True, fig: str
     plt.xlabel('height / cm')
     plt.ylabel('CL / (g s^2)')
 
-    # fit using the assumption that ground effect behaves as the eqn
-    # values of height (x) are made non dimensional by dividing by prop_spacing
-
-    if (fit == True) :
-        print(1)
-        prop_spacing = 16
-
-        def ground_effect(x,c1,c2,c3):
-            c0 =0
-            c4 =3
-            return np.piecewise(x,[x < c0, x >= c0], [lambda x: c1/(np.power((c0+c4)/prop_spacing,c3))+c2, lambda x: c1/(np.power((x+c4)/prop_spacing,c3))+c2])
-
-        def pipe_effect(x, c5, c6,c7):
-            return np.piecewise(x, [x < 0, x >= 0], [lambda x: 0, lambda x: -c5 * (x/prop_spacing) / (np.power(c7, x/prop_spacing*c6))])
-
-
-        def overall_effect(x,a1,a2,a3,e1,e2):
-            return(a1*(1+np.power((x/a2),e1))*(1/(1+np.power((x/a3),e2))))
-
-        fit , cov = scipy.optimize.curve_fit(overall_effect,x_cl,y_cl,p0 = np.asarray([1,3,50,-1,-1]),maxfev = 10000)
+    if fit and prop_spacing is None and model in (2, 4):
+        print(f'(W) cl_height_plot: prop_spacing of the rig not given; model {model} is not fitted.')
+    elif fit:
+        job = fitting.FitJob(x_cl, y_cl, model, prop_spacing = prop_spacing, prop_radius = prop_radius)
+        if offsets is not None:
+            best, _ = fitting.profile_scan(job, {'c4': offsets}, workers = fit_workers).get_best()
+            print(f'cl_height_plot: least residuals at {best}.')
+            job = fitting.FitJob(**(job.__dict__ | {'fixed': best}))
+        result = fitting.fit(job)
 
         plt.subplot(2,1,1)
         x_ref = np.linspace(min(x_cl), max(x_cl), 1000)
-        plt.plot(x_ref,overall_effect(x_ref,*fit))
-        overall_residual = [a-b for a,b in zip(y_cl, [overall_effect(a,*fit) for a in x_cl])]
+        plt.plot(x_ref, result.evaluate(x_ref, **job.get_consts()))
+        overall_residual = np.asarray(y_cl) - result.evaluate(x_cl, **job.get_consts())
         plt.subplot(2,1,2)
         plt.plot(x_cl,overall_residual)
         plt.plot(x_ref,np.zeros(len(x_ref)))
-        print(fit)
-
-    # try a range of C4, calculate the residuals of optimal fits with a given C4
-    # a reasonable c4 value is 3
-    '''
-    
-    c4_fit = []
-    c4_res = []
-    c4_list = []
-    for i in range(0,500):
-        c4 = i/50
-        fit_temp, cov_temp = scipy.optimize.curve_fit(ground_effect,x_cl,y_cl,p0 = np.asarray([4e-6, 2.3e-6, 1]),maxfev = 10000)
-        c4_fit.append(fit_temp)
-        c4_res.append(sum([a-b for a,b in zip(y_cl, [ground_effect(a,*fit_temp) for a in x_cl])]))
-        c4_list.append(c4)
-    plt.subplot(2,1,2)
-    plt.plot(c4_list,c4_res)
-    '''
-    # code used to fit ground effect first and then pipe effect
-    '''
-    fit_ground, e_ground = scipy.optimize.curve_fit(ground_effect,x_cl,y_cl,p0 = np.asarray([4e-6, 2.3e-6, 1]),maxfev = 10000)
-    x_ref = np.linspace(min(x_cl), max(x_cl), 1000)
+        print(fitting.format_table([result]))
 
-    #plot both the initial value curve and the optimised curve
-    plt.plot(x_ref, ground_effect(x_ref, *p0_ground))
-    plt.plot(x_ref, ground_effect(x_ref, *fit_ground))
-    print(fit_ground)
-
-    residual_ground = [a-b for a,b in zip(y_cl, [ground_effect(a,*fit_ground) for a in x_cl])]
-    # fit residual using pipe effect assuming equation below
+    if fig:
+        plt.savefig(fig)
+    plt.show()
+    plt.clf()
 
-    fit_pipe, e_pipe = scipy.optimize.curve_fit(pipe_effect,x_cl,residual_ground,maxfev = 10000)
-    '''
+# plot the profile of the residuals of fits of CL against height, over a grid of fixed parameters
+# of the model, e.g. the c4 offset of the ground effect model (see fitting.profile_scan).
+# grid: dict (name -> values), e.g. {'c4': np.linspace(0, 10, 500)}. One or two parameters can be plotted.
+# model: see fitting.MODELS. The ground effect model of cl_height_plot is 4.
+# workers: number of worker processes, see fitting.fit_all.
+# return -> fitting.Profile
+def profile_plot(data_list: list, grid: dict, model: int = 4, avg: bool = True, fig: str = None,
+                 prop_spacing: float = 16, prop_radius: float = 5.08, workers: int = None, **kwargs):
+    plt.ioff()
+    plt.clf()
+    if not 1 <= len(grid) <= 2:
+        raise ValueError(f'(E) processor::profile_plot: can only plot profiles over 1 or 2 parameters, got {list(grid)}.')
+
+    cl_by_batch = get_cl_by_batch(get_lift_by_batch(data_list, avg, **kwargs))
+    x_cl = [height for height, timestamp in cl_by_batch]
+    y_cl = [cl for cl, cl_stderr in cl_by_batch.values()]
+
+    profile = fitting.profile_scan(fitting.FitJob(x_cl, y_cl, model, prop_spacing = prop_spacing, prop_radius = prop_radius),
+                                   grid, workers = workers)
+    best, params = profile.get_best()
+    print(f'profile_plot: best fit at {best}: {params}')
+
+    if len(grid) == 1:
+        plt.plot(profile.values[0], profile.rss)
+        plt.xlabel(profile.names[0])
+        plt.ylabel('residual sum of squares')
+    else:
+        plt.contourf(profile.values[1], profile.values[0], profile.get_log_likelihood(), levels = 50)
+        plt.colorbar(label = 'profile log likelihood')
+        plt.xlabel(profile.names[1])
+        plt.ylabel(profile.names[0])
+    plt.title(f'profile of model {model} fits of CL against height')
 
     if fig:
         plt.savefig(fig)
     plt.show()
     plt.clf()
+    return profile
 
-# this is function to plot for multiple sets of data and multiple fit functions
+# return -> name of the data set of {data_list} that does not depend on its position among others, e.g. as the
+#   label of fits kept for warm starts (see fitting.fit_all): the folder of its files, or, for data not loaded
+#   from files, the timestamps of its data.
+def get_data_label(data_list: list) -> str:
+    sources = [data.source for data in data_list if data.source is not None]
+    if sources:
+        return os.path.commonpath([os.path.abspath(os.path.dirname(source)) for source in sources])
+    return ','.join(str(timestamp) for timestamp in sorted({data.timestamp for data in data_list}, key = str))
 
-def cl_height_plot_multiple(data_lists: list,data_choice:list = [0,2], avg: bool = True,fit: bool = True, fig: str = None, model: int = 1, **kwargs):
+# this is function to plot for multiple sets of data and multiple fit functions
+# fit: fit {model} (see fitting.MODELS) to each set of data, in {fit_workers} processes (None: one per CPU).
+# warm_start: json file of previous fits to start from, see fitting.fit_all.
+def cl_height_plot_multiple(data_lists: list,data_choice:list = [0,2], avg: bool = True,fit: bool = True, fig: str = None, model: int = 1,
+                            fit_workers: int = None, warm_start: str = None, **kwargs):
     plt.ioff()
     plt.clf()
     multi_data = []
@@ -623,22 +972,18 @@ def cl_height_plot_multiple(data_lists: list,data_choice:list = [0,2], avg: bool
     markers = ['x','o','s','v','^']
 
     for i in range(len(data_lists)):
-        result_by_batches=(get_result_by_batch(data_lists[i], **kwargs))
+        cl_by_batch = get_cl_by_batch(get_lift_by_batch(data_lists[i], avg, **kwargs))
 
         # cl: coefficient of lift
         x_cl, y_cl, yerr_cl = ([] for j in range(3))
 
-        for (height, timestamp), result_by_rpm in result_by_batches.items():
-            x, y, xerr, yerr = lift_rpm(result_by_rpm, avg)
-            x = [xx ** 2 for xx in x]
-
-            res = scipy.stats.linregress(x, y)
+        for (height, timestamp), (cl, cl_stderr) in cl_by_batch.items():
             x_cl.append(height)
             if (i==1):
-                y_cl.append(res.slope + 2.0713488097364073e-07)
+                y_cl.append(cl + 2.0713488097364073e-07)
             else:
-                y_cl.append(res.slope)
-            yerr_cl.append(res.stderr)
+                y_cl.append(cl)
+            yerr_cl.append(cl_stderr)
         # store multiple sets of data for different drone size
         multi_data.append([x_cl,y_cl,yerr_cl])
 
@@ -654,104 +999,27 @@ def cl_height_plot_multiple(data_lists: list,data_choice:list = [0,2], avg: bool
     plt.ylabel('CL / (g s^2)')
 
     # fit and plot fitted line for each set of data
-    # different models to fit data
+    # different models to fit data, see fitting.MODELS
     prop_spacings = [16,24,32,24,12]
     prop_radii = [5.08,5.08,5.08,5.08,5.08]
 
-    def model_1(x, a1, a2, a3):
-        # multiplicative solution with powers -4 and -2
-        a5 = 3
-        e1 = -4
-        e2 =-2
-        return (a1 * (1 + np.power(((x+a5)/ a2), e1)) * (1 / (1 + np.power(((x+a5)/ a3), e2))))
-
-
-    def model_2(x,T_oge):
-        # Sanchez-Cuevas
-        Kb = 2
-        z = x+2
-        term1 = 1 - (prop_radius / (4 * z)) ** 2
-        term2 = -prop_radius ** 2 * (z / (prop_spacing ** 2 + 4 * z ** 2) ** (3 / 2))
-        term3 = -(prop_radius ** 2 / 2) * (z / (2 * prop_spacing ** 2 + 4 * z ** 2) ** (3 / 2))
-        term4 = -2 * prop_radius ** 2 * (z / ((2 ** 0.5 * prop_spacing) ** 2 + 4 * z ** 2) ** (3 / 2) * Kb)
-        T_ige = T_oge/(term1+term2+term3+term4)
-        return T_ige
-
-    def model_3(x,T_oge,x_offset):
-        z = x+x_offset
-        T_ige = T_oge*np.power((0.9926+0.03794/(np.power(z/2/prop_radius,2))),2/3)
-
-        return T_ige
-
     if (fit == True):
-
-        if (model == 1):
-            fit_init_1 = [[1e-6, 40, 100],
-                          [1e-6, 40, 100],
-                          [1e-6, 40, 100],
-                          [1e-6, 40, 100],
-                          [1e-6, 40, 100],]
-
-            exponents_1 = [[-1, -1],
-                           [-1, -1]]
-
-            parameters_1 = []
-            covs_1 = []
-
-            for i in range(len(multi_data)):
-                x_cl, y_cl, yerr_cl = multi_data[i]
-                parameter, cov = scipy.optimize.curve_fit(model_1, x_cl, y_cl, p0=np.asarray(fit_init_1[i]),maxfev=10000)
-                parameters_1.append(parameter)
-                covs_1.append(cov)
-                plt.subplot(2, 1, 1)
-                x_ref = np.linspace(min(x_cl), max(x_cl), 1000)
-                plt.plot(x_ref, model_1(x_ref, *parameter))
-                #plt.plot(x_ref,model_1(x_ref,*fit_init_1[i]))
-                overall_residual = [a - b for a, b in zip(y_cl, [model_1(a, *parameter) for a in x_cl])]
-                plt.subplot(2, 1, 2)
-                plt.plot(x_cl, overall_residual)
-                plt.plot(x_ref, np.zeros(len(x_ref)))
-            print(parameters_1)
-
-        if(model == 2):
-            parameters_2 = []
-            covs_2 = []
-            for i in range(len(multi_data)):
-                prop_spacing = prop_spacings[i]
-                prop_radius = prop_radii[i]
-                x_cl, y_cl, yerr_cl = multi_data[i]
-                parameter,cov = scipy.optimize.curve_fit(model_2,x_cl,y_cl,p0 = np.asarray([2.5e-6]),maxfev=10000)
-                parameters_2.append(parameter)
-                covs_2.append(cov)
-                plt.subplot(2, 1, 1)
-                x_ref = np.linspace(min(x_cl), max(x_cl), 1000)
-                plt.plot(x_ref, model_2(x_ref, *parameter))
-                overall_residual = [a - b for a, b in zip(y_cl, [model_2(a, *parameter) for a in x_cl])]
-                plt.subplot(2, 1, 2)
-                plt.plot(x_cl, overall_residual)
-                plt.plot(x_ref, np.zeros(len(x_ref)))
-            print(parameters_2)
-
-        if(model == 3):
-            parameters_3 = []
-            covs_3 = []
-            for i in range(len(multi_data)):
-                prop_spacing = prop_spacings[i]
-                prop_radius = prop_radii[i]
-                x_cl, y_cl, yerr_cl = multi_data[i]
-                parameter, cov = scipy.optimize.curve_fit(model_3, x_cl, y_cl, maxfev=10000)
-                parameters_3.append(parameter)
-                covs_3.append(cov)
-                plt.subplot(2, 1, 1)
-                x_ref = np.linspace(min(x_cl), max(x_cl), 1000)
-                plt.plot(x_ref, model_3(x_ref, *parameter))
-                overall_residual = [a - b for a, b in zip(y_cl, [model_3(a, *parameter) for a in x_cl])]
-                plt.subplot(2, 1, 2)
-                plt.plot(x_cl, overall_residual)
-                plt.plot(x_ref, np.zeros(len(x_ref)))
-            print(parameters_3)
-
-
+        # labelled by data set, so that warm starts follow it wherever it is in data_lists.
+        jobs = [fitting.FitJob(x_cl, y_cl, model, label = get_data_label(data_lists[i]),
+                               prop_spacing = prop_spacings[i], prop_radius = prop_radii[i])
+                for i, (x_cl, y_cl, yerr_cl) in enumerate(multi_data)]
+        results = fitting.fit_all(jobs, workers = fit_workers, warm_start = warm_start)
+
+        for job, result in zip(jobs, results):
+            plt.subplot(2, 1, 1)
+            x_ref = np.linspace(min(job.x), max(job.x), 1000)
+            plt.plot(x_ref, result.evaluate(x_ref, job.prop_spacing, job.prop_radius))
+            overall_residual = np.asarray(job.y) - result.evaluate(job.x, job.prop_spacing, job.prop_radius)
+            plt.subplot(2, 1, 2)
+            plt.plot(job.x, overall_residual)
+            plt.plot(x_ref, np.zeros(len(x_ref)))
+        print([result.params for result in results])
+        print(fitting.format_table(results))
 
     if fig:
         plt.savefig(fig)
@@ -766,24 +1034,18 @@ def ln_cl_ln_height_plot(data_list: list, avg: bool = True, fig: str = None, off
     plt.ioff()
     plt.clf()
 
-    result_by_batch = get_result_by_batch(data_list, **kwargs)
+    cl_by_batch = get_cl_by_batch(get_lift_by_batch(data_list, avg, **kwargs))
 
     # cl: coefficient of lift
     x_cl, y_cl, yerr_cl = ([] for i in range(3))
 
-    for (height, timestamp), result_by_rpm in result_by_batch.items():
+    for (height, timestamp), (cl, cl_stderr) in cl_by_batch.items():
         if height < 0:
             raise ValueError('Negative height found in input: Check if you have corrected for reference height?')
 
-        x, y, xerr, yerr = lift_rpm(result_by_rpm, avg)
-        x = [xx ** 2 for xx in x]
-
-        res = scipy.stats.linregress(x, y)
-        cl = res.slope
-
         x_cl.append(log(height))
         y_cl.append(log(cl + offset))
-        yerr_cl.append(res.stderr / cl)
+        yerr_cl.append(cl_stderr / cl)
      
     for i in range(len(x_cl)):
         errorbar_plot(x_cl[i], y_cl[i]) # can't use linreg as we are plotting individual points.
@@ -827,38 +1089,27 @@ def ln_cl_ln_height_plot(data_list: list, avg: bool = True, fig: str = None, off
 
 # since most matplotlib 3d plot functions require 2d np array z inputs
 # interpolation of x and y are used to form meshgrid
+# z interpolated on a regular grid of len(x)*5 by len(y)*5 over the range of x and y, see surface.LiftSurface.
+# return -> Xi, Yi, Zi as given by np.meshgrid.
 def interpolate_to_create_2d_z(x,y,z):
-    from scipy.interpolate import griddata
-    xi = np.linspace(min(x), max(x), len(x)*5)
-    yi = np.linspace(min(y), max(y), len(y)*5)
-    Xi, Yi = np.meshgrid(xi, yi)
-    # Interpolate z values onto the regular grid
-    Zi = griddata((x, y), z, (Xi, Yi), method='linear')
-    return Xi,Yi,Zi
+    return LiftSurface(x, y, z).get_grid((len(x)*5, len(y)*5))
 
 # plot lift(z) against RPM2(y) and height(x) in 3D.
-def rpm_height_3d_plot(data_list: list, avg:bool = True, fig: str = None, **kwargs):
+# resolution: number of grid points of the surface along each axis, see surface.LiftSurface.get_grid.
+# surface: path to save the surface to, see surface.LiftSurface.save. None: don't save.
+def rpm_height_3d_plot(data_list: list, avg:bool = True, fig: str = None, resolution: int = 200, surface: str = None, **kwargs):
     plt.ioff()
     plt.clf()
     ax = plt.figure().add_subplot(projection='3d')
     ax.view_init(elev = 2, azim = 3)
 
-    height_x = []
-    rpm_y2 = []
-    mass_z = []
-        
-    result_by_batch = get_result_by_batch(data_list, **kwargs)
-    for (height, timestamp), result_by_rpm in result_by_batch.items():
-        y, z, yerr, zerr = lift_rpm(result_by_rpm, avg)
-        for i in range(len(y)):
-            height_x.append(height)
-            rpm_y2.append(y[i]**2)
-            mass_z.append(z[i])
-
-    Xi,Yi,Zi = interpolate_to_create_2d_z(height_x, rpm_y2, mass_z)
-
-    # wireframe plot
-    ax.plot_wireframe(Xi,Yi,Zi,rstride=200, cstride=200, linewidth=2)
+    lift_surface = LiftSurface.from_lift_by_batch(get_lift_by_batch(data_list, avg, **kwargs))
+    if surface:
+        lift_surface.save(surface)
+    Xi,Yi,Zi = lift_surface.get_grid(resolution)
+
+    # wireframe plot, of about 16 lines along each axis.
+    ax.plot_wireframe(Xi,Yi,Zi,rstride=max(resolution//16, 1), cstride=max(resolution//16, 1), linewidth=2)
     # superpose the 3d surface on the wireframe
     surf = ax.plot_surface(Xi, Yi, Zi, cmap=cm.coolwarm,linewidth=0, antialiased=True, alpha = 0.5)
 
@@ -872,76 +1123,38 @@ def rpm_height_3d_plot(data_list: list, avg:bool = True, fig: str = None, **kwar
     plt.show()
     plt.clf()
 
-# extract data as a list for further processing
-def extractor(data_lists: list,avg:bool = False,**kwargs):
-    import csv
-
-    multi_data = []
-    prop_spacings = [16, 24, 32, 24, 12]
-    prop_radii = [5.08, 5.08, 5.08, 5.08, 5.08]
-    test_run = [1,1,1,2,1]
-    # note that the second run of the 24cm drone is the correction run
-
-    for i in range(len(data_lists)):
-        result_by_batches=(get_result_by_batch(data_lists[i], **kwargs))
-        for (height, timestamp), result_by_rpm in result_by_batches.items():
-            x,y,xerr,yerr = lift_rpm(result_by_rpm, avg)
-            for j in range(len(x)):
-                # each list contains in order:
-                # rpm in rpm, lift in grams, height in cm, prop spacing in cm, prop radii in cm, test run number
-                # more can be added
-                multi_data.append([x[j],y[j],height,prop_spacings[i],prop_radii[i],test_run[i]])
-
-    ###filename = '../raw/bf2/all_data.csv'
-    filename = 'C:/Users/zc345-elev/Documents/quad/src/temp/all_data.csv'
-
-
+# compare CL against height of any number of runs of the same rig, see compare.compare_runs.
+# plots the difference of CL of each run from run {reference}, and its mean (the offset), against height.
+# for the two runs of the 24cm drone, the cl in g/rpm^2 is calculated to be less by 2.0713488097364073e-07
+# labels: name of each run, for the plot and the table printed. Defaults to its index.
+# kwargs: arguments to be passed to get_result_by_batch
+# return -> compare.Comparison
+def same_parameter_comparison(data_lists: list, labels: list = None, reference: int = 0, fig: str = None, **kwargs):
+    plt.ioff()
+    plt.clf()
 
-    with open(filename, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(multi_data)
+    curves = [get_curve(get_cl_by_batch(get_lift_by_batch(data_list, avg = True, **kwargs))) for data_list in data_lists]
+    comparison = compare_runs(curves, labels)
 
-    print(len(multi_data))
-    return multi_data
+    for j, label in enumerate(comparison.labels):
+        if j == reference:
+            continue
+        height, diff = comparison.get_diff(reference, j)
+        lines = plt.plot(height, diff, label = str(label))
+        plt.plot(height, [comparison.offset[reference, j]] * len(height),
+                 color = lines[0].get_color(), ls = '--')
 
-# interpolate and find the offset between the two runs of the same parameters
-# for the two runs of the 24cm drone, the cl in g/rpm^2 is calculated to be less by 2.0713488097364073e-07
-def same_parameter_comparison(data_lists: list,**kwargs):
-
-    # assuming 0 has more data than 1
-    x_cl = [[], []]
-    y_cl = [[], []]
-    for i in [0,1]:
-        result_by_batch = get_result_by_batch(data_lists[i], **kwargs)
-        for (height, timestamp), result_by_rpm in result_by_batch.items():
-            x, y, xerr, yerr = lift_rpm(result_by_rpm, avg= True)
-            x = [xx ** 2 for xx in x]
-            res = scipy.stats.linregress(x, y)
-            x_cl[i].append(height)
-            y_cl[i].append(res.slope)
-    #first row contain the height and second row contain diff in cl
-    diff = [[],[]]
-    for i in range(len(x_cl[1])):
-        if (x_cl[1][i] >= min(x_cl[0]) and x_cl[1][i] <= max(x_cl[0])):
-            # directly subtract when matching height found
-            if (x_cl[1][i]==x_cl[0][i]):
-                diff[0].append(x_cl[1][i])
-                diff[1].append(y_cl[1][i]-y_cl[0][i])
-            # interpolate when not found
-            else:
-                lhs_index = x_cl[0].index(max((num for num in x_cl[0] if num < x_cl[1][i]), key=lambda x: x))
-                rhs_index = x_cl[0].index(max((num for num in x_cl[0] if num > x_cl[1][i]), key=lambda x: x))
-                grad = (y_cl[0][rhs_index]-y_cl[0][lhs_index])/(x_cl[0][rhs_index]-x_cl[0][lhs_index])
-                diff[0].append(x_cl[1][i])
-                diff[1].append(y_cl[1][i]-(y_cl[0][lhs_index]+grad*(x_cl[1][i]-x_cl[0][lhs_index])))
-
-    plt.plot(diff[0],diff[1])
-    plt.plot(diff[0],[np.mean(diff[1])]*len(diff[0]))
-    plt.title('diff between the two runs of the 240mm drone')
+    plt.title(f'diff in CL from run {comparison.labels[reference]}')
     plt.xlabel('height / cm')
     plt.ylabel('diff in CL / (g s^2)')
+    plt.legend()
+    print(comparison.format_table(reference))
+
+    if fig:
+        plt.savefig(fig)
     plt.show()
-    print(np.mean(diff[1]))
+    plt.clf()
+    return comparison
 
 """
 LOAD CELL processing functions
@@ -0,0 +1,157 @@
+"""
+report.py
+
+Headless rendering of the standard set of figures of a campaign (a folder of Data files).
+
+render loads the campaign once (lazily, metadata only), computes the lift statistics that the
+figures share once per distinct set of arguments, then renders the figures in parallel worker
+processes with the non-interactive Agg backend. The lift statistics reach the workers through
+the ResultCache, so that only figures that need the frames themselves (bootstrap intervals) parse
+them.
+
+Figures whose inputs (files, by path, mtime and size, and arguments) have not changed since they
+were last rendered are skipped; the inputs of each rendered figure are recorded in MANIFEST, in
+the figure folder.
+
+Usage:
+    report.render('../data/10-04-2024-240mm', figures = ['lift-w', 'cl-height-model-1'])
+    report.render('../data/10-04-2024-240mm', rig = {'prop_spacing': 24, 'prop_radius': 5.08})   # to fit CL against height.
+"""
+
+import os, json
+import matplotlib
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import processor
+from cache import ResultCache
+
+
+@dataclass
+class Figure:
+    filename: str
+    func: callable          # processor plotting function: func(data_list, fig = ..., **lift, **plot)
+    lift: dict = field(default_factory = dict)  # arguments of get_lift_by_batch, i.e. avg and those of get_result_by_batch.
+    plot: dict = field(default_factory = dict)  # other arguments of func.
+    multiple: bool = False  # func takes a list of data_lists, see cl_height_plot_multiple.
+    rig: bool = False       # func takes the rig (prop_spacing, prop_radius) of the campaign, see render.
+
+# name -> Figure. Arguments as in analysis.py.
+FIGURES = {'lift-w':            Figure('lift-w.pdf', processor.lift_rpm2_plot, {'avg': True, 'rpm_range': [0, 12000]}),
+           'cl-height':         Figure('cl-height.pdf', processor.cl_height_plot, {'avg': True, 'rpm_range': [0, 12000]}, {'fit': True}, rig = True),
+           'cl-height-bootstrap': Figure('cl-height_bootstrap.pdf', processor.cl_height_plot, {'avg': True, 'rpm_range': [0, 12000]},
+                                         {'fit': True, 'bootstrap': 1000}, rig = True),
+           '3d':                Figure('3d.pdf', processor.rpm_height_3d_plot, {'avg': True}),
+           'ln-cl-ln-height':   Figure('ln-cl-ln-height.pdf', processor.ln_cl_ln_height_plot, {'avg': True}, {'offset': 0}),
+           **{f'cl-height-model-{model}':
+              Figure(f'cl-height_model_{model}.pdf', processor.cl_height_plot_multiple, {'avg': True},
+                     {'data_choice': [0], 'fit': True, 'model': model, 'fit_workers': 1}, multiple = True)
+              for model in (1, 2, 3)}}
+
+# inputs of the figures last rendered into a folder: filename -> key, see render.
+MANIFEST = '.report.json'
+
+
+# render figures of the campaign in {path} into {path}/Figures.
+# figures: names of FIGURES to render. None: all of them.
+# workers: number of worker processes. None: one per CPU. 1: render in this process, with the Agg
+#   backend for the duration of the rendering only.
+# force = True: render even figures whose inputs have not changed.
+# cache: ResultCache for lift statistics. None: processor.result_cache if set, otherwise one in {path}/.cache.
+# rig: dict of the rig of the campaign, prop_spacing and prop_radius (cm), for the figures that fit models of it.
+#   None: those are plotted without fits.
+# return -> dict (name -> 'rendered', 'skipped' or the error that rendering raised).
+def render(path: str, figures: list = None, workers: int = None, force: bool = False, cache: ResultCache = None,
+           rig: dict = None) -> dict:
+    if figures is None:
+        figures = list(FIGURES)
+    for name in figures:
+        if name not in FIGURES:
+            raise KeyError(f'(E) report::render: unknown figure {name}, must be one of {list(FIGURES)}.')
+    if cache is None:
+        cache = processor.result_cache if processor.result_cache is not None else ResultCache(os.path.join(path, '.cache'))
+
+    folder = os.path.join(path, 'Figures')
+    os.makedirs(folder, exist_ok = True)
+    manifest_name = os.path.join(folder, MANIFEST)
+    manifest = dict()
+    if os.path.isfile(manifest_name):
+        with open(manifest_name, 'r') as file:
+            manifest = json.load(file)
+
+    files = sorted(processor.get_data_files(path))
+    status = dict()
+    todo = list()
+    for name in figures:
+        figure = FIGURES[name]
+        key = cache.get_key(files, figure = name, lift = figure.lift, plot = figure.plot,
+                            **({'rig': rig} if figure.rig else {}))
+        fig = os.path.join(folder, figure.filename)
+        if not force and manifest.get(figure.filename) == key and os.path.isfile(fig):
+            status[name] = 'skipped'
+        else:
+            todo.append((name, fig, key))
+
+    if todo:
+        # shared intermediate results: lift statistics, once per distinct set of arguments.
+        data_list = [processor.load_data(file_name, lazy = True) for file_name in files]
+        for lift in {json.dumps(FIGURES[name].lift, sort_keys = True) for name, _, _ in todo}:
+            processor.get_lift_by_batch(data_list, cache = cache, **json.loads(lift))
+
+        if workers is None:
+            workers = os.cpu_count() or 1
+        tasks = [(name, files, fig, rig) for name, fig, _ in todo]
+        if workers <= 1 or len(tasks) <= 1:
+            with rendering(cache.path, cache.max_size):
+                errors = [render_figure(*task) for task in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers = min(workers, len(tasks)),
+                                     initializer = init_worker, initargs = (cache.path, cache.max_size)) as executor:
+                errors = list(executor.map(render_figure, *zip(*tasks)))
+
+        for (name, fig, key), error in zip(todo, errors):
+            if error is None:
+                status[name] = 'rendered'
+                manifest[FIGURES[name].filename] = key
+            else:
+                status[name] = error
+                manifest.pop(FIGURES[name].filename, None)
+
+        with open(manifest_name, 'w') as file:
+            json.dump(manifest, file, indent = 4)
+
+    for name in figures:
+        print(f'report::render: {name}: {status[name]}')
+    return status
+
+# set up a process to render figures: non-interactive backend, and the cache of lift statistics.
+def init_worker(cache_path: str, max_size: int):
+    matplotlib.use('Agg', force = True)
+    processor.result_cache = ResultCache(cache_path, max_size)
+
+# set up this process to render figures within the block, see init_worker, then restore its backend
+# and cache, so that interactive plotting keeps working afterwards.
+@contextmanager
+def rendering(cache_path: str, max_size: int):
+    backend = matplotlib.get_backend()
+    cache = processor.result_cache
+    init_worker(cache_path, max_size)
+    try:
+        yield
+    finally:
+        processor.result_cache = cache
+        matplotlib.use(backend, force = True)
+
+# render FIGURES[{name}] from {files} into {fig}, with {rig} (see render). Module-level, so that it can be
+# run by worker processes.
+# return -> None, or the error raised, as a string.
+def render_figure(name: str, files: list, fig: str, rig: dict = None) -> str:
+    figure = FIGURES[name]
+    data_list = [processor.load_data(file_name, lazy = True) for file_name in files]
+    rig = (rig or dict()) if figure.rig else dict()
+    try:
+        figure.func([data_list] if figure.multiple else data_list, fig = fig, **figure.lift, **figure.plot, **rig)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
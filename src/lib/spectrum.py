@@ -0,0 +1,181 @@
+"""
+spectrum.py
+
+Streaming short-time spectra (STFT with Welch averaging) of long recordings.
+
+An STFT takes audio as it arrives, in chunks of any length, e.g. the audio of each frame of a Data.
+Overlapping segments of nperseg samples, hop samples apart, are windowed and transformed all at once
+(see utils.Numerical.get_plan), and the power spectral densities of every {average} consecutive segments
+are averaged (Welch's method) into a column of the spectrogram. Only the samples of the last, incomplete,
+segment are kept between chunks, so that minutes of audio are processed incrementally, without
+recomputing anything, into a compact float32 spectrogram [columns, frequencies]. Audio that does not
+follow on from the previous chunk (a gap in the recording) starts the segments afresh. Whether it follows
+on is judged from its time, within a tolerance of a hop by default, as the times of chunks (e.g. of frames)
+jitter by milliseconds; a chunk that follows on is placed right after the previous one.
+
+While recording, Data.listen feeds an STFT with the audio of every frame, and the spectrogram is saved
+next to the recording, with the extension of Spectrogram (see load).
+
+Usage:
+    stft = STFT(fs = Recorder.fs, nperseg = 4096, hop = 1024, average = 4, fl = 100, fr = 2000)
+    stft.push(audio, t = 0)     # as audio arrives, with the time of its first sample.
+    stft.get_spectrogram().save('../data/spectrogram.npz')
+
+    data.listen(recorder, stft = STFT(fs = recorder.fs, fl = 100, fr = 2000))  # while recording.
+    spectrogram = load('../data/bf_100_[...].bin')      # saved with a recording.
+    spectrogram = from_data(data, fl = 100, fr = 2000)  # of the audio of a recording.
+"""
+
+import os
+import numpy as np
+
+from dataclasses import dataclass
+from numpy.lib.stride_tricks import sliding_window_view
+from utils import Data, Numerical, Channel
+
+
+@dataclass
+class Spectrogram:
+    t: np.ndarray       # [M] time of the centre of each column, on the clock of the audio.
+    freq: np.ndarray    # [K] float32
+    power: np.ndarray   # [M, K] float32 power spectral density, in audio^2 / Hz.
+
+    EXTENSION = 'npz'
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    # return -> Spectrogram of the frequencies in (fl, fr] only.
+    def get_band(self, fl: float = 0, fr: float = np.inf):
+        band = (self.freq > fl) & (self.freq <= fr)
+        return Spectrogram(self.t, self.freq[band], self.power[:, band])
+
+    # save to {name}, as a numpy .npz file.
+    def save(self, name: str):
+        with open(name, 'wb') as file:
+            np.savez_compressed(file, t = self.t, freq = self.freq, power = self.power)
+
+    # return -> Spectrogram saved to {name} by save.
+    @classmethod
+    def load(cls, name: str):
+        with np.load(name, allow_pickle = False) as file:
+            return cls(file['t'], file['freq'], file['power'])
+
+
+class STFT:
+    # fs: samples per second of audio.
+    # nperseg: samples per segment. hop: samples between the starts of consecutive segments.
+    # window: name of the window function, see scipy.signal.get_window. None: rectangular.
+    # average: number of consecutive segments averaged into each column.
+    # fl, fr: range of frequencies to keep (fl, fr].
+    # tolerance: seconds by which the time of a chunk may differ from the end of the previous one for it to
+    #   follow on, see push. None: hop samples.
+    def __init__(self, fs: float, nperseg: int = 4096, hop: int = 1024, window: str = 'hann', average: int = 1,
+                 fl: float = 0, fr: float = 20000, tolerance: float = None):
+        if hop < 1 or average < 1:
+            raise ValueError(f'(E) STFT::__init__: hop and average must be positive, got {hop} and {average}.')
+        self.fs = fs
+        self.dt = 1 / fs
+        self.nperseg = nperseg
+        self.hop = hop
+        self.average = average
+        self.tolerance = hop * self.dt if tolerance is None else tolerance
+        self.plan = Numerical.get_plan(nperseg, self.dt, fl, fr, window)
+
+        # density scaling, one-sided, as scipy.signal.welch: DC and Nyquist are not doubled.
+        weights = self.plan.window if self.plan.window is not None else np.ones(nperseg)
+        one_sided = np.where((self.plan.freq == 0) | (2 * self.plan.freq == fs), 1, 2)
+        self.scale = (one_sided / (fs * np.sum(np.square(weights, dtype = np.float64)))).astype(np.float32)
+
+        self.t = Channel(1)
+        self.power = Channel(2, np.float32)
+        self.reset()
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    # drop the audio of incomplete segments and columns, so that the next chunk starts afresh.
+    def reset(self):
+        self.pending = np.empty(0, dtype = np.float32)  # samples from the start of the next segment.
+        self.pending_t = None                           # time of pending[0].
+        self.group_power = np.empty((0, len(self.plan.freq)), dtype = np.float32)  # segments of the next column.
+        self.group_t = np.empty(0)
+
+    # feed a chunk of audio.
+    # t: time of its first sample. None: right after the previous chunk (0 for the first).
+    #   A chunk more than {tolerance} away from the end of the previous one starts afresh; otherwise it is
+    #   placed right after it.
+    # return -> number of new columns.
+    def push(self, audio, t: float = None) -> int:
+        audio = np.asarray(audio, dtype = np.float32)
+        if self.pending_t is not None:
+            expected = self.pending_t + len(self.pending) * self.dt
+            if t is not None and abs(t - expected) > self.tolerance:
+                self.reset()
+            else:
+                t = expected
+        if self.pending_t is None:
+            self.pending_t = 0 if t is None else t
+        samples = np.concatenate((self.pending, audio)) if len(self.pending) else audio
+
+        n_segments = (len(samples) - self.nperseg) // self.hop + 1 if len(samples) >= self.nperseg else 0
+        if n_segments:
+            segments = sliding_window_view(samples, self.nperseg)[::self.hop][:n_segments]
+            power = np.square(self.plan.transform(segments)) * self.scale
+            start = n_segments * self.hop
+            segment_t = self.pending_t + (np.arange(n_segments) * self.hop + self.nperseg / 2) * self.dt
+            self.pending_t += start * self.dt
+            self.pending = samples[start:].copy()
+
+            # Welch: average groups of consecutive segments, carrying incomplete groups over.
+            power = np.concatenate((self.group_power, power))
+            segment_t = np.concatenate((self.group_t, segment_t))
+            n_columns = len(power) // self.average
+            end = n_columns * self.average
+            if n_columns:
+                self.power.extend(power[:end].reshape(n_columns, self.average, -1).mean(axis = 1))
+                self.t.extend(segment_t[:end].reshape(n_columns, self.average).mean(axis = 1))
+            self.group_power = power[end:]
+            self.group_t = segment_t[end:]
+            return n_columns
+
+        self.pending = samples.copy()
+        return 0
+
+    # return -> Spectrogram of the columns so far. Its arrays are views, see utils.Channel.
+    def get_spectrogram(self) -> Spectrogram:
+        power = self.power.view()
+        if not len(power):
+            power = np.empty((0, len(self.plan.freq)), dtype = np.float32)
+        return Spectrogram(self.t.view(), self.plan.freq, power)
+
+    # save the spectrogram of the columns so far with the recording at {name}, see get_name.
+    def save_with(self, name: str):
+        self.get_spectrogram().save(get_name(name))
+
+# return -> path of the spectrogram saved with the recording at {name} (see Data.listen).
+def get_name(name: str) -> str:
+    return os.path.splitext(name)[0] + '.' + Spectrogram.EXTENSION
+
+# return -> Spectrogram saved with the recording at {name}, see Data.listen.
+def load(name: str) -> Spectrogram:
+    spectrogram_name = get_name(name)
+    if not os.path.isfile(spectrogram_name):
+        raise IOError(f'(E) spectrum::load: {name} has no spectrogram saved with it ({spectrogram_name}).')
+    return Spectrogram.load(spectrogram_name)
+
+# spectrogram of the audio of the frames of {data}, placed in time by audio_t (see Data.listen).
+# audio of frames without audio_t is taken to end at the frame's t.
+# kwargs: see STFT, but for fs, which is that of the audio.
+# return -> Spectrogram
+def from_data(data: Data, **kwargs) -> Spectrogram:
+    dt = next((value for value in data.get_dt() if value), None)
+    if dt is None:
+        raise ValueError('(E) spectrum::from_data: data has no audio.')
+
+    stft = STFT(fs = 1 / dt, **kwargs)
+    for audio, audio_t, t in zip(data.get_audio(), data.get_audio_t(), data.get_t()):
+        if audio is None or not len(audio):
+            continue
+        stft.push(audio, audio_t if audio_t is not None else t - len(audio) * dt)
+    return stft.get_spectrogram()
@@ -0,0 +1,81 @@
+"""
+surface.py
+
+Lift as a function of height and rpm, interpolated from the lift statistics of a campaign.
+
+A LiftSurface is built once from (height, rpm^2, lift) points, e.g. those of get_lift_by_batch. It
+keeps the Delaunay triangulation of the points and the linear interpolant over it, so that
+any number of queries, at arbitrary points, reuse them. Queries are vectorised, and plotting
+grids are of a chosen resolution instead of growing with the number of points.
+
+Surfaces can be saved and loaded, to be used as a lookup model, e.g. when planning campaigns:
+    surface = LiftSurface.from_lift_by_batch(processor.get_lift_by_batch(data_list))
+    surface.save('../data/lift-surface.npz')
+    LiftSurface.load('../data/lift-surface.npz').lift(height = [20, 30], rpm = 8000)
+"""
+
+import numpy as np
+
+from scipy.interpolate import LinearNDInterpolator
+from scipy.spatial import Delaunay
+
+
+class LiftSurface:
+    EXTENSION: str = 'npz'
+
+    # height, rpm2, lift: arrays [n] of the points to interpolate between; rpm2 is rpm squared.
+    # interpolation is linear over the Delaunay triangulation of (height, rpm2), as with
+    #   scipy.interpolate.griddata(method = 'linear'). Outside the convex hull of the points, lift is nan.
+    def __init__(self, height, rpm2, lift):
+        self.points = np.column_stack((np.asarray(height, dtype = float), np.asarray(rpm2, dtype = float)))
+        self.values = np.asarray(lift, dtype = float)
+        if len(self.points) != len(self.values):
+            raise ValueError(f'(E) LiftSurface::__init__: got {len(self.points)} points but {len(self.values)} lift values.')
+        if len(self.points) < 3:
+            raise ValueError(f'(E) LiftSurface::__init__: need at least 3 points, got {len(self.points)}.')
+
+        self.triangulation = Delaunay(self.points)
+        self.interpolant = LinearNDInterpolator(self.triangulation, self.values)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    # lift_by_batch: dict = (batch -> (x, y, xerr, yerr)), see processor.get_lift_by_batch, where
+    #   batch = (height, timestamp), x is rpm and y is lift.
+    # return -> LiftSurface
+    @classmethod
+    def from_lift_by_batch(cls, lift_by_batch: dict):
+        height = [batch[0] for batch, (x, _, _, _) in lift_by_batch.items() for _ in x]
+        rpm = np.concatenate([lift[0] for lift in lift_by_batch.values()]) if lift_by_batch else []
+        lift = np.concatenate([lift[1] for lift in lift_by_batch.values()]) if lift_by_batch else []
+        return cls(height, np.square(rpm), lift)
+
+    # height, rpm: scalars or arrays, broadcast against each other.
+    # return -> array of interpolated lift, of the broadcast shape.
+    def lift(self, height, rpm) -> np.ndarray:
+        height, rpm = np.broadcast_arrays(np.asarray(height, dtype = float), np.asarray(rpm, dtype = float))
+        return self.interpolant(height, np.square(rpm))
+
+    # regular grid over the range of the points, for plotting.
+    # resolution: number of grid points along height and rpm2; an int for both, or (n_height, n_rpm2).
+    # return -> (height, rpm2, lift), arrays [n_rpm2, n_height] as given by np.meshgrid.
+    def get_grid(self, resolution: int|tuple = 100) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        n_height, n_rpm2 = (resolution, resolution) if np.isscalar(resolution) else resolution
+        lower = self.points.min(axis = 0)
+        upper = self.points.max(axis = 0)
+        height, rpm2 = np.meshgrid(np.linspace(lower[0], upper[0], n_height),
+                                   np.linspace(lower[1], upper[1], n_rpm2))
+        return height, rpm2, self.interpolant(height, rpm2)
+
+    # save the points of the surface to {name}, as a numpy .npz file.
+    # the triangulation is rebuilt from them by load, which is fast and gives the same surface.
+    def save(self, name: str):
+        with open(name, 'wb') as file:
+            np.savez_compressed(file, points = self.points, values = self.values)
+
+    # return -> LiftSurface saved to {name} by save.
+    @classmethod
+    def load(cls, name: str):
+        with np.load(name, allow_pickle = False) as file:
+            points = file['points']
+            return cls(points[:, 0], points[:, 1], file['values'])
@@ -0,0 +1,110 @@
+"""
+tracking.py
+
+Tracking of the blade-pass frequency through the spectrogram of a recording.
+
+Picking the tallest peak of each frame on its own makes the chosen frequency jump between harmonics from
+frame to frame. track instead finds the one path of frequencies through the whole spectrogram (see
+spectrum.py) with the most log power along it, less a cost for every Hz it jumps between consecutive
+columns (Viterbi). The path is found in one pass over the columns, each vectorised over all frequencies:
+with a cost linear in the jump, the best predecessor of every frequency follows from two running maxima.
+
+Optionally, the path is kept near the blade-pass frequency expected from the rpm of the motors (DShot
+telemetry), rpm / 60 * blades, within a relative tolerance.
+
+Usage:
+    result = track(spectrum.from_data(data, fl = 100, fr = 2000), jump_cost = 2)
+    result = track_data(data, fl = 100, fr = 2000, blades = 2)  # with the rpm of data.
+    w = result.get_freq(data.get_t())
+"""
+
+import numpy as np
+
+from dataclasses import dataclass, field
+import spectrum
+from utils import Data
+
+
+@dataclass
+class Track:
+    t: np.ndarray                               # [M] time of each column of the spectrogram.
+    freq: np.ndarray                            # [M] tracked frequency; nan where the column has no power.
+    power: np.ndarray = field(repr = False)     # [M] power spectral density at freq.
+    expected: np.ndarray = field(repr = False)  # [M] blade-pass frequency expected from rpm; nan without.
+
+    def __len__(self) -> int:
+        return len(self.t)
+
+    # return -> tracked frequency at times {t}, linearly interpolated; nan outside the track.
+    def get_freq(self, t) -> np.ndarray:
+        if not len(self.t):
+            return np.full(np.shape(t), np.nan)
+        return np.interp(t, self.t, self.freq, left = np.nan, right = np.nan)
+
+# best score reachable at each frequency from the previous column: max over j of total[j] - cost * |freq[i] - freq[j]|.
+# freq must be sorted. The max over j <= i is a running max of total + cost * freq, and likewise over j >= i.
+# return -> (best, predecessor), arrays [K].
+def get_best_predecessor(total: np.ndarray, freq: np.ndarray, cost: float) -> tuple[np.ndarray, np.ndarray]:
+    index = np.arange(len(total))
+    up = total + cost * freq
+    up_max = np.maximum.accumulate(up)
+    # last j at which the running max was reached.
+    up_arg = np.maximum.accumulate(np.where(up >= up_max, index, 0))
+
+    down = (total - cost * freq)[::-1]
+    down_max = np.maximum.accumulate(down)
+    down_arg = (len(total) - 1 - np.maximum.accumulate(np.where(down >= down_max, index, 0)))[::-1]
+    down_max = down_max[::-1]
+
+    from_below = up_max - cost * freq
+    from_above = down_max + cost * freq
+    return np.maximum(from_below, from_above), np.where(from_below >= from_above, up_arg, down_arg)
+
+# track the blade-pass frequency through {spectrogram}, see module docstring.
+# jump_cost: dB of power per Hz of jump between consecutive columns.
+# rpm: None, or (t, rpm) arrays of the mean rpm of the motors, on the clock of the spectrogram.
+# blades: number of blades of each propeller. tolerance: relative distance from rpm / 60 * blades
+#   allowed. Columns with no frequency within it are not restricted.
+# return -> Track
+def track(spectrogram: spectrum.Spectrogram, jump_cost: float = 2, rpm: tuple = None,
+          blades: int = 2, tolerance: float = 0.2) -> Track:
+    t, freq = spectrogram.t, np.asarray(spectrogram.freq, dtype = float)
+    n_columns, n_freq = spectrogram.power.shape
+    if not n_columns or not n_freq:
+        return Track(t, np.full(n_columns, np.nan), np.full(n_columns, np.nan), np.full(n_columns, np.nan))
+
+    with np.errstate(divide = 'ignore'):
+        score = 10 * np.log10(spectrogram.power.astype(float))
+
+    expected = np.full(n_columns, np.nan)
+    if rpm is not None:
+        expected = np.interp(t, *rpm) / 60 * blades
+        allowed = np.abs(freq[None, :] - expected[:, None]) <= tolerance * expected[:, None]
+        allowed |= ~allowed.any(axis = 1, keepdims = True)
+        score = np.where(allowed, score, -np.inf)
+
+    total = score[0]
+    back = np.zeros((n_columns, n_freq), dtype = np.intp)
+    for m in range(1, n_columns):
+        best, back[m] = get_best_predecessor(total, freq, jump_cost)
+        total = best + score[m]
+
+    path = np.empty(n_columns, dtype = np.intp)
+    path[-1] = np.argmax(total)
+    for m in range(n_columns - 1, 0, -1):
+        path[m - 1] = back[m, path[m]]
+
+    columns = np.arange(n_columns)
+    tracked = np.where(np.isfinite(score[columns, path]), freq[path], np.nan)
+    return Track(t, tracked, spectrogram.power[columns, path], expected)
+
+# track the blade-pass frequency through the audio of {data}.
+# blades: None to track without rpm. Otherwise, see track, with the mean rpm of data.
+# kwargs: see spectrum.from_data, e.g. fl, fr, nperseg.
+# return -> Track
+def track_data(data: Data, jump_cost: float = 2, blades: int = None, tolerance: float = 0.2, **kwargs) -> Track:
+    spectrogram = spectrum.from_data(data, **kwargs)
+    rpm = None
+    if blades is not None and len(data.get_t()):
+        rpm = (data.get_t(), data.get_mean_rpm())
+    return track(spectrogram, jump_cost = jump_cost, rpm = rpm, blades = blades or 2, tolerance = tolerance)
@@ -1,8 +1,12 @@
 import pyaudio, time, scipy, serial, os, json, dataclasses, copy
+import datafile
+from force import CellLayout, NINE_CELL
 
 from scipy import signal
 from threading import Thread
+from functools import lru_cache
 from dataclasses import dataclass, field
+from collections.abc import Sequence
 from datetime import datetime
 
 import statistics as st
@@ -11,7 +15,13 @@ import matplotlib.pyplot as plt
 import multiprocessing as mp
 
 
+# reconstruction matrix for the 9-load cell setup, such that mass_vec = MASS_VEC_MATRIX @ mass. See force.py.
+MASS_VEC_MATRIX = NINE_CELL.matrix
+
+
 # stores all experimental data at a point in time.
+# Frames obtained from a Data instance are views: array attributes (accel, dist, mass, rpm)
+# are rows of the columns in Data, and modifying the frame does not modify the Data.
 @dataclass
 class Frame:
     t: float = 0
@@ -27,6 +37,7 @@ class Frame:
     # mic input
     audio:list = field(default_factory=list) # list of lists of audio
     dt:float = 0
+    audio_t:float = None    # time of the first audio sample, on the clock of t. See Data.listen.
     fft_freq:list = field(default_factory=list) 
     fft_ampl: list = field(default_factory=list) 
     peak_freq:list = field(default_factory=list) 
@@ -56,30 +67,14 @@ class Frame:
     def get_mean_rpm(self) -> float:
         return st.mean(self.rpm)
 
-    # reconstruct 3d force vector from readings of 9-load cell setup.
+    # reconstruct 3d force vector from load cell readings.
+    # layout: cell geometry of the rig, see force.py. Defaults to the 9-load cell setup.
     # return -> force in 3D [x, y, z].
-    def get_mass_vec(self) -> list:
-        if len(self.mass) != 9:
-            raise IndexError('(E) Frame::get_mass_vec: must have 9 elements for get_mass_vec to work (9-cell setup.)')
-
-        from numpy import sin, cos, pi
-
-        f = np.reshape(self.mass, (3, 3))  # f: force vectors by cell, even though they are in grams
-        DEG15 = pi * 15 / 180
-        DEG45 = pi * 45 / 180
-        DEG75 = pi * 75 / 180
-
-        # right-handed coordinate system.
-        # z points upward, x points along middle line towards cells 1-0
-        mass_vec = [None for i in range(3)]
-        mass_vec[0] = (- sin(DEG45) * f[0, 1] + sin(DEG45) * f[0, 2]
-                       + cos(DEG15) * f[1, 1] + cos(DEG75) * f[1, 2]
-                       - cos(DEG75) * f[2, 1] - cos(DEG15) * f[2, 2])
-        mass_vec[1] = (- cos(DEG45) * f[0, 1] - cos(DEG45) * f[0, 2]
-                       - sin(DEG15) * f[1, 1] + sin(DEG75) * f[1, 2]
-                       + sin(DEG75) * f[2, 1] - sin(DEG15) * f[2, 2])
-        mass_vec[2] = -sum(f[:, 0])   # z-component adds simply
-        return mass_vec
+    def get_mass_vec(self, layout: CellLayout = NINE_CELL) -> list:
+        if len(self.mass) != len(layout):
+            raise IndexError(f'(E) Frame::get_mass_vec: must have {len(layout)} elements for get_mass_vec to work ({layout.name} setup.)')
+
+        return layout.reconstruct(self.mass).tolist()
 
     # NOTE: HARDCODING HERE.
     # return -> reading of the first (there's only one) accelerometer [x, y, z].
@@ -92,8 +87,163 @@ class Frame:
         return self.dist[0]
 
 
+# names of all Frame attributes, in order, as they appear in saved json files.
+FRAME_FIELDS = tuple(f.name for f in dataclasses.fields(Frame))
+
+
+# return -> the last {window} items of {seq}, or all of seq if window is None.
+#   For arrays this is a view, so it takes O(1) regardless of the length of seq.
+def tail(seq, window: int = None):
+    if window is None:
+        return seq
+    return seq[max(len(seq) - window, 0):]
+
+
+# return -> True if {rows} (scalar, nested list or array) hold only integers; empty rows do.
+def is_integral(rows) -> bool:
+    rows = np.asarray(rows)
+    return rows.size == 0 or np.issubdtype(rows.dtype, np.integer)
+
+# a growable numpy array holding a single channel of Data, e.g. rpm[N, 4].
+# rows are written in place into a preallocated buffer, whose capacity doubles when full;
+# appending is therefore amortised O(1) and does not allocate per row.
+# the shape of a row is fixed by the first row appended (or by set).
+class Channel:
+    MIN_CAPACITY: int = 64
+
+    # ndim: number of dimensions of the channel, including the frame axis.
+    def __init__(self, ndim: int = 1, dtype = np.float64):
+        self.ndim = ndim
+        self.dtype = dtype
+        self.buf = None     # preallocated storage; only buf[:n] is valid.
+        self.n = 0
+        self.integral = True    # the first row given was of integers (e.g. rpm), see export.
+
+    def __len__(self) -> int:
+        return self.n
+
+    # pickle only the valid part of the buffer.
+    def __getstate__(self) -> dict:
+        return self.__dict__ | {'buf': None if self.buf is None else self.view()}
+
+    # append a single row to the channel.
+    # row: scalar for 1D channels, (nested) list or array otherwise. Empty rows are allowed.
+    def append(self, row):
+        if self.buf is None:
+            shape = np.shape(row)
+            if len(shape) != self.ndim - 1:     # e.g. [] supplied to accel
+                shape = (0,) * (self.ndim - 1)
+            # decided once, so that appending does not build an array per row.
+            self.integral = is_integral(row)
+            self.buf = np.empty((self.MIN_CAPACITY, *shape), dtype = self.dtype)
+        elif self.n == len(self.buf):
+            self.reserve(max(2 * self.n, self.MIN_CAPACITY))
+
+        # guard against silent broadcasting of e.g. [x] into a row of 3.
+        if self.ndim > 1 and len(row) != self.buf.shape[1]:
+            raise ValueError(f'(E) Channel::append: row of length {len(row)} does not match '
+                             f'channel of row shape {self.buf.shape[1:]}.')
+
+        self.buf[self.n] = row
+        self.n += 1
+
+    # append many rows at once.
+    # rows: array (or nested list) with rows along the first axis.
+    def extend(self, rows):
+        if self.buf is None:
+            self.integral = is_integral(rows)
+        rows = np.asarray(rows, dtype = self.dtype)
+        if self.buf is None:
+            self.buf = np.empty((max(len(rows), self.MIN_CAPACITY), *rows.shape[1:]), dtype = self.dtype)
+        elif self.n + len(rows) > len(self.buf):
+            self.reserve(max(self.n + len(rows), 2 * len(self.buf)))
+
+        self.buf[self.n:self.n + len(rows)] = rows
+        self.n += len(rows)
+
+    # make sure that at least {capacity} rows can be held without reallocation.
+    def reserve(self, capacity: int):
+        if self.buf is None or capacity <= len(self.buf):
+            return
+
+        buf = np.empty((capacity, *self.buf.shape[1:]), dtype = self.dtype)
+        buf[:self.n] = self.buf[:self.n]
+        self.buf = buf
+
+    # replace the content of the channel with {rows}. No copy is made if rows is already
+    # an array of the correct dtype; the buffer is only copied once more rows are appended.
+    def set(self, rows):
+        self.integral = is_integral(rows)
+        buf = np.asarray(rows, dtype = self.dtype)
+        if buf.ndim != self.ndim:
+            if buf.size:
+                raise ValueError(f'(E) Channel::set: expected {self.ndim} dimensions, got {buf.ndim}.')
+            buf = buf.reshape((len(buf), *(0,) * (self.ndim - 1)))
+
+        self.buf = buf
+        self.n = len(buf)
+
+    # drop the first {k} rows. Views obtained earlier are not affected.
+    def discard(self, k: int):
+        k = min(k, self.n)
+        if k:
+            self.buf = self.buf[k:]
+            self.n -= k
+
+    # drop all rows from index {n} onwards.
+    def truncate(self, n: int):
+        self.n = min(self.n, n)
+
+    def clear(self):
+        self.buf = None
+        self.n = 0
+        self.integral = True
+
+    # return -> array of all rows. This is a view, not a copy.
+    def view(self) -> np.ndarray:
+        if self.buf is None:
+            return np.empty((0,) * self.ndim, dtype = self.dtype)
+        return self.buf[:self.n]
+
+    # return -> array of all rows, of integers if the first row given was (see integral) and all values
+    #   are whole, so that saved files keep the type of the values recorded. A view unless converted.
+    def export(self) -> np.ndarray:
+        rows = self.view()
+        if self.integral and len(rows) and np.array_equal(rows, np.round(rows)):
+            return rows.astype(np.int64)
+        return rows
+
+
+# read-only sequence of the Frames in a Data instance.
+# each Frame is built on access as a view into the columns of Data.
+class FrameList(Sequence):
+    def __init__(self, data):
+        self.data = data
+
+    def __len__(self) -> int:
+        return len(self.data.channels['t'])
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self.data.get_frame(i) for i in range(*key.indices(len(self)))]
+        return self.data.get_frame(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.data.get_frame(i)
+
+
+# per-frame values of a ragged field, e.g. spectra, may be lists or arrays (see Numerical.fft).
+# return -> True if {a} and {b} hold the same values.
+def ragged_equal(a: list, b: list) -> bool:
+    return len(a) == len(b) and all(x is y or (x is not None and y is not None and np.array_equal(x, y))
+                                    for x, y in zip(a, b))
+
 # stores all data.
-@dataclass
+# frames are stored by column: each of t, accel, dist, mass and rpm is a numpy array
+# with the frame index as its first axis (see CHANNELS), while audio and its spectra,
+# whose lengths vary from frame to frame, are kept as lists (see RAGGED).
+@dataclass(eq = False)
 class Data:
     height: float = None
     target_rpm: list = None
@@ -101,64 +251,175 @@ class Data:
     platform: str = None    # 'snaptain' or 'betaflight' or 'betaflight-2'
     description: str = None
     compact: bool = False
-    frames: list = field(default_factory=list)
-    
+
+    # channel name -> number of dimensions, e.g. t[N], rpm[N, 4], mass[N, k], accel[N, a, 3], dist[N, d].
+    CHANNELS = {'t': 1, 'accel': 3, 'dist': 2, 'mass': 2, 'rpm': 2}
+    # per-frame values that are not stored as arrays.
+    RAGGED = ('audio', 'dt', 'audio_t', 'fft_freq', 'fft_ampl', 'peak_freq', 'peak_ampl')
+    # quantities derived from a channel, cached so that they are only computed once for each frame.
+    # name -> (number of dimensions, source channel, function of source rows -> derived rows).
+    DERIVED = {'total_mass': (1, 'mass', lambda mass: mass.sum(axis = 1)),
+               'mean_rpm': (1, 'rpm', lambda rpm: rpm.mean(axis = 1)),
+               'mass_vec': (2, 'mass', NINE_CELL.reconstruct),
+               'accel_vec': (2, 'accel', lambda accel: accel[:, 0])}
+
+    def __post_init__(self):
+        self.channels = {name: Channel(ndim) for name, ndim in self.CHANNELS.items()}
+        self.ragged = {name: list() for name in self.RAGGED}
+        self.derived = {name: Channel(ndim) for name, (ndim, _, _) in self.DERIVED.items()}
+        self.time_sorted = (0, True)   # (number of frames checked, whether they are in time order), see is_time_sorted.
+        self.writer = None  # datafile.Writer, see stream.
+        self.pending = None # (name, mmap) of a file whose frames are yet to be loaded, see load.
+        self.source = None  # path to the file this instance was loaded from, while unmodified. See processor.get_lift_by_batch.
+        self.recorder = None    # Recorder audio is pulled from, see listen.
+        self.stft = None        # spectrum.STFT fed with the audio of every frame added, see listen.
+
     # add a frame of data.
     # kwargs: this allows use of **asdict(ardmanager_object.get_reading())
     # keys in kwargs that are not a Frame attr are ignored.
+    # audio: None to pull the audio since the last frame from the Recorder being listened to, if any (see listen).
+    # audio_t: time of the first sample of audio, on the clock of t. None: taken to end at t.
+    # spectra = True: also store the spectrum of the audio of this frame in (fl, fr] and its peaks
+    #   (fft_freq, fft_ampl, peak_freq, peak_ampl), e.g. for the 'freq' and 'peak' plots of plotter.Plotter.
+    #   None: unless audio is analysed as a whole by the STFT of listen.
     def add(self, t:float,
             audio:list = None,
             dt:float = None,
             fl:float = 0,
             fr:float = 20000,
+            audio_t:float = None,
+            spectra:bool = None,
             **kwargs):
+        self.source = None
+        if audio is None and self.recorder is not None:
+            audio, dt, audio_t = self._pull_audio(t)
+
+        if isinstance(audio, np.ndarray):
+            # may be a view of a Recorder buffer, which is overwritten.
+            audio = audio.copy()
+        if self.stft is not None and audio is not None and len(audio) and (audio_t is not None or dt):
+            self.stft.push(audio, audio_t if audio_t is not None else t - len(audio) * dt)
+        if spectra is None:
+            spectra = self.stft is None
+
         # process peaks
         freq, ampl, peak_freq, peak_ampl = [None for i in range(4)]
-        if audio and dt:
+        if spectra and audio is not None and len(audio) and dt:
             freq, ampl = Numerical.fft(audio, dt, fl, fr)
-            peak_freq, peak_ampl = Numerical.find_peaks(freq, ampl) 
+            peak_freq, peak_ampl = Numerical.find_peaks(freq, ampl)
             peak_freq, peak_ampl = Numerical.sort_peaks(peak_freq, peak_ampl)
 
-        # remove unknown properties in kwargs
-        dummy_frame = Frame()   # hasattr doesn't work on a class.
-        for kw in list(kwargs.keys()):  # or else, RuntimeError results.
-            if not hasattr(dummy_frame, kw):
-                kwargs.pop(kw)
-
-        self.frames.append(Frame(t = t,
-                                 audio = audio,
-                                 dt = dt,
-                                 fft_freq = freq,
-                                 fft_ampl = ampl,
-                                 peak_freq = peak_freq,
-                                 peak_ampl = peak_ampl,
-                                 compact = False,
-                                 **kwargs
-                          )     )
-    
+        n = len(self.channels['t'])
+        try:
+            self.channels['t'].append(t)
+            for name in ('accel', 'dist', 'mass', 'rpm'):
+                row = kwargs.get(name)
+                self.channels[name].append(row if row is not None else ())
+        except ValueError:
+            # keep all channels the same length.
+            for channel in self.channels.values():
+                channel.truncate(n)
+            raise
+
+        ragged = self.ragged
+        ragged['audio'].append(audio)
+        ragged['dt'].append(dt)
+        ragged['audio_t'].append(audio_t)
+        ragged['fft_freq'].append(freq)
+        ragged['fft_ampl'].append(ampl)
+        ragged['peak_freq'].append(peak_freq)
+        ragged['peak_ampl'].append(peak_ampl)
+
+        if self.writer is not None and len(self.channels['t']) - self.stream_start >= self.stream_chunk:
+            self._write_block()
+
 
     # GET functions (public)
-    # returns a generic get function, which attempts to provide a list
-    # of that variable in the different frames
+    # all take an optional {window}: only the last {window} frames are returned, in O(window).
+    # None gives all frames.
+
+    # return -> array of a channel in CHANNELS, with frames along the first axis.
+    #   This is a view: it is not updated by subsequent calls to add.
+    def get_channel(self, name: str, window: int = None) -> np.ndarray:
+        return tail(self.channels[name].view(), window)
+
+    # return -> read-only array of a quantity in DERIVED, with frames along the first axis.
+    #   Only the frames added since the last call are computed, so that live consumers
+    #   (e.g. plotter.Plotter) do not rescan the whole history on every update.
+    def get_derived(self, name: str, window: int = None) -> np.ndarray:
+        _, source, func = self.DERIVED[name]
+        rows = self.get_channel(source)
+        derived = self.derived[name]
+        if len(derived) < len(rows):
+            derived.extend(func(rows[len(derived):]))
+
+        view = tail(derived.view(), window)
+        view.flags.writeable = False
+        return view
+
+    def get_t(self, window: int = None) -> np.ndarray:
+        return self.get_channel('t', window)
+
+    # NOTE: even when Arduino isn't connected, this will yield 0.
+    # return -> array of total mass by frame.
+    def get_total_mass(self, window: int = None) -> np.ndarray:
+        return self.get_derived('total_mass', window)
+
+    # return -> array of mean rpm by frame.
+    def get_mean_rpm(self, window: int = None) -> np.ndarray:
+        return self.get_derived('mean_rpm', window)
+
+    # reconstruct 3d force vectors from load cell readings, for all frames at once. See force.py.
+    # layout: cell geometry of the rig. Forces with the default 9-load cell layout are cached (see DERIVED).
+    # return -> array [N, 3] of forces by frame.
+    def get_mass_vec(self, window: int = None, layout: CellLayout = NINE_CELL) -> np.ndarray:
+        mass = self.get_channel('mass')
+        if len(mass) and mass.shape[1] != len(layout):
+            raise IndexError(f'(E) Data::get_mass_vec: must have {len(layout)} elements for get_mass_vec to work ({layout.name} setup.)')
+
+        if layout is NINE_CELL:
+            return self.get_derived('mass_vec', window)
+        return layout.reconstruct(tail(mass, window))
+
+    # NOTE: HARDCODING HERE.
+    # return -> array [N, 3] of readings of the first accelerometer.
+    def get_accel_vec(self, window: int = None) -> np.ndarray:
+        return self.get_derived('accel_vec', window)
+
+    # NOTE: HARDCODING HERE.
+    # return -> array of readings of the first ultrasound distance sensor.
+    def get_dist(self, window: int = None) -> np.ndarray:
+        return self.get_channel('dist', window)[:, 0]
+
+    # returns a generic get function for the remaining Frame attributes / get_* functions.
+    # arrays are returned for CHANNELS, and lists of the per-frame values otherwise.
     def __getattr__(self, attr: str):
+        # frames of a lazily loaded instance are loaded on first access.
+        if attr in ('channels', 'ragged') and self.__dict__.get('pending') is not None:
+            self._load_pending()
+            return getattr(self, attr)
+
         # intended to sub for generic get_* functions only
         if '_' not in attr or attr.split('_')[0] != 'get':
             raise AttributeError('Attribute does not exist.')
 
         attr_type, var_name = attr.split('_', 1)
-        dummy_frame = Frame()
 
-        if not (hasattr(dummy_frame, attr) or hasattr(dummy_frame, var_name)):
-            raise AttributeError('Relevant get_* function or variable not found in Frame.')
+        # a get_* function in Frame without a vectorised counterpart in Data.
+        if hasattr(Frame, attr):
+            return lambda window = None: [getattr(frame, attr)() for frame in tail(self.frames, window)]
 
-        def get_func() -> list:
-            # test for the get function
-            if hasattr(dummy_frame, attr):
-                return [getattr(frame, attr)() for frame in self.frames] 
+        if var_name in self.CHANNELS:
+            return lambda window = None: self.get_channel(var_name, window)
 
-            return [getattr(frame, var_name) for frame in self.frames]
+        if var_name in self.RAGGED:
+            return lambda window = None: list(tail(self.ragged[var_name], window))
 
-        return get_func
+        raise AttributeError('Relevant get_* function or variable not found in Frame.')
+
+    # return -> dict of all metadata (everything but the frames).
+    def get_metadata(self) -> dict:
+        return {f.name: getattr(self, f.name) for f in dataclasses.fields(self)}
 
     def get_date(self) -> str:
         return datetime.fromtimestamp(self.timestamp).strftime('%d/%m/%Y %H:%M:%S')
@@ -167,28 +428,95 @@ class Data:
     # if only one data point is provided, stdev is set to 0.
     def get_mass_stat(self) -> tuple[float, float]:
         tot_mass = self.get_total_mass()
-        stdev = st.stdev(tot_mass) if len(tot_mass) > 1 else 0
-        return st.mean(tot_mass), stdev
+        stdev = tot_mass.std(ddof = 1) if len(tot_mass) > 1 else 0
+        return tot_mass.mean(), stdev
+
+    # return -> True if all frames are in time order (as recorded), so that they can be binary searched by t.
+    #   Only the frames added since the last call are checked.
+    def is_time_sorted(self) -> bool:
+        t = self.get_t()
+        checked, is_sorted = self.time_sorted
+        if is_sorted and checked < len(t):
+            # NaN compares False, so any NaN counts as unsorted.
+            new = t[max(checked - 1, 0):]
+            is_sorted = bool(np.all(new[1:] >= new[:-1]))
+        self.time_sorted = (len(t), is_sorted)
+        return is_sorted
+
+    # return -> index of the first frame with frame.t > t (side = 'right') or frame.t >= t (side = 'left'),
+    #   len(frames) if there is none. O(log n) if frames are in time order, O(n) otherwise.
+    def search_t(self, t: float, side: str = 'right') -> int:
+        times = self.get_t()
+        if self.is_time_sorted():
+            return int(np.searchsorted(times, t, side = side))
+
+        later = np.flatnonzero(times > t if side == 'right' else times >= t)
+        return int(later[0]) if len(later) else len(times)
 
     # return -> frame at index {ind} or first frame with frame.t > t
     #   None in case of no match
     def get_frame(self, ind:int = None, t:float = None) -> Frame:
-        if (ind and t):
+        if (ind is not None and t is not None):
             raise Exception("Can only get_frame() specifying one of index and time.")
 
-        if ind:
-            return self.frames[ind]
-        
-        if t:
-            for frame in self.frames:
-                if frame.t > t:
-                    return frame
-
-        return None
+        if t is not None:
+            ind = self.search_t(t)
+            if ind == len(self.frames):
+                return None
+
+        if ind is None:
+            return None
+
+        channels = self.channels
+        return Frame(t = channels['t'].view()[ind],
+                     accel = channels['accel'].view()[ind],
+                     dist = channels['dist'].view()[ind],
+                     mass = channels['mass'].view()[ind],
+                     rpm = channels['rpm'].view()[ind],
+                     compact = self.compact,
+                     **{name: values[ind] for name, values in self.ragged.items()})
+
+    # return -> Data with the same metadata, and only the frames with t0 <= frame.t < t1.
+    #   Either limit can be None. e.g. data.window(5, relative = True) drops the first 5 seconds.
+    #   If frames are in time order, channels are views into those of this instance, and no frames
+    #   are copied; like after load, they are only copied once frames are added to the window.
+    # relative = True: t0 and t1 are measured from the time of the first frame.
+    def window(self, t0: float = None, t1: float = None, relative: bool = False):
+        times = self.get_t()
+        if relative and len(times):
+            t0 = None if t0 is None else times[0] + t0
+            t1 = None if t1 is None else times[0] + t1
+
+        if self.is_time_sorted():
+            start = self.search_t(t0, side = 'left') if t0 is not None else 0
+            end = self.search_t(t1, side = 'left') if t1 is not None else len(times)
+            return self._select(slice(start, max(start, end)))
+
+        keep = np.ones(len(times), dtype = bool)
+        if t0 is not None:
+            keep &= times >= t0
+        if t1 is not None:
+            keep &= times < t1
+        return self._select(np.flatnonzero(keep))
+
+    # return -> read-only sequence of all frames. See FrameList.
+    @property
+    def frames(self) -> FrameList:
+        return FrameList(self)
 
     def __getitem__(self, key) -> Frame:
         return self.frames[key]
 
+    # True if metadata and all frames are identical.
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Data):
+            return NotImplemented
+
+        return (self.get_metadata() == other.get_metadata()
+                and all(np.array_equal(self.get_channel(name), other.get_channel(name))
+                        for name in self.CHANNELS)
+                and all(ragged_equal(self.ragged[name], other.ragged[name]) for name in self.RAGGED))
+
     # AUXILIARY functions (public)
     # re-initialise this instance.
     def clear(self):
@@ -198,80 +526,335 @@ class Data:
         self.platform = None
         self.description = None
         self.compact: bool = False
-    
-        self.frames.clear()
+        self.source = None
+
+        if self.pending is not None:
+            # frames were never loaded.
+            self.pending = None
+            self.channels = {name: Channel(ndim) for name, ndim in self.CHANNELS.items()}
+            self.ragged = {name: list() for name in self.RAGGED}
+
+        for channel in self.channels.values():
+            channel.clear()
+        for channel in self.derived.values():
+            channel.clear()
+        for values in self.ragged.values():
+            values.clear()
+        self.time_sorted = (0, True)
 
-    # TODO: not tested yet
     # remove all audio information in all Frames to reduce memory use.
     # return -> compactified copy of data instance (data.compact = True)
+    #   channel arrays are shared with the original until either is appended to.
     def compactify(self):
         data_copy = dataclasses.replace(self)
-        data_copy.frames = [frame.compactify() for frame in self.frames]
+        for name, channel in self.channels.items():
+            data_copy.channels[name].set(channel.view())
+        data_copy.ragged = {name: list(values) for name, values in self.ragged.items()}
+        data_copy.ragged['audio'] = [[] for i in range(len(self.frames))]
         data_copy.compact = True
         return data_copy
 
-    # save this instance to json file at {name}.
-    # name: path to json file.
-    def dump(self, name: str):
-        frames_list = [frame.__dict__ for frame in self.frames]
-        # modify the original dict, because json cannot parse our Frame class.
-        # data_dict['frames'] = frames_list # NO!!! This will overwrite self.__dict__['frames'].
-        # PEP 448 merge operator. {} term will overwrite frames but create new dict.
-        data_dict = self.__dict__ | {'frames': frames_list}
-        data_json = json.dumps(data_dict, indent = 4)
+    # save this instance to file at {name}.
+    # name: path to json file, or binary file (see datafile.py).
+    # binary: True to save in the binary format. None: binary iff name has the binary extension.
+    def dump(self, name: str, binary: bool = None):
         if os.path.isfile(name):
             raise IOError(f'(E) Data::dump: {name} already exists.')
 
+        self._save_spectrogram(name)
+        if binary is None:
+            binary = name.split('.')[-1] == datafile.EXTENSION
+
+        if binary:
+            datafile.write(name,
+                           self.get_metadata(),
+                           {key: self.channels[key].export() for key in self.CHANNELS},
+                           self.ragged)
+            return
+
+        # rebuild the per-frame dicts of the original format, so that old files and new are alike.
+        columns = ({key: self.channels[key].export().tolist() for key in self.CHANNELS}
+                   | {name: [value.tolist() if isinstance(value, np.ndarray) else value for value in values]
+                      for name, values in self.ragged.items()}
+                   | {'compact': [self.compact] * len(self.frames)})
+        frames_list = [{key: columns[key][i] for key in FRAME_FIELDS}
+                       for i in range(len(self.frames))]
+        # PEP 448 merge operator. {} term will add frames to a new dict.
+        data_dict = self.get_metadata() | {'frames': frames_list}
+        data_json = json.dumps(data_dict, indent = 4)
+
         with open(name, 'w') as file:
             file.write(data_json)
 
-    # load this instance with data in saved json file.
-    # name: path to json file.
-    def load(self, name: str):
+    # load this instance with data in saved json or binary file. The format is detected automatically.
+    # name: path to file.
+    # mmap = True: for binary files, channels are read-only memory maps of the file instead of copies.
+    #   They are copied on the first call to add.
+    # lazy = True: only read the metadata (height, target_rpm, etc.) for now. Frames are loaded
+    #   on first access, so that files can be filtered by metadata without parsing all frames.
+    def load(self, name: str, mmap: bool = True, lazy: bool = False):
         if not os.path.isfile(name):
             raise IOError(f'(E) Data::load: {name} does not exist.')
 
         # that is, some frames already exist.
-        if self.frames:
+        if len(self.frames):
             raise Exception(f'(E) Data::load: frames are already present. Refusing to overwrite.')
-        
+
         # ...but clear nonetheless.
         self.clear()
+        self.source = name
+        if lazy:
+            self._set_metadata(Data.read_metadata(name))
+            self.pending = (name, mmap)
+            # accessed through __getattr__ from now on.
+            del self.channels
+            del self.ragged
+            return
+
+        if datafile.is_binary(name):
+            self._load_binary(name, mmap)
+            return
+
         with open(name, 'r') as file:
             data_json = file.read()
             data_dict = json.loads(data_json)
-            
-            for key, value in data_dict.items():
-                # frames have been converted and needs to be dealt with separately
-                # plus, only set keys that exist.
-                if key != 'frames' and key in self.__dict__:
-                    setattr(self, key, value)
-            
-            for frame_dict in data_dict['frames']:
-                frame = Frame()
-                frame.update(frame_dict)
-                self.frames.append(frame)
 
+            self._set_metadata(data_dict)
+            self._set_frames(data_dict['frames'])
+
+    # read only the metadata of a saved json or binary file, without parsing the frames.
+    # return -> dict of metadata, see get_metadata.
+    @staticmethod
+    def read_metadata(name: str) -> dict:
+        if datafile.is_binary(name):
+            return datafile.read_header(name)[0]['metadata']
+
+        # json dumps store the metadata before the frames: parse only what comes before.
+        key = '"frames"'
+        text = ''
+        with open(name, 'r') as file:
+            while chunk := file.read(4096):
+                start = max(len(text) - len(key), 0)
+                text += chunk
+                ind = text.find(key, start)
+                if ind < 0:
+                    continue
+
+                try:
+                    return json.loads(text[:ind].rstrip().rstrip(',') + '}')
+                except json.JSONDecodeError:
+                    break   # unusual layout: fall back to parsing everything.
+
+            text += file.read()
+
+        data_dict = json.loads(text)
+        data_dict.pop('frames', None)
+        return data_dict
+
+    # load the frames of a lazily loaded instance.
+    def _load_pending(self):
+        name, mmap = self.pending
+        data = Data()
+        data.load(name, mmap)
+        self.channels = data.channels
+        self.ragged = data.ragged
+        self.pending = None
+
+    def _load_binary(self, name: str, mmap: bool):
+        metadata, channels, ragged = datafile.read(name, mmap)
+        self._set_metadata(metadata)
+        for key, rows in channels.items():
+            if key in self.channels:
+                self.channels[key].set(rows)
+
+        n = len(self.frames)
+        for key in self.RAGGED:
+            self.ragged[key] = ragged.get(key, [None] * n)
+
+    # set metadata from a dict, ignoring keys that are not metadata (e.g. frames).
+    def _set_metadata(self, metadata: dict):
+        fields = self.get_metadata()
+        for key, value in metadata.items():
+            if key in fields:
+                setattr(self, key, value)
+
+    # fill the columns from a list of frame dicts, as found in saved json files.
+    # missing keys take the Frame default.
+    def _set_frames(self, frames_list: list):
+        default = Frame()
+        for name in self.CHANNELS:
+            rows = [frame_dict.get(name) for frame_dict in frames_list]
+            empty = getattr(default, name)
+            self.channels[name].set([row if row is not None else empty for row in rows])
+
+        for name in self.RAGGED:
+            self.ragged[name] = [frame_dict.get(name, getattr(default, name)) for frame_dict in frames_list]
+
+    # return -> Data with the same metadata and the frames at {key} (a slice or an array of indices).
+    #   For slices, channels and computed derived rows are views into those of this instance.
+    def _select(self, key: slice|np.ndarray):
+        data = dataclasses.replace(self)
+        for name, channel in self.channels.items():
+            data.channels[name].set(channel.view()[key])
+
+        if isinstance(key, slice):
+            for name, channel in self.derived.items():
+                # derived rows are a prefix; keep whatever part of it falls into the window.
+                if key.start <= len(channel):
+                    data.derived[name].set(channel.view()[key.start:min(key.stop, len(channel))])
+            data.ragged = {name: values[key] for name, values in self.ragged.items()}
+        else:
+            data.ragged = {name: [values[i] for i in key] for name, values in self.ragged.items()}
+
+        return data
+
+
+    # stream this instance to a journal file at {name} (see datafile.Writer) while recording.
+    # the frames already present, and all frames added from now on, are written in blocks of
+    # {chunk} frames by a background thread. The journal is complete after close_stream, and
+    # can be loaded with Data.load; if recording is aborted, all blocks written can be recovered.
+    # keep: number of most recent frames kept in memory once written. None: keep all frames.
+    #   This bounds memory use for long recordings, at the cost of only the last frames
+    #   being available (e.g. for live plotting) until the journal is loaded again.
+    def stream(self, name: str, chunk: int = 256, keep: int = None):
+        if self.writer is not None:
+            raise Exception(f'(E) Data::stream: already streaming to {self.writer.name}.')
+
+        self.writer = datafile.Writer(name, self.get_metadata())
+        self.stream_chunk = chunk
+        self.stream_keep = keep
+        self.stream_start = 0   # frames from this index onwards are not yet written.
+
+    # pull audio from {recorder} into the frames added from now on, without blocking: each frame gets
+    # the audio captured since the previous frame, up to its own t, with the time of its first sample
+    # (audio_t). Audio, and the other channels, can thus be sampled at independent rates and still line up.
+    # audio_t follows the sample index from one origin (see Recorder.get_origin), fixed for the session,
+    # so that contiguous audio gets contiguous times. It is only taken again after the device drops samples.
+    # t0: time.monotonic() at which t = 0. None: now.
+    # stft: spectrum.STFT (at the fs of recorder) to feed with the audio of every frame as it is added, so that
+    #   the spectrogram of the whole recording is built while recording. It is saved with the frames by
+    #   dump and close_stream (see spectrum.load). Samples lost by the recorder start its segments afresh.
+    # recorder = None: stop. The stft, if any, is kept until the next call, to be saved.
+    def listen(self, recorder, t0: float = None, stft = None):
+        self.recorder = recorder
+        if recorder is not None or stft is not None:
+            self.stft = stft
+        self.listen_t0 = time.monotonic() if t0 is None else t0
+        self.listen_next = None     # index of the first sample not yet pulled.
+        self.listen_origin = None   # time.monotonic() of sample 0, see Recorder.get_origin.
+        self.listen_overflows = None
+
+    # return -> (audio, dt, audio_t) for a frame at {t}, see listen.
+    def _pull_audio(self, t: float) -> tuple:
+        recorder = self.recorder
+        # samples dropped by the device, or overwritten before being pulled: the audio does not follow on.
+        gap = self.listen_next is not None and recorder.overflows != self.listen_overflows
+        if self.listen_origin is None or recorder.overflows != self.listen_overflows:
+            self.listen_origin = recorder.get_origin()
+            self.listen_overflows = recorder.overflows
+        if self.listen_next is None:
+            self.listen_next = recorder.get_index(self.listen_t0, self.listen_origin)
+        start, audio = recorder.get_range(self.listen_next, recorder.get_index(self.listen_t0 + t, self.listen_origin))
+        gap |= start != self.listen_next
+        if gap and self.stft is not None:
+            self.stft.reset()
+        self.listen_next = start + len(audio)
+        return audio, recorder.dt, recorder.get_time(start, self.listen_origin) - self.listen_t0
+
+    # write the remaining frames and finalise the journal started by stream.
+    # return -> checksum of the journal.
+    def close_stream(self) -> int:
+        if self.writer is None:
+            raise Exception('(E) Data::close_stream: not streaming.')
+
+        try:
+            self._save_spectrogram(self.writer.name)
+            self._write_block()
+            return self.writer.close()
+        finally:
+            self.writer = None
+
+    # save the spectrogram of the STFT fed by add (see listen), if any, with the recording at {name}.
+    def _save_spectrogram(self, name: str):
+        if self.stft is not None:
+            self.stft.save_with(name)
+
+    # queue the frames not yet written to the writer, then drop old frames beyond stream_keep.
+    def _write_block(self):
+        start = self.stream_start
+        end = len(self.frames)
+        if end > start:
+            # copies, so that the writer thread never shares memory with the columns.
+            self.writer.write({name: self.channels[name].export()[start:end].copy() for name in self.CHANNELS},
+                              {name: values[start:end] for name, values in self.ragged.items()})
+        self.stream_start = end
+
+        if self.stream_keep is not None and end > self.stream_keep:
+            drop = end - self.stream_keep
+            for channel in self.channels.values():
+                channel.discard(drop)
+            for channel in self.derived.values():
+                channel.discard(drop)
+            for values in self.ragged.values():
+                del values[:drop]
+            checked, is_sorted = self.time_sorted
+            self.time_sorted = (max(checked - drop, 0), is_sorted)
+            self.stream_start -= drop
+
+    # convert all json Data files in {path} to the binary format (see datafile.py).
+    # output files are saved in {output_dir}, path/binary/ by default, with the binary extension.
+    # files which have already been converted (and not modified since) are skipped.
+    # verify = True: reload each converted file and check it is identical to the original.
+    # return -> list of paths to converted files.
+    @staticmethod
+    def convert_to_binary(path: str, output_dir: str = None, verify: bool = True) -> list:
+        if output_dir is None:
+            output_dir = os.path.join(path, 'binary')
+        os.makedirs(output_dir, exist_ok = True)
+
+        converted = list()
+        for filename in sorted(os.listdir(path)):
+            name = os.path.join(path, filename)
+            if (not os.path.isfile(name)) or filename.split('.')[-1] != 'json':
+                continue
+
+            output_name = os.path.join(output_dir, filename[:-len('json')] + datafile.EXTENSION)
+            if os.path.isfile(output_name) and os.path.getmtime(output_name) >= os.path.getmtime(name):
+                continue
+
+            print(f'Data::convert_to_binary: converting {name}')
+            data = Data()
+            data.load(name)
+            if os.path.isfile(output_name):
+                os.remove(output_name)  # outdated
+            data.dump(output_name, binary = True)
+
+            if verify:
+                data2 = Data()
+                data2.load(output_name)
+                if data2 != data:
+                    raise IOError(f'(E) Data::convert_to_binary: {output_name} differs from {name}.')
+
+            converted.append(output_name)
+
+        return converted
 
     # LEGACY functions (private)
-    # deprecated in favour of new load function, which enables more sophiscated Data class structures. 
+    # deprecated in favour of new load function, which enables more sophiscated Data class structures.
     def _load_frames_list(self, name):
         if not os.path.isfile(name):
             raise IOError(f'(E) Data::load: {name} does not exist.')
 
         # that is, some frames already exist.
-        if self.frames:
+        if len(self.frames):
             raise Exception(f'(E) Data::load: frames are already present. Refusing to overwrite.')
-        
+
         # ...but clear nonetheless.
         self.clear()
         with open(name, 'r') as file:
             frames_json = file.read()
             frames_list = json.loads(frames_json)
-            for frame_dict in frames_list:
-                frame = Frame()
-                frame.update(frame_dict)
-                self.frames.append(frame)
+            self._set_frames(frames_list)
 
     # convert the now-deprecated frame_list json files to the new format
     # output files are saved in path/converted/
@@ -292,7 +875,7 @@ class Data:
             print(f'converting {name}')
             data = Data()
             data._load_frames_list(name)
-            
+
             if filename[0] == 'h':
                 # remove h at front, remove separators, and replace _ with -,
                 # which in the file represents the minus sign.
@@ -427,16 +1010,30 @@ class Recorder:
     fs = 48000  # Record at 44100 samples per second
     dt = 1 / fs
     device_index = None # A default device index
+    buffer_time = 60    # seconds of audio kept in the ring buffer; the longest window that can be recorded.
 
     # PRIVATE METHODS
     # device_name: which device to record from.
-    # kwargs: user-specified pyaudio settings.
+    # kwargs: user-specified pyaudio settings, or overloads of the defaults above, e.g. fs, buffer_time.
     # defaults to linux system with pipewire.
     def __init__(self, device_name: str = 'pipewire', **kwargs):
-        for kw, val in kwargs:
+        for kw, val in list(kwargs.items()):
             # overload the defaults
             if hasattr(self, kw):
-                setattr(self, kw, val)
+                setattr(self, kw, kwargs.pop(kw))
+        self.dt = 1 / self.fs
+
+        # audio is captured by the stream callback into a ring buffer, written twice (at i and i + capacity),
+        # so that the last {capacity} samples are always contiguous, see get_last.
+        self.capacity = -(-int(self.buffer_time * self.fs) // self.chunk) * self.chunk
+        self.buffer = np.zeros(2 * self.capacity, dtype = np.float32)
+        self.written = 0        # samples captured since the stream started.
+        self.read = 0           # samples handed out by record or get_last.
+        self.overflows = 0      # chunks flagged by PortAudio as input overflow: samples dropped by the device.
+        self.overruns = 0       # samples asked for (see get_range) after they were overwritten: lost by a reader that fell behind.
+        # (time.monotonic(), samples captured) at the end of each chunk, for the chunks in the buffer. See get_origin.
+        self.stamps = np.full((self.capacity // self.chunk, 2), np.nan)
+        self.n_stamps = 0
 
         self.pa = pyaudio.PyAudio()
 
@@ -459,23 +1056,33 @@ class Recorder:
                                    frames_per_buffer=self.chunk,
                                    input=True,
                                    input_device_index=self.device_index,
+                                   stream_callback=self.capture,
                                    # still pass it in just in case other pa options are specified
                                    **kwargs)
         self.record(self.startup_time)  # rid of weird junk at start
-        
-    # get raw data; not parsed to avoid overhead during rec.
-    # return -> raw_chunk: bytes
-    def get_chunk(self) -> bytes:
-        # Workaround for input overflowed error
-        raw_chunk = self.stream.read(self.chunk, exception_on_overflow = False)
-        return raw_chunk
-
-    # parse raw_audio received from get_chunk to numbers.
-    # return -> list of amplitudes in time
+
+    # stream callback: copy a chunk into the ring buffer. Runs in the PortAudio thread.
+    def capture(self, in_data: bytes, frame_count: int, time_info: dict, status: int) -> tuple:
+        now = time.monotonic()
+        audio = self.parse(in_data)
+        if status & pyaudio.paInputOverflow:
+            self.overflows += 1
+            # samples were dropped before this chunk: stamps from before the gap no longer bound the origin.
+            self.n_stamps = 0
+
+        index = (self.written + np.arange(len(audio))) % self.capacity
+        self.buffer[index] = audio
+        self.buffer[index + self.capacity] = audio
+        self.stamps[self.n_stamps % len(self.stamps)] = (now, self.written + len(audio))
+        self.n_stamps += 1
+        self.written += len(audio)
+        return None, pyaudio.paContinue
+
+    # parse raw_audio received from the stream to numbers.
+    # return -> array of amplitudes in time, a view of raw_audio.
     @staticmethod
-    def parse(raw_audio: bytes) -> list:
-        parsed = np.frombuffer(raw_audio, dtype=np.float32).tolist()
-        return parsed
+    def parse(raw_audio: bytes) -> np.ndarray:
+        return np.frombuffer(raw_audio, dtype=np.float32)
 
     # PUBLIC METHODS 
     # print audio devices and their indices
@@ -488,45 +1095,129 @@ class Recorder:
         for i in range(0, numdevices):
             if (p.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
                 print("Input Device id ", i, " - ", p.get_device_info_by_host_api_device_index(0, i).get('name'))
-   
+
+    # the last {window} seconds of audio captured, without waiting.
+    # return -> float32 array of amplitudes by time, a view of the ring buffer: it is overwritten
+    #   after buffer_time seconds, so copy it to keep it longer.
+    def get_last(self, window: float = 1) -> np.ndarray:
+        n = round(window * self.fs)
+        if n > self.capacity:
+            raise ValueError(f'(E) Recorder::get_last: window of {window}s is longer than the buffer, {self.buffer_time}s.')
+        end = self.written
+        return self.get_range(end - n, end)[1]
+
+    # chunks reach the callback some latency after they are sampled, so each stamp bounds the time of
+    # the first sample from above; the tightest bound over the chunks in the buffer is taken, which is
+    # free of the jitter of the callback and follows slow drift between the audio and host clocks.
+    # the bound moves by a few ms as chunks enter and leave the buffer, so times that must stay
+    #   contiguous with the samples (e.g. Data.listen) should keep one origin and pass it to get_index and get_time.
+    # return -> time.monotonic() of the first sample captured, up to the least latency.
+    def get_origin(self) -> float:
+        stamps = self.stamps[:min(self.n_stamps, len(self.stamps))]
+        if not len(stamps):
+            raise Exception('(E) Recorder::get_origin: no audio captured yet.')
+        return float(np.min(stamps[:, 0] - stamps[:, 1] * self.dt))
+
+    # origin: time of the first sample, see get_origin. None: the current one.
+    # return -> index of the sample captured at time.monotonic() {t}.
+    def get_index(self, t: float, origin: float = None) -> int:
+        origin = self.get_origin() if origin is None else origin
+        return round((t - origin) * self.fs)
+
+    # origin: see get_index.
+    # return -> time.monotonic() at which sample {index} was captured.
+    def get_time(self, index: int, origin: float = None) -> float:
+        origin = self.get_origin() if origin is None else origin
+        return origin + index * self.dt
+
+    # samples [start, end) by index, without waiting: those not yet captured, or already overwritten, are left out.
+    #   The latter are counted in overruns.
+    # return -> (index of the first sample returned, float32 array of amplitudes by time). See get_last.
+    def get_range(self, start: int, end: int) -> tuple[int, np.ndarray]:
+        written = self.written
+        self.overruns += max(min(end, written - self.capacity) - max(start, 0), 0)
+        start = max(start, written - self.capacity, 0)
+        end = max(min(end, written), start)
+        self.read = max(self.read, end)
+        offset = start % self.capacity
+        return start, self.buffer[offset:offset + end - start]
+
     # window: length of recording in seconds
-    # return -> list of amplitues by time.
-    def record(self, window: float=1) -> list:
-        audio = []
-
-        t = time.time()
-        raw_audio = self.get_chunk()
-        while time.time() - t < window:
-            raw_audio = raw_audio + self.get_chunk() 
-            
-        # do the resource-heavy conversion only at the end
-        audio = self.parse(raw_audio)
-        return audio        
+    # return -> float32 array of amplitudes by time, of the {window} seconds from now. See get_last.
+    def record(self, window: float=1) -> np.ndarray:
+        if round(window * self.fs) > self.capacity:
+            raise ValueError(f'(E) Recorder::record: window of {window}s is longer than the buffer, {self.buffer_time}s.')
+        end = self.written + round(window * self.fs)
+        while self.written < end:
+            time.sleep(self.chunk * self.dt / 2)
+        return self.get_last(window)
 
     # close the stream and terminate PyAudio.
-    def close():
+    def close(self):
         self.stream.stop_stream()
         self.stream.close()
         self.pa.terminate()
 
 
+# frequency grid of a band-limited real FFT of chunks of {n} samples, see Numerical.get_plan.
+# frames are multiplied by the window, zero-padded to nfft samples, transformed, then cut to the band.
+@dataclass(frozen = True, eq = False)
+class SpectralPlan:
+    n: int                  # samples per chunk.
+    nfft: int               # samples per transform, n zero-padded.
+    window: np.ndarray      # [n] float32, or None for none (rectangular).
+    band: slice             # of the rfft bins within (fl, fr].
+    freq: np.ndarray        # [k] float32 frequencies of the band.
+
+    # chunks: array [..., n] of audio, e.g. [n] for one chunk, [m, n] for m chunks.
+    # return -> array [..., k] float32 amplitudes of the band. Unnormalised, as np.abs(np.fft.fft(chunk)).
+    def transform(self, chunks) -> np.ndarray:
+        chunks = np.asarray(chunks, dtype = np.float32)
+        if chunks.shape[-1] != self.n:
+            raise ValueError(f'(E) SpectralPlan::transform: plan is for chunks of {self.n} samples, got {chunks.shape[-1]}.')
+        if self.window is not None:
+            chunks = chunks * self.window
+        return np.abs(np.fft.rfft(chunks, n = self.nfft, axis = -1)[..., self.band]).astype(np.float32)
+
 class Numerical:
-    # audio: list of amplitudes
+    # frequency grid and band of the real FFT of chunks of {n} samples. Cached, as the same plan serves
+    #   every chunk of a recording.
     # dt: difference in time between two neighbouring audio values.
-    # fl, fr: range of frequencies to do fft [fl, fr].
-    # return -> freq's and the corresponding amplitudes at the freqs.
+    # fl, fr: range of frequencies to keep (fl, fr].
+    # window: None, or name of a window function, see scipy.signal.get_window, e.g. 'hann'.
+    # pad: zero-pad chunks to pad times their length, for a finer frequency grid.
+    # return -> SpectralPlan
+    @staticmethod
+    @lru_cache(maxsize = 64)
+    def get_plan(n: int, dt: float, fl: float = 0, fr: float = 20000, window: str = None, pad: int = 1) -> SpectralPlan:
+        nfft = n * pad
+        freq = np.fft.rfftfreq(nfft, d = dt)
+        # left and right indices of the band (fl, fr], as freq is sorted.
+        il = np.searchsorted(freq, fl, side = 'right')
+        ir = np.searchsorted(freq, fr, side = 'right')
+        window = signal.get_window(window, n).astype(np.float32) if window is not None else None
+        return SpectralPlan(n, nfft, window, slice(il, ir), freq[il:ir].astype(np.float32))
+
+    # audio: list or array of amplitudes
+    # dt: difference in time between two neighbouring audio values.
+    # fl, fr: range of frequencies to do fft (fl, fr].
+    # window, pad: see get_plan.
+    # return -> freq's and the corresponding amplitudes at the freqs, float32 arrays.
+    @staticmethod
+    def fft(audio: list, dt: float, fl: float = 0, fr: float = 20000,
+            window: str = None, pad: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        plan = Numerical.get_plan(len(audio), dt, fl, fr, window, pad)
+        return plan.freq, plan.transform(audio)
+
+    # fft of many chunks of the same length at once, as one 2D transform.
+    # chunks: array [m, n] of audio, one chunk per row.
+    # return -> (freq [k], ampl [m, k]), float32 arrays. See fft.
     @staticmethod
-    def fft(audio: list, dt: float, fl: float = 0, fr: float = 20000) -> tuple[list, list]:
-        freq = np.fft.fftfreq(len(audio), d = dt).tolist()
-        ampl = np.abs(np.fft.fft(audio)).tolist()
-        # left and right indices between fl, ft
-        il = ir = None 
-        for i in range(len(freq)):
-            if il is None and fl < freq[i]:
-                il = i
-            if ir is None and fr < freq[i]:
-                ir = i - 1
-        return freq[il:ir], ampl[il:ir]
+    def fft_batch(chunks, dt: float, fl: float = 0, fr: float = 20000,
+                  window: str = None, pad: int = 1) -> tuple[np.ndarray, np.ndarray]:
+        chunks = np.atleast_2d(np.asarray(chunks, dtype = np.float32))
+        plan = Numerical.get_plan(chunks.shape[1], dt, fl, fr, window, pad)
+        return plan.freq, plan.transform(chunks)
 
     # high-pass filter.
     # audio: list of amplitudes by time.
@@ -546,8 +1237,8 @@ class Numerical:
     @staticmethod
     def find_peaks(x:list, y:list, prom=30, dist=20, ht=50) -> tuple[list, list]:
         peaks, _ = signal.find_peaks(y, prominence=prom, distance=dist, height=ht)
-        peak_x = [x[peak] for peak in peaks]
-        peak_y = [y[peak] for peak in peaks]
+        peak_x = np.asarray(x)[peaks].tolist()
+        peak_y = np.asarray(y)[peaks].tolist()
         return peak_x, peak_y
 
     # sort the peaks in descending y values, then x
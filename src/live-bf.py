@@ -73,6 +73,7 @@ class BFLive:
                      rpm = rpm,
 #                     audio = audio,
 #                     dt = self.recorder.dt,
+#                     spectra = True,
                      fl = 400,  # TODO: up to debate if this will hold correct.
                      fr = 1000)
             self.plotter.plot(data, window = 20)
@@ -2,7 +2,7 @@ import os, time
 import numpy as np
 
 from datetime import datetime
-from lib import ard, plotter, utils, drone
+from lib import ard, plotter, utils, drone, datafile, spectrum
 from dataclasses import asdict
 from numbers import Number
 
@@ -14,14 +14,23 @@ class BFLive:
                          (1, 1): 'accel_comp'}
     PLOT_NROWS: int = 2
     PLOT_NCOLS: int = 2
+    # frames are streamed to disk in blocks of STREAM_CHUNK while recording,
+    # and only the most recent STREAM_KEEP frames are held in memory.
+    STREAM_CHUNK: int = 64
+    STREAM_KEEP: int = 2048
+    # spectrogram of the audio, built while recording and saved with each file, see spectrum.STFT.
+    SPECTROGRAM: dict = {'nperseg': 4096, 'hop': 1024, 'average': 4, 'fl': 100, 'fr': 2000}
 
     # bf_name: path to betaflight-configurator executable.
-    def __init__(self, path: str, bf_name: str = None):
+    # audio_device: name of the microphone to record audio from in the background, see utils.Recorder.
+    #   None: no audio.
+    def __init__(self, path: str, bf_name: str = None, audio_device: str = None):
         print('BFLive::__init__: initialising.')
         self.path = path
         self.quad = drone.Drone(bf_name)
         self.ardman = ard.ArdManager()
         self.plotter = plotter.Plotter(self.PLOT_NROWS, self.PLOT_NCOLS, self.PLOT_LAYOUT)
+        self.recorder = utils.Recorder(audio_device) if audio_device is not None else None
 
         self.t_str = datetime.now().strftime('%m-%d')
         self.timestamp = time.time()    # timestamp acts as a UUID for this set of data
@@ -29,7 +38,7 @@ class BFLive:
         self.cnt = -1
         for filename in os.listdir(path):
             file = os.path.join(path, filename) 
-            if not os.path.isfile(file) or "json" not in filename:
+            if not os.path.isfile(file) or filename.split('.')[-1] not in datafile.DATA_EXTENSIONS:
                 continue
             try:
                 cnt = int(filename.split('.')[-2].split('_')[-1])
@@ -104,7 +113,7 @@ class BFLive:
         if isinstance(target_rpm, Number):
             target_rpm = [target_rpm] * self.quad.NUM_OF_MOTORS
 
-        filename = f'bf_{height}_{target_rpm}_{self.t_str}_{self.cnt}.json'
+        filename = f'bf_{height}_{target_rpm}_{self.t_str}_{self.cnt}.{datafile.EXTENSION}'
         file = os.path.join(self.path, filename)
         data = utils.Data(height = height,
                           target_rpm = target_rpm,
@@ -127,29 +136,36 @@ class BFLive:
 
         print(f"Time: {datetime.fromtimestamp(time.time())}")
         print(f'BFLive::record: recording started...')
-        t = time.time()
-        while time.time() - t < rec_t:
-            rpm = self.quad.get_rpm()
-            ct = time.time() - t
-            data.add(t = ct,
-                     rpm = rpm,
-                     **asdict(self.ardman.get_reading())
-                     )
-            self.plotter.plot(data)
-        
-        print('BFLive::record: dumping raw data.')
-        data.dump(file)
-        data2 = utils.Data()
-        data2.load(file)
-        print(f'BFLive::record: dumped == original: {data2 == data}')
-
-        self.quad.set_rpm_worker_on(False)
-        self.quad.set_throttle(0)
+        data.stream(file, chunk = self.STREAM_CHUNK, keep = self.STREAM_KEEP)
+        # monotonic, the clock audio is stamped with: each frame pulls the audio since the last one.
+        t = time.monotonic()
+        if self.recorder is not None:
+            data.listen(self.recorder, t, stft = spectrum.STFT(self.recorder.fs, **self.SPECTROGRAM))
+        # on an emergency stop, all frames recorded so far are still written.
+        try:
+            while time.monotonic() - t < rec_t:
+                rpm = self.quad.get_rpm()
+                ct = time.monotonic() - t
+                data.add(t = ct,
+                         rpm = rpm,
+                         **asdict(self.ardman.get_reading())
+                         )
+                self.plotter.plot(data)
+        finally:
+            # stop the motors first, so that they stop even if finalising fails.
+            self.quad.set_rpm_worker_on(False)
+            self.quad.set_throttle(0)
+            data.listen(None)
+            print('BFLive::record: finalising raw data.')
+            checksum = data.close_stream()
+            print(f'BFLive::record: dumped to {file}, crc32 = {checksum:08x}')
 
 
     def close(self):
         self.quad.set_rpm_worker_on(False)
         self.quad.set_arming(False)
+        if self.recorder is not None:
+            self.recorder.close()
 
 if __name__ == '__main__':
     # rpm_queue = [2000, 4000] + np.linspace(6000, 12000, 7).tolist()